@@ -64,14 +64,17 @@ class Radii(Table):
             self.db.commit()
             self.info_loger.write_to_log('is_new', 1)
 
-    def make_check_call_string(self, data_query, table_name, radii_count):
+    def make_check_call_string(self, data_query, table_name, radii_count, delta=False):
         check_call_string = './primary/calculate_radii ' \
                             '--dbpass="tttBBB777" ' \
                             '--output_table="'+self.radii_schema+'.' + table_name + '" ' \
                             '--data_query="' + data_query + '" ' \
+                            '--snapshot_table="' + self.get_snapshot_table(table_name) + '" ' \
                             '--threads=30 ' \
                             '--action=sum ' \
                             '--radii_count='+str(radii_count)
+        if delta:
+            check_call_string += ' --delta'
         self.info_loger.write_to_log('output_table', self.radii_schema + '.' + table_name)
         return check_call_string
 
@@ -114,6 +117,14 @@ class Radii(Table):
             data_query += ")"
         return data_query
 
+    def get_snapshot_table(self, table_name):
+        return self.radii_schema + '.' + table_name + '_points'
+
+    def snapshot_exists(self):
+        cur = self.db.cur
+        cur.execute("select to_regclass('" + self.get_snapshot_table(self.en_category) + "')")
+        return cur.fetchone()[0] is not None
+
     def get_objects_assembly_date(self):
         cur = self.db.cur
         cur.execute("select date "
@@ -177,7 +188,7 @@ class Radii(Table):
         ru_category = cur.fetchone()[0]
         return ru_category
 
-    def calculate_radii(self, parsing_date='last', data_query='auto', radii_count=30):
+    def calculate_radii(self, parsing_date='last', data_query='auto', radii_count=30, delta=False):
         cwd = os.getcwd()
         self.info_loger.write_to_log('function', 'calculate_radii')
         self.info_loger.write_to_log('category', self.en_category)
@@ -193,7 +204,7 @@ class Radii(Table):
                     data_query = self.make_data_query(self.elements, self.names,
                                                       self.elements_denial, self.names_denial)
                 
-                check_call_string = self.make_check_call_string(data_query, self.en_category, radii_count)
+                check_call_string = self.make_check_call_string(data_query, self.en_category, radii_count, delta)
                 self.info_loger.write_to_log('date_objects_assembly', date)
                 check_call([check_call_string], shell=True)
                 self.info_loger.write_to_log('done', True)
@@ -201,7 +212,10 @@ class Radii(Table):
             except Exception as e:
                 self.info_loger.write_to_log('error', str(e))
                 self.info_loger.push()
+                os.chdir(cwd)
+                return False
         os.chdir(cwd)
+        return True
 
     def sum_radii(self, radii_count=30, measurment_system='meter'):
         if measurment_system is 'meter':
@@ -239,7 +253,10 @@ class Radii(Table):
         if ((date_assembled != date_calculated) or recalc) & (self.en_category not in ('flats', 'stops17',
                                                                                        'actual_routes', 'all_objects',
                                                                                        'population','square_meter_price')):
-            self.calculate_radii(radii_count=radii_count)
+            # radii computed with a snapshot of their points are updated incrementally
+            delta = (not recalc) and self.snapshot_exists()
+            if not self.calculate_radii(radii_count=radii_count, delta=delta):
+                return 'Failed'
             self.sum_radii(radii_count)
             return 'Freshened'
         else:
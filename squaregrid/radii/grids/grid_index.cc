@@ -0,0 +1,124 @@
+#include "grid_index.h"
+
+#include <cmath>
+
+#include <algorithm>
+#include <vector>
+
+namespace grids {
+
+namespace {
+
+const int kMaxBucketsPerSide = 2048;
+
+}  // namespace
+
+using utils::GeoCoords;
+
+GridIndex::GridIndex(const std::vector<GridMetadata> &grids)
+		: grids_(grids), lat_min_(0), lng_min_(0), lat_step_(1), lng_step_(1),
+		  rows_(1), cols_(1) {
+	if (!grids_.empty()) {
+		float_t lat_max = grids_[0].GetLatMax(), lng_max = grids_[0].GetLngMax();
+		float_t lat_sum = 0, lng_sum = 0;
+		lat_min_ = grids_[0].GetLatMin();
+		lng_min_ = grids_[0].GetLngMin();
+		for (const auto &grid : grids_) {
+			lat_min_ = std::min(lat_min_, grid.GetLatMin());
+			lng_min_ = std::min(lng_min_, grid.GetLngMin());
+			lat_max = std::max(lat_max, grid.GetLatMax());
+			lng_max = std::max(lng_max, grid.GetLngMax());
+			lat_sum += grid.GetLatMax() - grid.GetLatMin();
+			lng_sum += grid.GetLngMax() - grid.GetLngMin();
+		}
+		// Buckets of an average grid's size keep every bucket short.
+		lat_step_ = std::max<float_t>(
+				lat_sum / grids_.size(), (lat_max - lat_min_) / kMaxBucketsPerSide);
+		lng_step_ = std::max<float_t>(
+				lng_sum / grids_.size(), (lng_max - lng_min_) / kMaxBucketsPerSide);
+		if (!(lat_step_ > 0)) lat_step_ = 1;
+		if (!(lng_step_ > 0)) lng_step_ = 1;
+		rows_ = std::min(
+				kMaxBucketsPerSide,
+				(int) std::floor((lat_max - lat_min_) / lat_step_) + 1);
+		cols_ = std::min(
+				kMaxBucketsPerSide,
+				(int) std::floor((lng_max - lng_min_) / lng_step_) + 1);
+	}
+	buckets_.resize(rows_ * cols_);
+	for (size_t i = 0; i < grids_.size(); ++i) {
+		int row_from = GetRow_(grids_[i].GetLatMin());
+		int row_to = GetRow_(grids_[i].GetLatMax());
+		int col_from = GetCol_(grids_[i].GetLngMin());
+		int col_to = GetCol_(grids_[i].GetLngMax());
+		for (int row = row_from; row <= row_to; ++row) {
+			for (int col = col_from; col <= col_to; ++col) {
+				buckets_[row * cols_ + col].push_back(i);
+			}
+		}
+	}
+}
+
+void GridIndex::FindGrids(const GeoCoords &c, std::vector<int> *result) const {
+	result->clear();
+	const std::vector<int> *bucket = GetBucket_(c);
+	if (bucket == nullptr) return;
+	for (int grid : *bucket) {
+		if (Contains_(grid, c.lat, c.lng)) result->push_back(grid);
+	}
+}
+
+int GridIndex::FindGrid(const GeoCoords &c) const {
+	const std::vector<int> *bucket = GetBucket_(c);
+	if (bucket == nullptr) return -1;
+	for (int grid : *bucket) {
+		if (Contains_(grid, c.lat, c.lng)) return grid;
+	}
+	return -1;
+}
+
+void GridIndex::Locate(
+		const float_t *lat, const float_t *lng, size_t count,
+		int *grid_ids, int *square_ids) const {
+	for (size_t i = 0; i < count; ++i) {
+		GeoCoords c(lat[i], lng[i]);
+		int grid = FindGrid(c);
+		if (grid == -1 || !grids_[grid].GetSquareId(c, &square_ids[i])) {
+			grid_ids[i] = square_ids[i] = -1;
+			continue;
+		}
+		grid_ids[i] = grids_[grid].GetId();
+	}
+}
+
+const std::vector<GridMetadata>& GridIndex::GetGrids() const {
+	return grids_;
+}
+
+int GridIndex::Size() const {
+	return grids_.size();
+}
+
+bool GridIndex::Contains_(int grid, float_t lat, float_t lng) const {
+	const GridMetadata &g = grids_[grid];
+	return (
+			g.GetLatMin() <= lat && lat <= g.GetLatMax() &&
+			g.GetLngMin() <= lng && lng <= g.GetLngMax());
+}
+
+int GridIndex::GetRow_(float_t lat) const {
+	int row = std::floor((lat - lat_min_) / lat_step_);
+	return std::max(0, std::min(row, rows_ - 1));
+}
+
+int GridIndex::GetCol_(float_t lng) const {
+	int col = std::floor((lng - lng_min_) / lng_step_);
+	return std::max(0, std::min(col, cols_ - 1));
+}
+
+const std::vector<int>* GridIndex::GetBucket_(const GeoCoords &c) const {
+	if (!std::isfinite(c.lat) || !std::isfinite(c.lng)) return nullptr;
+	return &buckets_[GetRow_(c.lat) * cols_ + GetCol_(c.lng)];
+}
+
+}  // namespace grids
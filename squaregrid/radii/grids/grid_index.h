@@ -0,0 +1,42 @@
+#pragma once
+
+#include <vector>
+
+#include "grids/grid_metadata.h"
+#include "utils/common.h"
+
+namespace grids {
+
+// Uniform lat/lng bucket index over grid bounding boxes. Every bucket lists
+// the grids whose bbox intersects it, in the order they were passed in.
+class GridIndex {
+	public:
+		explicit GridIndex(const std::vector<GridMetadata> &grids);
+
+		// Positions (in the constructor argument) of all grids whose bbox
+		// contains c, in increasing order.
+		void FindGrids(const utils::GeoCoords &c, std::vector<int> *result) const;
+		// Position of the first grid whose bbox contains c, -1 if there is none.
+		int FindGrid(const utils::GeoCoords &c) const;
+		// Grid ids and square ids of count points, the grid being the one
+		// FindGrid returns. Points outside all the grids get -1 for both.
+		void Locate(
+				const float_t *lat, const float_t *lng, size_t count,
+				int *grid_ids, int *square_ids) const;
+
+		const std::vector<GridMetadata>& GetGrids() const;
+		int Size() const;
+
+	private:
+		std::vector<GridMetadata> grids_;
+		float_t lat_min_, lng_min_, lat_step_, lng_step_;
+		int rows_, cols_;
+		std::vector< std::vector<int> > buckets_;
+
+		bool Contains_(int grid, float_t lat, float_t lng) const;
+		int GetRow_(float_t lat) const;
+		int GetCol_(float_t lng) const;
+		const std::vector<int>* GetBucket_(const utils::GeoCoords &c) const;
+};
+
+}  // namespace grids
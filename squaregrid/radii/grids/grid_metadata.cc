@@ -105,20 +105,7 @@ bool GridMetadata::GetSquareId(const GeoCoords &c, int *id) const {
 		int y = std::floor((lng - lng_bbox_[0]) / lng_step_);
 		x = std::min(x, side_ * 2 - 1);
 		y = std::min(y, side_ * 2 - 1);
-		int dx = x - side_, dy = y - side_;
-		int r = std::max({-dx, dx + 1, -dy, dy + 1});
-		*id = 4 * (r - 1) * (r - 1);
-		if (dy == -r) {
-			*id += (dx + r);
-		} else if (dx == r - 1) {
-			*id += (2 * r + dy + r - 1);
-		} else if (dy == r - 1) {
-			*id += (4 * r - 1 + (r - 2 - dx));
-		} else if (dx == -r) {
-			*id += (6 * r - 2 + (r - 2 - dy));
-		} else {
-			assert(false);
-		}
+		*id = GetCellId(x, y, side_);
 	}
 	return true;
 }
@@ -141,36 +128,131 @@ bool GridMetadata::GetSquareCoords(const GeoCoords &c, int *x, int *y) const {
 	return true;
 }
 
-std::vector< std::pair<int, int> > EnumerateGridCells(int side) {
-	std::vector< std::pair<int, int> > res;
-	for (int r = 1; r <= side; ++r) {
-		int dx = -r, dy = -r;
-		const int dir[4][2] = {{1, 0}, {0, 1}, {-1, 0}, {0, -1}};
-		for (int j = 0; j < 4; ++j) {
-			while (true) {
-				if (j == 3 && dx == -r && dy == -r) break;
-				if (!res.size() ||
-						res.back().first != side + dx ||
-						res.back().second != side + dy) {
-					res.emplace_back(side + dx, side + dy);
-				}
-				dx += dir[j][0], dy += dir[j][1];
-				if (std::max({-dx, dx + 1, -dy, dy + 1}) != r) {
-					dx -= dir[j][0], dy -= dir[j][1];
-					break;
-				}
-			}
+int GetCellId(int x, int y, int side) {
+	int dx = x - side, dy = y - side;
+	int r = std::max({-dx, dx + 1, -dy, dy + 1});
+	int id = 4 * (r - 1) * (r - 1);
+	if (dy == -r) {
+		id += (dx + r);
+	} else if (dx == r - 1) {
+		id += (2 * r + dy + r - 1);
+	} else if (dy == r - 1) {
+		id += (4 * r - 1 + (r - 2 - dx));
+	} else if (dx == -r) {
+		id += (6 * r - 2 + (r - 2 - dy));
+	} else {
+		assert(false);
+	}
+	return id;
+}
+
+namespace {
+
+// Ring of the spiral id, 1 for the central four cells.
+inline int _GetCellRing(int id) {
+	int root = std::sqrt((double) id);
+	while (root * root > id) --root;
+	while ((root + 1) * (root + 1) <= id) ++root;
+	return root / 2 + 1;
+}
+
+// The bin numeration walks rings in the opposite direction.
+inline int _ReflectInRing(int id) {
+	int r = _GetCellRing(id);
+	int first = 4 * (r - 1) * (r - 1), k = id - first;
+	return first + (k <= 6 * r - 3 ? 6 * r - 3 - k : 14 * r - 7 - k);
+}
+
+inline int _ToSpiralId(int id, int side, CellNumeration numeration) {
+	switch (numeration) {
+		case CellNumeration::kLegacy:
+			return GetCellId(id / (2 * side), id % (2 * side), side);
+		case CellNumeration::kBin:
+			return _ReflectInRing(id - 1);
+		default:
+			return id;
+	}
+}
+
+inline int _FromSpiralId(int id, int side, CellNumeration numeration) {
+	switch (numeration) {
+		case CellNumeration::kLegacy: {
+			int x, y;
+			GetCellCoords(id, side, &x, &y);
+			return x * 2 * side + y;
+		}
+		case CellNumeration::kBin:
+			return _ReflectInRing(id) + 1;
+		default:
+			return id;
+	}
+}
+
+}  // namespace
+
+void GetCellCoords(int id, int side, int *x, int *y) {
+	int r = _GetCellRing(id);
+	int k = id - 4 * (r - 1) * (r - 1);
+	int dx, dy;
+	if (k < 2 * r) {
+		dx = k - r, dy = -r;
+	} else if (k < 4 * r - 1) {
+		dx = r - 1, dy = k - 3 * r + 1;
+	} else if (k < 6 * r - 2) {
+		dx = 5 * r - 3 - k, dy = r - 1;
+	} else {
+		dx = -r, dy = 7 * r - 4 - k;
+	}
+	*x = side + dx;
+	*y = side + dy;
+}
+
+void GetCellIds(
+		const int *x, const int *y, size_t count, int side,
+		CellNumeration numeration, int *ids) {
+	for (size_t i = 0; i < count; ++i) {
+		ids[i] = (
+				numeration == CellNumeration::kLegacy ?
+				x[i] * 2 * side + y[i] :
+				_FromSpiralId(GetCellId(x[i], y[i], side), side, numeration));
+	}
+}
+
+void GetCellsCoords(
+		const int *ids, size_t count, int side,
+		CellNumeration numeration, int *x, int *y) {
+	for (size_t i = 0; i < count; ++i) {
+		if (numeration == CellNumeration::kLegacy) {
+			x[i] = ids[i] / (2 * side);
+			y[i] = ids[i] % (2 * side);
+		} else {
+			GetCellCoords(_ToSpiralId(ids[i], side, numeration), side, &x[i], &y[i]);
 		}
 	}
-	assert((int) res.size() == 4 * side * side);
+}
+
+void ConvertCellIds(
+		const int *ids, size_t count, int side,
+		CellNumeration from, CellNumeration to, int *result) {
+	for (size_t i = 0; i < count; ++i) {
+		result[i] = _FromSpiralId(_ToSpiralId(ids[i], side, from), side, to);
+	}
+}
+
+std::vector< std::pair<int, int> > EnumerateGridCells(int side) {
+	std::vector< std::pair<int, int> > res(4 * side * side);
+	for (size_t id = 0; id < res.size(); ++id) {
+		GetCellCoords(id, side, &res[id].first, &res[id].second);
+	}
 	return res;
 }
 
 std::vector< std::vector<int> > GetGridCellsIds(int side) {
 	std::vector< std::vector<int> > res(2 * side, std::vector<int>(2 * side));
-	auto cells = EnumerateGridCells(side);
-	for (size_t i = 0; i < cells.size(); ++i) {
-		res[cells[i].first][cells[i].second] = i;
+	for (int x = 0; x < 2 * side; ++x) {
+		for (int y = 0; y < 2 * side; ++y) {
+			res[x][y] = GetCellId(x, y, side);
+		}
 	}
 	return res;
 }
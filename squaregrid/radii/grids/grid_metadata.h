@@ -42,6 +42,31 @@ class GridMetadata {
 		std::string region_, town_;
 };
 
+// Numerations of the cells of a 2 * side grid: spiral ids start at the
+// centre, legacy ids are row-major and bin ids are the spiral ids of the bin
+// system, which go around every ring the other way and start at 1.
+enum class CellNumeration {
+	kSpiral,
+	kLegacy,
+	kBin,
+};
+
+// Id of the cell (x, y) in the spiral numeration of a 2 * side grid.
+int GetCellId(int x, int y, int side);
+// Inverse of GetCellId.
+void GetCellCoords(int id, int side, int *x, int *y);
+
+// Closed form batch conversions, none of them builds per grid tables.
+void GetCellIds(
+		const int *x, const int *y, size_t count, int side,
+		CellNumeration numeration, int *ids);
+void GetCellsCoords(
+		const int *ids, size_t count, int side,
+		CellNumeration numeration, int *x, int *y);
+void ConvertCellIds(
+		const int *ids, size_t count, int side,
+		CellNumeration from, CellNumeration to, int *result);
+
 std::vector< std::pair<int, int> > EnumerateGridCells(int side);
 std::vector< std::vector<int> > GetGridCellsIds(int side);
 std::vector<GridMetadata> LoadGridMetadata(pqxx::connection *db_conn);
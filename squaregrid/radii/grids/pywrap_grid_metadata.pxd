@@ -11,8 +11,8 @@ cdef extern from "grids/grid_metadata.h" namespace "grids":
 				float_t, float_t, float_t, float_t, float_t, float_t,
 				int, string, string, int)
 
-		bool_t GetSquareId(const GeoCoords&, int*)
-		bool_t GetSquareCoords(const GeoCoords&, int*, int*)
+		bool_t GetSquareId(const GeoCoords&, int*) nogil
+		bool_t GetSquareCoords(const GeoCoords&, int*, int*) nogil
 		string GetName()
 
 		int GetId()
@@ -27,8 +27,32 @@ cdef extern from "grids/grid_metadata.h" namespace "grids":
 		pair[float_t, float_t] GetNWCorner(int, int)
 		pair[float_t, float_t] GetCenter(int, int)
 
+	ctypedef enum CellNumeration "grids::CellNumeration":
+		kSpiral "grids::CellNumeration::kSpiral"
+		kLegacy "grids::CellNumeration::kLegacy"
+		kBin "grids::CellNumeration::kBin"
+
+	cdef int GetCellId(int, int, int)
+	cdef void GetCellCoords(int, int, int*, int*)
+	cdef void GetCellIds(
+			const int*, const int*, size_t, int, CellNumeration, int*) nogil
+	cdef void GetCellsCoords(
+			const int*, size_t, int, CellNumeration, int*, int*) nogil
+	cdef void ConvertCellIds(
+			const int*, size_t, int, CellNumeration, CellNumeration, int*) nogil
 	cdef vector[pair[int, int]] EnumerateGridCells(int)
 	cdef vector[vector[int]] GetGridCellsIds(int)
 
+cdef extern from "grids/grid_index.h" namespace "grids":
+	cdef cppclass GridIndex:
+		GridIndex(const vector[GridMetadata]&)
+
+		int FindGrid(const GeoCoords&)
+		void Locate(const float_t*, const float_t*, size_t, int*, int*) nogil
+		int Size()
+
 cdef class PywrapGridMetadata:
 	cdef GridMetadata* c_grid
+
+cdef class PywrapGridIndex:
+	cdef GridIndex* c_index
@@ -1,9 +1,13 @@
-from grids.pywrap_grid_metadata cimport GridMetadata
+from grids.pywrap_grid_metadata cimport CellNumeration, GridIndex, GridMetadata
+from grids.pywrap_grid_metadata cimport ConvertCellIds, GetCellIds, GetCellsCoords
+from grids.pywrap_grid_metadata cimport kBin, kLegacy, kSpiral
 from utils.pywrap_common cimport GeoCoords
 
 from libcpp.string cimport string
+from libcpp.vector cimport vector
 
 import logging
+import numpy
 
 cdef class PywrapGridMetadata:
 	def __cinit__(
@@ -33,6 +37,92 @@ cdef class PywrapGridMetadata:
 		return self.c_grid.GetId()
 
 
+cdef class PywrapGridIndex:
+	def __cinit__(self, grids):
+		cdef vector[GridMetadata] c_grids
+		cdef PywrapGridMetadata grid
+		for grid in grids:
+			c_grids.push_back(grid.c_grid[0])
+		self.c_index = new GridIndex(c_grids)
+
+	def __dealloc__(self):
+		del self.c_index
+
+	def locate(self, lat, lng):
+		"""Returns grid ids and square ids of the points as int32 arrays,
+		-1 for points outside all the grids."""
+		cdef float_t[::1] c_lat = numpy.ascontiguousarray(lat, dtype=numpy.float32)
+		cdef float_t[::1] c_lng = numpy.ascontiguousarray(lng, dtype=numpy.float32)
+		if c_lat.shape[0] != c_lng.shape[0]:
+			raise ValueError('lat and lng differ in length')
+		grid_ids = numpy.empty(c_lat.shape[0], dtype=numpy.int32)
+		square_ids = numpy.empty(c_lat.shape[0], dtype=numpy.int32)
+		cdef int[::1] c_grid_ids = grid_ids
+		cdef int[::1] c_square_ids = square_ids
+		if c_lat.shape[0] > 0:
+			with nogil:
+				self.c_index.Locate(
+						&c_lat[0], &c_lng[0], c_lat.shape[0],
+						&c_grid_ids[0], &c_square_ids[0])
+		return grid_ids, square_ids
+
+
+cdef CellNumeration _ParseNumeration(numeration) except *:
+	if numeration == 'spiral':
+		return kSpiral
+	if numeration == 'legacy':
+		return kLegacy
+	if numeration == 'bin':
+		return kBin
+	raise ValueError('Unknown cell numeration %s' % numeration)
+
+
+def cell_ids(x, y, int side, numeration='spiral'):
+	"""Ids of the cells (x, y) of a 2 * side grid as an int32 array.
+	numeration is one of 'spiral', 'legacy' and 'bin'."""
+	cdef CellNumeration c_numeration = _ParseNumeration(numeration)
+	cdef int[::1] c_x = numpy.ascontiguousarray(x, dtype=numpy.int32)
+	cdef int[::1] c_y = numpy.ascontiguousarray(y, dtype=numpy.int32)
+	if c_x.shape[0] != c_y.shape[0]:
+		raise ValueError('x and y differ in length')
+	ids = numpy.empty(c_x.shape[0], dtype=numpy.int32)
+	cdef int[::1] c_ids = ids
+	if c_x.shape[0] > 0:
+		with nogil:
+			GetCellIds(
+					&c_x[0], &c_y[0], c_x.shape[0], side, c_numeration, &c_ids[0])
+	return ids
+
+
+def cell_coords(ids, int side, numeration='spiral'):
+	"""Inverse of cell_ids, returns (x, y) int32 arrays."""
+	cdef CellNumeration c_numeration = _ParseNumeration(numeration)
+	cdef int[::1] c_ids = numpy.ascontiguousarray(ids, dtype=numpy.int32)
+	x = numpy.empty(c_ids.shape[0], dtype=numpy.int32)
+	y = numpy.empty(c_ids.shape[0], dtype=numpy.int32)
+	cdef int[::1] c_x = x
+	cdef int[::1] c_y = y
+	if c_ids.shape[0] > 0:
+		with nogil:
+			GetCellsCoords(
+					&c_ids[0], c_ids.shape[0], side, c_numeration, &c_x[0], &c_y[0])
+	return x, y
+
+
+def convert_cell_ids(ids, int side, from_numeration, to_numeration):
+	"""Converts cell ids of a 2 * side grid between numerations."""
+	cdef CellNumeration c_from = _ParseNumeration(from_numeration)
+	cdef CellNumeration c_to = _ParseNumeration(to_numeration)
+	cdef int[::1] c_ids = numpy.ascontiguousarray(ids, dtype=numpy.int32)
+	result = numpy.empty(c_ids.shape[0], dtype=numpy.int32)
+	cdef int[::1] c_result = result
+	if c_ids.shape[0] > 0:
+		with nogil:
+			ConvertCellIds(
+					&c_ids[0], c_ids.shape[0], side, c_from, c_to, &c_result[0])
+	return result
+
+
 def LoadGridsMetadata(engine):
 	sql_query = (
 		"SELECT city_id, latmin, latmax, longmin, longmax, latstep, "
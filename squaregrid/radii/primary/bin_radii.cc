@@ -75,7 +75,7 @@ int main(int argc, char **argv) {
 					FLAGS_data_query, FLAGS_output_table,
 					FLAGS_radii_count,
 					FLAGS_exclude_most_common, FLAGS_tolerance,
-					FLAGS_threads);
+					FLAGS_threads, FLAGS_threads);
 		} else {
 			processing::CreateRadiiTableFromSQLConcurrently<
 				int, utils::Averager<float_t> >(
@@ -83,7 +83,7 @@ int main(int argc, char **argv) {
 					FLAGS_data_query, FLAGS_output_table,
 					FLAGS_radii_count,
 					FLAGS_exclude_most_common, FLAGS_tolerance,
-					FLAGS_threads);
+					FLAGS_threads, FLAGS_threads);
 		}
 
 		LOG(DEBUG) << "All jobs are finished";
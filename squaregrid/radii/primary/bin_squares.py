@@ -1,32 +1,20 @@
+from grids.pywrap_grid_metadata import convert_cell_ids
+
+import numpy
+
+
+def _convert(square_id, from_numeration, to_numeration):
+	# bin ids do not depend on the grid size
+	result = convert_cell_ids(
+			numpy.atleast_1d(square_id), 0, from_numeration, to_numeration)
+	return int(result[0]) if numpy.ndim(square_id) == 0 else result
+
+
 def bin_to_our(square_id):
-	square_id -= 1
-	r = int(square_id ** 0.5 + 1e-8) // 2
-	num = square_id - (2 * r) ** 2
-	l = r + 1
-	# if num <= 2 * l - 1:
-	#   num = 2 * l - 1 - num + (4 * l - 2)
-	# elif num <= 4 * l - 2:
-	#   num = 4 * l - 2 - num + (2 * l - 1)
-	if num <= 6 * l - 3:
-		num = 6 * l - 3 - num
-	elif num <= 8 * l - 5:
-		num = 8 * l - 5 - num + (6 * l - 2)
-	else:
-		assert(False)
-	return (2 * r) ** 2 + num
+	"""Spiral id of a bin square id, works on scalars and arrays."""
+	return _convert(square_id, 'bin', 'spiral')
+
 
 def our_to_bin(square_id):
-	r = int(square_id ** 0.5 + 1e-8) // 2
-	num = square_id - (2 * r) ** 2
-	l = r + 1
-	# if num <= 2 * l - 1:
-	#   num = 2 * l - 1 - num + (4 * l - 2)
-	# elif num <= 4 * l - 2:
-	#   num = 4 * l - 2 - num + (2 * l - 1)
-	if num <= 6 * l - 3:
-		num = 6 * l - 3 - num
-	elif num <= 8 * l - 5:
-		num = 8 * l - 5 - num + (6 * l - 2)
-	else:
-		assert(False)
-	return (2 * r) ** 2 + num + 1
+	"""Bin id of a spiral square id, works on scalars and arrays."""
+	return _convert(square_id, 'spiral', 'bin')
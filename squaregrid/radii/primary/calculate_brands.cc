@@ -133,7 +133,7 @@ int main(int argc, char **argv) {
 						data_query, output_table,
 						FLAGS_radii_count,
 						FLAGS_exclude_most_common, FLAGS_tolerance,
-						FLAGS_threads);
+						FLAGS_threads, FLAGS_threads);
 			}
 		}
 
@@ -11,6 +11,7 @@
 #include <pqxx/tablewriter>
 #include <easylogging++.h>
 
+#include "processing/radii_update.h"
 #include "processing/table_creation.h"
 #include "utils/common.h"
 #include "utils/helpers.h"
@@ -19,6 +20,15 @@ static bool ValidateNonEmpty(const char*, const std::string &value) {
 	return !value.empty();
 }
 
+static bool ValidateNonNegative(const char*, int32_t value) {
+	return value >= 0;
+}
+
+static bool ValidateRadiiEngine(const char*, const std::string &value) {
+	processing::RadiiEngine engine;
+	return processing::ParseRadiiEngine(value, &engine);
+}
+
 static bool ValidateAction(const char*, const std::string &value) {
 	return value == "sum" || value == "average";
 }
@@ -32,7 +42,6 @@ DEFINE_string(dbpass, "", "database password");
 DEFINE_validator(dbpass, &ValidateNonEmpty);
 
 DEFINE_string(data_query, "", "SQL-query");
-DEFINE_validator(data_query, &ValidateNonEmpty);
 DEFINE_string(output_table, "", "Output table name");
 DEFINE_validator(output_table, &ValidateNonEmpty);
 DEFINE_string(
@@ -45,8 +54,42 @@ DEFINE_bool(exclude_most_common, false,
 DEFINE_double(tolerance, 1e-6, "Tolerance to match most common points");
 
 DEFINE_int32(threads, 1, "Number of threads to use");
+DEFINE_int32(
+		compute_threads, 0,
+		"Number of threads summing radii, 0 means --threads");
+DEFINE_validator(compute_threads, &ValidateNonNegative);
+DEFINE_int32(
+		writer_threads, 0,
+		"Number of threads writing radii to DB, 0 means --threads");
+DEFINE_validator(writer_threads, &ValidateNonNegative);
+DEFINE_int32(
+		band_rows, 0,
+		"Compute and write radii in bands of this many grid rows to bound "
+		"memory, 0 means whole grids");
+DEFINE_validator(band_rows, &ValidateNonNegative);
+DEFINE_string(
+		radii_engine, "auto",
+		"Algorithm used to sum values in radii. "
+		"Possible values: auto, stencil, prefix_sums, fft");
+DEFINE_validator(radii_engine, &ValidateRadiiEngine);
 DEFINE_int32(radii_count, 30, "Number of radii to calculate");
 
+DEFINE_string(
+		snapshot_table, "",
+		"If set, the points of data_query are kept in this table, so that "
+		"later runs with --delta can update output_table incrementally");
+DEFINE_bool(
+		delta, false,
+		"Update output_table with the difference between data_query and "
+		"snapshot_table instead of recomputing it. Only for --action=sum");
+DEFINE_string(
+		added_query, "",
+		"SQL-query of points added since output_table was computed. "
+		"Together with removed_query replaces data_query in delta mode");
+DEFINE_string(
+		removed_query, "",
+		"SQL-query of points removed since output_table was computed");
+
 std::string GetConnectionString() {
 	std::string connection_string;
 	connection_string += "host=" + FLAGS_dbhost;
@@ -62,26 +105,88 @@ int main(int argc, char **argv) {
 	el::Loggers::reconfigureAllLoggers(el::ConfigurationType::Filename,
 			"logs/calculate_radii_objects.log");
 	gflags::ParseCommandLineFlags(&argc, &argv, true);
+	processing::RadiiEngine engine;
+	processing::ParseRadiiEngine(FLAGS_radii_engine, &engine);
+	int compute_threads = FLAGS_compute_threads ? FLAGS_compute_threads : FLAGS_threads;
+	int writer_threads = FLAGS_writer_threads ? FLAGS_writer_threads : FLAGS_threads;
+
+	bool explicit_delta = !FLAGS_added_query.empty() || !FLAGS_removed_query.empty();
+	if (FLAGS_data_query.empty() && !explicit_delta) {
+		LOG(ERROR) << "Either --data_query or --added_query/--removed_query is required";
+		return 1;
+	}
+	if ((FLAGS_delta || explicit_delta) &&
+			(FLAGS_action != "sum" || FLAGS_exclude_most_common)) {
+		LOG(ERROR) << "Delta updates support only --action=sum "
+		           << "without --exclude_most_common";
+		return 1;
+	}
+	if (FLAGS_delta && FLAGS_snapshot_table.empty() && !explicit_delta) {
+		LOG(ERROR) << "--delta requires --snapshot_table";
+		return 1;
+	}
 
 	try {
 		pqxx::connection db_conn(GetConnectionString());
 		std::vector<grids::GridMetadata> grids = grids::LoadGridMetadata(&db_conn);
 
-		if (FLAGS_action == "sum") {
-			processing::CreateRadiiTableFromSQLConcurrently<int, int>(
+		bool delta = FLAGS_delta && !explicit_delta;
+		if (delta && !processing::CanUpdateFromSnapshot(
+					GetConnectionString(), FLAGS_snapshot_table, FLAGS_output_table,
+					FLAGS_radii_count)) {
+			LOG(WARNING) << FLAGS_output_table << " cannot be updated from "
+			             << FLAGS_snapshot_table << " with " << FLAGS_radii_count
+			             << " radii, recomputing it";
+			delta = false;
+		}
+
+		bool ok;
+		if (explicit_delta) {
+			ok = processing::UpdateRadiiTableFromSQL(
 					GetConnectionString(), grids,
-					FLAGS_data_query, FLAGS_output_table,
+					FLAGS_added_query, FLAGS_removed_query, FLAGS_output_table,
+					FLAGS_radii_count);
+		} else if (delta) {
+			ok = processing::UpdateRadiiTableFromSnapshot(
+					GetConnectionString(), grids,
+					FLAGS_data_query, FLAGS_snapshot_table, FLAGS_output_table,
+					FLAGS_radii_count);
+		} else if (FLAGS_action == "sum") {
+			// the snapshot is replaced only once the radii computed from it are
+			// written, see CommitSnapshot
+			std::string data_query = FLAGS_data_query;
+			if (!FLAGS_snapshot_table.empty()) {
+				std::string fresh = processing::FreshSnapshotTable(FLAGS_snapshot_table);
+				processing::SaveSnapshot(GetConnectionString(), FLAGS_data_query, fresh);
+				data_query = "SELECT * FROM " + fresh;
+			}
+			ok = processing::CreateRadiiTableFromSQLConcurrently<int, int>(
+					GetConnectionString(), grids,
+					data_query, FLAGS_output_table,
 					FLAGS_radii_count,
 					FLAGS_exclude_most_common, FLAGS_tolerance,
-					FLAGS_threads);
+					compute_threads, writer_threads, engine,
+					processing::kDefaultQueueDepth, FLAGS_band_rows);
+			if (!FLAGS_snapshot_table.empty()) {
+				if (ok) {
+					processing::CommitSnapshot(GetConnectionString(), FLAGS_snapshot_table);
+				} else {
+					processing::DropSnapshot(GetConnectionString(), FLAGS_snapshot_table);
+				}
+			}
 		} else {
-			processing::CreateRadiiTableFromSQLConcurrently<
+			ok = processing::CreateRadiiTableFromSQLConcurrently<
 				int, utils::Averager<float_t> >(
 					GetConnectionString(), grids,
 					FLAGS_data_query, FLAGS_output_table,
 					FLAGS_radii_count,
 					FLAGS_exclude_most_common, FLAGS_tolerance,
-					FLAGS_threads);
+					compute_threads, writer_threads, engine,
+					processing::kDefaultQueueDepth, FLAGS_band_rows);
+		}
+		if (!ok) {
+			LOG(ERROR) << FLAGS_output_table << " was not written completely";
+			return 1;
 		}
 
 		LOG(DEBUG) << "All jobs are finished";
@@ -19,6 +19,15 @@ static bool ValidateNonEmpty(const char*, const std::string &value) {
 	return !value.empty();
 }
 
+static bool ValidateNonNegative(const char*, int32_t value) {
+	return value >= 0;
+}
+
+static bool ValidateRadiiEngine(const char*, const std::string &value) {
+	processing::RadiiEngine engine;
+	return processing::ParseRadiiEngine(value, &engine);
+}
+
 static bool ValidateAction(const char*, const std::string &value) {
 	return value == "sum" || value == "average";
 }
@@ -45,6 +54,24 @@ DEFINE_bool(exclude_most_common, false,
 DEFINE_double(tolerance, 1e-6, "Tolerance to match most common points");
 
 DEFINE_int32(threads, 1, "Number of threads to use");
+DEFINE_int32(
+		compute_threads, 0,
+		"Number of threads summing radii, 0 means --threads");
+DEFINE_validator(compute_threads, &ValidateNonNegative);
+DEFINE_int32(
+		writer_threads, 0,
+		"Number of threads writing radii to DB, 0 means --threads");
+DEFINE_validator(writer_threads, &ValidateNonNegative);
+DEFINE_int32(
+		band_rows, 0,
+		"Compute and write radii in bands of this many grid rows to bound "
+		"memory, 0 means whole grids");
+DEFINE_validator(band_rows, &ValidateNonNegative);
+DEFINE_string(
+		radii_engine, "auto",
+		"Algorithm used to sum values in radii. "
+		"Possible values: auto, stencil, prefix_sums, fft");
+DEFINE_validator(radii_engine, &ValidateRadiiEngine);
 DEFINE_int32(radii_count, 30, "Number of radii to calculate");
 
 std::string GetConnectionString() {
@@ -62,6 +89,10 @@ int main(int argc, char **argv) {
 	el::Loggers::reconfigureAllLoggers(el::ConfigurationType::Filename,
 			"logs/calculate_radii_objects.log");
 	gflags::ParseCommandLineFlags(&argc, &argv, true);
+	processing::RadiiEngine engine;
+	processing::ParseRadiiEngine(FLAGS_radii_engine, &engine);
+	int compute_threads = FLAGS_compute_threads ? FLAGS_compute_threads : FLAGS_threads;
+	int writer_threads = FLAGS_writer_threads ? FLAGS_writer_threads : FLAGS_threads;
 
 	try {
 		pqxx::connection db_conn(
@@ -74,7 +105,8 @@ int main(int argc, char **argv) {
 					FLAGS_data_query, FLAGS_output_table,
 					FLAGS_radii_count,
 					FLAGS_exclude_most_common, FLAGS_tolerance,
-					FLAGS_threads);
+					compute_threads, writer_threads, engine,
+					processing::kDefaultQueueDepth, FLAGS_band_rows);
 		} else {
 			processing::CreateRadiiTableFromSQLConcurrently<
 				int, utils::Averager<float_t> >(
@@ -82,7 +114,8 @@ int main(int argc, char **argv) {
 					FLAGS_data_query, FLAGS_output_table,
 					FLAGS_radii_count,
 					FLAGS_exclude_most_common, FLAGS_tolerance,
-					FLAGS_threads);
+					compute_threads, writer_threads, engine,
+					processing::kDefaultQueueDepth, FLAGS_band_rows);
 		}
 
 		LOG(DEBUG) << "All jobs are finished";
@@ -13,12 +13,22 @@
 #include <easylogging++.h>
 
 #include "grids/grid_metadata.h"
+#include "processing/radii_jobs.h"
 #include "processing/table_creation.h"
 
 static bool ValidateNonEmpty(const char*, const std::string &value) {
 	return !value.empty();
 }
 
+static bool ValidateNonNegative(const char*, int32_t value) {
+	return value >= 0;
+}
+
+static bool ValidateRadiiEngine(const char*, const std::string &value) {
+	processing::RadiiEngine engine;
+	return processing::ParseRadiiEngine(value, &engine);
+}
+
 DEFINE_string(dbhost, "127.0.0.1", "Address of DB to connect");
 DEFINE_validator(dbhost, &ValidateNonEmpty);
 DEFINE_int32(dbport, 5432, "Port where DB is serving");
@@ -28,11 +38,44 @@ DEFINE_string(dbpass, "", "database password");
 DEFINE_validator(dbpass, &ValidateNonEmpty);
 
 DEFINE_int32(threads, 1, "Number of threads to use");
+DEFINE_int32(
+		compute_threads, 0,
+		"Number of threads summing radii, 0 means --threads");
+DEFINE_validator(compute_threads, &ValidateNonNegative);
+DEFINE_int32(
+		writer_threads, 0,
+		"Number of threads writing radii to DB, 0 means --threads");
+DEFINE_validator(writer_threads, &ValidateNonNegative);
+DEFINE_int32(
+		band_rows, 0,
+		"Compute and write radii in bands of this many grid rows to bound "
+		"memory, 0 means whole grids");
+DEFINE_validator(band_rows, &ValidateNonNegative);
+DEFINE_string(
+		radii_engine, "auto",
+		"Algorithm used to sum values in radii. "
+		"Possible values: auto, stencil, prefix_sums, fft");
+DEFINE_validator(radii_engine, &ValidateRadiiEngine);
 DEFINE_int32(radii_count, 30, "Number of radii to calculate");
 DEFINE_bool(exclude_most_common, false,
 		"If set, do not count most common square");
 DEFINE_double(tolerance, 1e-6, "Tolerance to match most common points");
 
+DEFINE_int32(
+		layers_per_pass, 0,
+		"If positive, fetch all rubrics with one query and compute radii for "
+		"this many rubrics per pass over each grid");
+DEFINE_validator(layers_per_pass, &ValidateNonNegative);
+
+DEFINE_string(
+		jobs_table, "",
+		"If set, compute rubric radii grid by grid as jobs of this table, "
+		"which any number of processes may run concurrently and resume "
+		"after a failure");
+DEFINE_bool(
+		schedule_jobs, false,
+		"Recreate --jobs_table and the rubric tables before running the jobs");
+
 DEFINE_int32(lbound, 0,
 		"Left bound in alphabetically sorted rubric list");
 DEFINE_int32(rbound, -1,
@@ -69,11 +112,59 @@ std::string QueryObjectsByRubric(
 	return query;
 }
 
+// Objects of the rubric inside the bbox of the grid.
+std::string QueryObjectsByRubric(
+		pqxx::connection *conn,
+		const std::string &rubric,
+		const grids::GridMetadata &grid) {
+	// points on the bbox border are kept despite the rounding of bounds
+	const float_t kMargin = 1e-4;
+	std::string query = QueryObjectsByRubric(conn, rubric);
+	query.pop_back();
+	query += (
+			" AND lat BETWEEN " + std::to_string(grid.GetLatMin() - kMargin) +
+			" AND " + std::to_string(grid.GetLatMax() + kMargin) +
+			" AND lon BETWEEN " + std::to_string(grid.GetLngMin() - kMargin) +
+			" AND " + std::to_string(grid.GetLngMax() + kMargin) + ";");
+	return query;
+}
+
+// Objects of all the rubrics as (lat, lon, layer) rows, layer being the
+// index of the rubric in the list.
+std::string QueryObjectsByRubrics(
+		pqxx::connection *conn,
+		const std::vector<std::string> &rubrics) {
+	pqxx::work trans(*conn);
+	std::string layers;
+	for (size_t i = 0; i < rubrics.size(); ++i) {
+		layers += (i ? ", (" : "(") + trans.quote(rubrics[i]) + ", ";
+		layers += std::to_string(i) + ")";
+	}
+	const std::string query = (
+			"SELECT DISTINCT ON (yandex_objects.organization.id, layers.layer_id)"
+			" lat, lon, layers.layer_id"
+			" FROM yandex_objects.organization"
+			" LEFT JOIN yandex_objects.organization_rubric ON"
+			" organization_rubric.organization_id = organization.id"
+			" LEFT JOIN yandex_objects.rubric ON"
+			" rubric.id = organization_rubric.rubric_id"
+			" JOIN (VALUES " + layers + ") AS layers (name, layer_id) ON"
+			" layers.name = rubric.name"
+			" WHERE lat IS NOT NULL AND lon IS NOT NULL"
+			" AND gc_accuracy IN ('house')"
+			" AND updated in ('1','2');");
+	return query;
+}
+
 int main(int argc, char **argv) {
 	START_EASYLOGGINGPP(argc, argv);
 	el::Loggers::reconfigureAllLoggers(el::ConfigurationType::Filename,
 			"logs/calculate_radii_objects.log");
 	gflags::ParseCommandLineFlags(&argc, &argv, true);
+	processing::RadiiEngine engine;
+	processing::ParseRadiiEngine(FLAGS_radii_engine, &engine);
+	int compute_threads = FLAGS_compute_threads ? FLAGS_compute_threads : FLAGS_threads;
+	int writer_threads = FLAGS_writer_threads ? FLAGS_writer_threads : FLAGS_threads;
 
 	try {
 		pqxx::connection db_conn(GetConnectionString());
@@ -107,6 +198,48 @@ int main(int argc, char **argv) {
 		if (FLAGS_rbound == -1 || FLAGS_rbound > (int) rubrics.size())
 			FLAGS_rbound = rubrics.size();
 
+		if (!FLAGS_jobs_table.empty()) {
+			if (FLAGS_schedule_jobs) {
+				std::vector<std::string> names, output_tables;
+				for (int i = FLAGS_lbound; i < FLAGS_rbound; ++i) {
+					names.push_back(rubrics[i].first);
+					output_tables.push_back("radii." + rubrics[i].second);
+				}
+				processing::ScheduleRadiiJobs(
+						GetConnectionString(), grids, FLAGS_jobs_table,
+						QueryObjectsByRubrics(&db_conn, names),
+						[&](int layer, const grids::GridMetadata &grid) {
+							return QueryObjectsByRubric(&db_conn, names[layer], grid);
+						},
+						output_tables, FLAGS_radii_count);
+			}
+			processing::RunRadiiJobs(
+					GetConnectionString(), grids, FLAGS_jobs_table, FLAGS_radii_count,
+					FLAGS_exclude_most_common, FLAGS_tolerance,
+					compute_threads, engine);
+			LOG(DEBUG) << "All jobs are finished";
+			return 0;
+		}
+
+		if (FLAGS_layers_per_pass > 0) {
+			std::vector<std::string> names, output_tables;
+			for (int i = FLAGS_lbound; i < FLAGS_rbound; ++i) {
+				names.push_back(rubrics[i].first);
+				output_tables.push_back("radii." + rubrics[i].second);
+			}
+			LOG(INFO) << "Starting " << names.size() << " tables in batch mode";
+			if (names.empty()) return 0;
+			processing::CreateLayeredRadiiTablesFromSQLConcurrently<int, int>(
+					GetConnectionString(), grids,
+					QueryObjectsByRubrics(&db_conn, names),
+					output_tables, FLAGS_radii_count,
+					FLAGS_exclude_most_common, FLAGS_tolerance,
+					compute_threads, writer_threads, FLAGS_layers_per_pass,
+					processing::kDefaultQueueDepth, FLAGS_band_rows);
+			LOG(DEBUG) << "All jobs are finished";
+			return 0;
+		}
+
 		for (int i = FLAGS_lbound; i < FLAGS_rbound; ++i) {
 			std::string output_table = "radii." + rubrics[i].second;
 			LOG(INFO) << "Starting table " << output_table;
@@ -116,7 +249,8 @@ int main(int argc, char **argv) {
 					QueryObjectsByRubric(&db_conn, rubrics[i].first),
 					output_table, FLAGS_radii_count,
 					FLAGS_exclude_most_common, FLAGS_tolerance,
-					FLAGS_threads);
+					compute_threads, writer_threads, engine,
+					processing::kDefaultQueueDepth, FLAGS_band_rows);
 		}
 		LOG(DEBUG) << "All jobs are finished";
 	} catch (const pqxx::sql_error &e) {
@@ -191,14 +191,16 @@ int main(int argc, char **argv) {
 
 			{
 				pqxx::work trans(db_conn);
-				auto cells = grids::EnumerateGridCells(grid.GetSide());
 				pqxx::tablewriter writer(trans, FLAGS_output_table);
-				for (size_t id = 0; id < cells.size(); ++id) {
-					auto p = cells[id];
-					if (data_grid[p.first][p.second] != 0) {
-						std::vector<int> row = {
-							grid.GetId(), (int) id, data_grid[p.first][p.second]};
-						writer.insert(row);
+				int n = 2 * grid.GetSide();
+				for (int x = 0; x < n; ++x) {
+					for (int y = 0; y < n; ++y) {
+						if (data_grid[x][y] != 0) {
+							std::vector<int> row = {
+								grid.GetId(), grids::GetCellId(x, y, grid.GetSide()),
+								data_grid[x][y]};
+							writer.insert(row);
+						}
 					}
 				}
 				writer.complete();
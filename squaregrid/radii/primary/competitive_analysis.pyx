@@ -1,16 +1,17 @@
+cimport cython
 from libcpp.vector cimport vector
 from libcpp.utility cimport pair
-from libcpp.string cimport string
-from libcpp.algorithm cimport sort
 from libcpp cimport bool as bool_t
+from libc.stdint cimport int64_t
 
 from grids.pywrap_grid_metadata cimport GridMetadata, PywrapGridMetadata
-from grids.pywrap_grid_metadata import LoadGridsMetadata
+from grids.pywrap_grid_metadata import LoadGridsMetadata, PywrapGridIndex
 from processing.pywrap_data_grid cimport DataGrid
 from processing.pywrap_grid_forming cimport FillDataGrid
+from processing.pywrap_label_counting cimport CalculateTopLabels, FillLabelGrid
+from processing.pywrap_label_counting cimport LabelGrid
 from processing.pywrap_radii_summation cimport CalculateRadii
-from utils.pywrap_common cimport GeoCoords
-from utils.pywrap_helpers cimport OccurrenceCounter
+from utils.pywrap_common cimport GeoCoords, float_t
 
 from processing.geocoder import geocode
 from primary.competitive_analysis_pb2 import MakeCompetitiveAnalysisMartRequest
@@ -18,29 +19,55 @@ from primary.competitive_analysis_pb2 import MakeCompetitiveAnalysisMartResponse
 from primary.competitive_analysis_pb2_grpc import CompetitiveAnalyserServicer
 from primary import competitive_analysis_pb2_grpc
 from primary.competitive_analysis_pb2_grpc import CompetitiveAnalyserStub
-from utils.datamart import create_df_from_datamart, create_datamart_from_df
+from utils.datamart import create_df_from_datamart, create_datamart_from_df, is_packed
+from utils.datamart import iter_datamart_chunks
+from utils.datamart_pb2 import DataMart
 from utils.flask import FlaskServingThread
+from utils.result_cache import MemoryCache, ResultCache, make_key
 
 import argparse
 import collections
 from concurrent import futures
 from flask import Flask, request, render_template, flash, redirect
 import grpc
+import hashlib
 import logging
+import numpy
 import pandas
+import string
 import time
+import threading
 import sqlalchemy
 
 class CompetitiveAnalyser(CompetitiveAnalyserServicer):
 	# gRPC API
 	def MakeCompetitiveAnalysisMart(self, request, context):
 		logging.debug('MakeCompetitiveAnalysisMartRequest recieved')
-		df = create_df_from_datamart(request.source_mart)
+		error = _CheckColumns(request)
+		if error is not None:
+			return error
+		return self.MakeMart_(
+				request, request.source_mart, self.Grids_(),
+				self.Competitors_(request.data_source.sql_query))
+
+	def StreamCompetitiveAnalysisMart(self, request_iterator, context):
+		logging.debug('StreamCompetitiveAnalysisMart request recieved')
+		settings = None
+		for request in request_iterator:
+			if settings is None:
+				settings = request
+				error = _CheckColumns(settings)
+				if error is not None:
+					yield error
+					return
+				grids = self.Grids_()
+				competitors = self.Competitors_(settings.data_source.sql_query)
+			yield self.MakeMart_(settings, request.source_mart, grids, competitors)
+	# end of gRPC API
+
+	def MakeMart_(self, request, source_mart, grids, competitors):
+		df = create_df_from_datamart(source_mart)
 		if len(request.address_column) > 0:
-			if len(request.lat_column) > 0 or len(request.lng_column) > 0:
-				return MakeCompetitiveAnalysisMartResponse(
-						status=1,
-						comment=('address_column AND lat/lng columns specified'))
 			logging.debug('Starting geocoding')
 			request_size_in_bytes = self.max_request_size_ * 1024 * 1024
 			df = geocode(
@@ -52,18 +79,9 @@ class CompetitiveAnalyser(CompetitiveAnalyserServicer):
 					whitelist={'latlong'})
 			request.lat_column = request.prefix + 'lat'
 			request.lng_column = request.prefix + 'lng'
-		else:
-			if len(request.lat_column) == 0 or len(request.lng_column) == 0:
-				return MakeCompetitiveAnalysisMartResponse(
-						status=1,
-						comment=('Too few of address_column, lat/lng columns specified'))
 
 		logging.debug('Calculating the response')
-		CalculateMart(
-				df, request.lat_column, request.lng_column,
-				self.sql_engine_, request.data_source.sql_query,
-				list(request.radii), request.top_brands_count, request.brands_radius,
-				request.prefix, request.exclude_most_common, request.tolerance)
+		self.CalculateMart_(df, request, grids, competitors)
 		response = MakeCompetitiveAnalysisMartResponse()
 		response.status = 0
 		if len(request.output_table) > 0:
@@ -80,13 +98,75 @@ class CompetitiveAnalyser(CompetitiveAnalyserServicer):
 						'Table already exists (and does not match?)')
 				logging.exception('Failed to insert data into DB')
 		if request.return_mart:
-			response.data_mart.CopyFrom(create_datamart_from_df(df))
+			response.data_mart.CopyFrom(create_datamart_from_df(
+					df, packed=is_packed(source_mart)))
 		logging.debug('Response created')
 		return response
-	# end of gRPC API
 
-	def __init__(self, sql_engine):
+	def CalculateMart_(self, df, request, grids, competitors):
+		"""CalculateMart, or its columns from the result cache if the same
+		points were analysed with the same competitors and parameters."""
+		params = (
+				list(request.radii), request.top_brands_count, request.brands_radius,
+				request.prefix, request.exclude_most_common, request.tolerance)
+		if self.result_cache_ is None:
+			CalculateMart(
+					df, request.lat_column, request.lng_column, grids, competitors,
+					*params, threads=self.threads_per_request_)
+			return
+		key = make_key(
+				'MakeCompetitiveAnalysisMart', params, competitors.digest,
+				[cur_grid.GetId() for cur_grid in grids],
+				df[request.lat_column].values.astype(numpy.float64).tobytes(),
+				df[request.lng_column].values.astype(numpy.float64).tobytes())
+		columns = _MartColumns(
+				request.radii, request.top_brands_count, request.prefix)
+		computed = list()
+
+		def compute():
+			computed.append(True)
+			CalculateMart(
+					df, request.lat_column, request.lng_column, grids, competitors,
+					*params, threads=self.threads_per_request_)
+			return create_datamart_from_df(
+					df[columns], packed=True).SerializeToString(), True
+
+		value = self.result_cache_.get_or_compute(key, compute)
+		if not computed:
+			logging.debug('Result found in the cache')
+			cached = create_df_from_datamart(DataMart.FromString(value))
+			for col in columns:
+				df[col] = cached[col].values
+
+	def Grids_(self):
+		# a failed startup load is retried
+		if not self.grids_:
+			self.grids_ = LoadGridsMetadata(self.sql_engine_)
+		return self.grids_
+
+	def Competitors_(self, query):
+		"""Competitors of query, from the competitors cache if the same query
+		was loaded less than its ttl ago."""
+		if self.competitors_cache_ is None:
+			return LoadCompetitors(self.sql_engine_, query)
+
+		def load():
+			logging.debug('Loading competitors')
+			competitors = LoadCompetitors(self.sql_engine_, query)
+			competitors.keep_filled = True
+			return competitors
+
+		return self.competitors_cache_.get_or_compute(
+				_NormalizeQuery(query), load)
+
+	def __init__(
+			self, sql_engine, result_cache=None, threads_per_request=1,
+			competitors_cache=None):
 		self.sql_engine_ = sql_engine
+		self.result_cache_ = result_cache
+		self.threads_per_request_ = threads_per_request
+		self.competitors_cache_ = competitors_cache
+		self.grids_ = LoadGridsMetadata(sql_engine)
 
 	def run_http_server(self, port, backend_url, geocoder_url, max_request_size):
 		if getattr(self, 'app_', None) is None:
@@ -212,19 +292,116 @@ class CompetitiveAnalyser(CompetitiveAnalyserServicer):
 		logging.info('Shutdown reached')
 
 
-def CalculateMart(
-		df, lat_col, lng_col,
-		sql_engine, competitors_query,
-		radii, top_brands_count, brands_radius,
-		prefix, exclude_most_common, tolerance):
-	grids = LoadGridsMetadata(sql_engine)
+def _CheckColumns(request):
+	"""Error response if the request has not exactly one of address_column
+	and lat/lng columns, None otherwise."""
+	if len(request.address_column) > 0:
+		if len(request.lat_column) > 0 or len(request.lng_column) > 0:
+			return MakeCompetitiveAnalysisMartResponse(
+					status=1,
+					comment=('address_column AND lat/lng columns specified'))
+	else:
+		if len(request.lat_column) == 0 or len(request.lng_column) == 0:
+			return MakeCompetitiveAnalysisMartResponse(
+					status=1,
+					comment=('Too few of address_column, lat/lng columns specified'))
+	return None
+
+
+def _NormalizeQuery(query):
+	"""query without surrounding whitespace and trailing semicolons.
+
+	Whitespace inside the query is kept as is, it may be part of a literal.
+	"""
+	return query.lstrip().rstrip(string.whitespace + ';')
+
+
+def _MartColumns(radii, top_brands_count, prefix):
+	"""Names of the columns added by CalculateMart."""
+	columns = [prefix + 'competitors_' + str(r) for r in radii]
+	for r in range(top_brands_count):
+		columns.append(prefix + 'brands_top_' + str(r))
+		columns.append(prefix + 'brands_top_' + str(r) + '_count')
+	return columns
+
+
+cdef class _FilledGrid:
+	"""Competitors of one grid by square."""
+	cdef DataGrid[int] quan
+	cdef LabelGrid labels
 
-	cdef vector[pair[GeoCoords, OccurrenceCounter[string]]] label_data
+	def Bytes(self):
+		return (
+				self.quan.NumRows() * self.quan.Stride() * sizeof(int) +
+				self.labels.offsets.size() * sizeof(size_t) +
+				self.labels.entries.size() * sizeof(pair[int, int]))
+
+
+cdef class Competitors:
+	"""Points of a competitors query with their quantities and labels, the
+	latter interned as indices of label_names in sorted order, so that ids
+	compare as the labels do. The extra last label name is empty. digest
+	changes with any of the rows of the query."""
+	cdef vector[pair[GeoCoords, pair[int, int]]] label_data
 	cdef vector[pair[GeoCoords, int]] quan_data
+	cdef readonly object label_names
+	cdef readonly str digest
+	# with keep_filled the grids filled by Fill are kept for later calls
+	cdef public bint keep_filled
+	cdef object filled_grids
+	cdef object lock
+
+	def __cinit__(self):
+		self.keep_filled = False
+		self.filled_grids = dict()
+		self.lock = threading.Lock()
+
+	cdef _FilledGrid Fill(
+			self, PywrapGridMetadata cur_grid,
+			bool_t exclude_most_common, float_t tolerance):
+		"""The points filled into the squares of cur_grid."""
+		cdef _FilledGrid filled
+		cdef GridMetadata *grid = cur_grid.c_grid
+		key = (cur_grid.GetId(), exclude_most_common, tolerance)
+		with self.lock:
+			filled = self.filled_grids.get(key)
+		if filled is not None:
+			return filled
+		filled = _FilledGrid()
+		with nogil:
+			FillLabelGrid(
+					self.label_data, grid[0], exclude_most_common, tolerance,
+					&filled.labels)
+			FillDataGrid[int](
+					self.quan_data, grid[0], exclude_most_common, tolerance,
+					&filled.quan)
+		if self.keep_filled:
+			with self.lock:
+				filled = self.filled_grids.setdefault(key, filled)
+		return filled
+
+	def Bytes(self):
+		"""Approximate memory taken by the points and the kept grids."""
+		cdef _FilledGrid filled
+		size = (
+				self.label_data.size() * sizeof(pair[GeoCoords, pair[int, int]]) +
+				self.quan_data.size() * sizeof(pair[GeoCoords, int]))
+		with self.lock:
+			kept = list(self.filled_grids.values())
+		for filled in kept:
+			size += filled.Bytes()
+		return size
+
+
+def LoadCompetitors(sql_engine, competitors_query):
+	cdef Competitors competitors = Competitors()
 	cdef GeoCoords coords
-	cdef OccurrenceCounter[string] tmp_counter
 	cdef int quantity
+	cdef vector[int] ranks
+	digest = hashlib.sha256()
+	label_ids = dict()
 	for result_tuple in sql_engine.execute(sqlalchemy.text(competitors_query)):
+		digest.update(repr(tuple(result_tuple)).encode('utf-8'))
 		if len(result_tuple) != 3 and len(result_tuple) != 4:
 			logging.error(
 					'SQL query sould yield tuples (lat, lng, label [, quantity])')
@@ -233,79 +410,121 @@ def CalculateMart(
 
 		coords.lat = float(result_tuple[0])
 		coords.lng = float(result_tuple[1])
-		tmp_counter.data.clear()
 		quantity = 1 if len(result_tuple) < 4 else result_tuple[3]
-		tmp_counter.data[result_tuple[2].encode('utf-8')] = quantity
+		label = label_ids.setdefault(result_tuple[2], len(label_ids))
+
+		competitors.label_data.push_back(pair[GeoCoords, pair[int, int]](
+				coords, pair[int, int](label, quantity)))
+		competitors.quan_data.push_back(pair[GeoCoords, int](coords, quantity))
+
+	names = sorted(label_ids)
+	ranks.resize(len(names))
+	for rank, name in enumerate(names):
+		ranks[label_ids[name]] = rank
+	for point in range(competitors.label_data.size()):
+		competitors.label_data[point].second.first = (
+				ranks[competitors.label_data[point].second.first])
+	competitors.label_names = numpy.array(names + [''], dtype=object)
+	competitors.digest = digest.hexdigest()
+	return competitors
+
+
+@cython.boundscheck(False)
+cdef _CalculateGridMart(
+		PywrapGridMetadata cur_grid, Competitors competitors,
+		const float_t[::1] lat, const float_t[::1] lng,
+		vector[int] radii_idx, int max_R, int brands_R, int top_brands_count,
+		bool_t exclude_most_common, float_t tolerance):
+	"""Competitors in radii_idx radii and top brands in brands_R radius of the
+	points lat/lng of cur_grid, as (len(radii_idx), n) counts and
+	(top_brands_count, n) label ids and counts. Missing brands get label -1."""
+	cdef Py_ssize_t count = lat.shape[0]
+	quan = numpy.zeros((radii_idx.size(), count), dtype=numpy.int64)
+	label_ids = numpy.full((top_brands_count, count), -1, dtype=numpy.int32)
+	label_counts = numpy.zeros((top_brands_count, count), dtype=numpy.int64)
+	cdef int64_t[:, ::1] c_quan = quan
+	cdef int[:, ::1] c_label_ids = label_ids
+	cdef int64_t[:, ::1] c_label_counts = label_counts
+	cdef GridMetadata *grid = cur_grid.c_grid
+	cdef _FilledGrid filled = competitors.Fill(
+			cur_grid, exclude_most_common, tolerance)
+	cdef vector[DataGrid[int]] radii_quan
+	# squares of the points inside cur_grid and the indices of the points
+	cdef vector[pair[int, int]] squares
+	cdef vector[Py_ssize_t] points
+	cdef vector[vector[pair[int, int]]] top_labels
+	cdef GeoCoords coords
+	cdef Py_ssize_t i
+	cdef int j, k, square_x, square_y
+
+	with nogil:
+		CalculateRadii[int](filled.quan, max_R + 1, &radii_quan, True)
+
+		for i in range(count):
+			coords.lat = lat[i]
+			coords.lng = lng[i]
+			if not grid.GetSquareCoords(coords, &square_x, &square_y):
+				continue
+			for j in range(<int> radii_idx.size()):
+				c_quan[j, i] = radii_quan[radii_idx[j]][square_x][square_y]
+			squares.push_back(pair[int, int](square_x, square_y))
+			points.push_back(i)
+
+		CalculateTopLabels(
+				filled.labels, brands_R, top_brands_count, squares, &top_labels)
+		for j in range(<int> points.size()):
+			for k in range(<int> top_labels[j].size()):
+				c_label_ids[k, points[j]] = top_labels[j][k].first
+				c_label_counts[k, points[j]] = top_labels[j][k].second
+
+	return quan, label_ids, label_counts
 
-		label_data.push_back(
-				pair[GeoCoords, OccurrenceCounter[string]](coords, tmp_counter))
-		quan_data.push_back(pair[GeoCoords, int](coords, quantity))
 
+def CalculateMart(
+		df, lat_col, lng_col, grids, Competitors competitors,
+		radii, top_brands_count, brands_radius,
+		prefix, exclude_most_common, tolerance, threads=1):
+	"""Adds to df the number of competitors in each of radii and the
+	top_brands_count most common brands in brands_radius around every row.
+	Grids are processed by up to threads threads."""
+	lat = numpy.ascontiguousarray(df[lat_col].values, dtype=numpy.float32)
+	lng = numpy.ascontiguousarray(df[lng_col].values, dtype=numpy.float32)
+	cdef vector[int] radii_idx = [r // 100 for r in radii]
 	cdef int max_R = max(radii) // 100
 	cdef int brands_R = brands_radius // 100
-	cdef DataGrid[OccurrenceCounter[string]] grid_labels
-	cdef DataGrid[int] grid_quan
-	cdef vector[DataGrid[int]] radii_quan
-	cdef vector[DataGrid[OccurrenceCounter[string]]] radii_labels
-	cdef PywrapGridMetadata cur_grid
-	cdef int i, square_x, square_y, in_grid
-	cdef vector[bool_t] used = vector[bool_t](len(df), False)
-	cdef vector[pair[int, string]] sorted_labels
-
-	for r in radii:
-		df[prefix + 'competitors_' + str(r)] = [0] * len(df)
-	for r in range(top_brands_count):
-		df[prefix + 'brands_top_' + str(r)] = [''] * len(df)
-		df[prefix + 'brands_top_' + str(r) + '_count'] = [0] * len(df)
-	for cur_grid in grids:
-		in_grid = 0
-		for idx, row in df.iterrows():
-			coords.lat = row[lat_col]
-			coords.lng = row[lng_col]
-			if cur_grid.c_grid.GetSquareCoords(coords, &square_x, &square_y):
-				in_grid += 1
-				break
-		if in_grid == 0:
-			continue
-
-		FillDataGrid[OccurrenceCounter[string]](
-				label_data, cur_grid.c_grid[0],
-				exclude_most_common, tolerance,
-				&grid_labels)
-		FillDataGrid[int](
-				quan_data, cur_grid.c_grid[0],
-				exclude_most_common, tolerance,
-				&grid_quan)
-		CalculateRadii[int](grid_quan, max_R + 1, &radii_quan, True)
-		CalculateRadii[OccurrenceCounter[string]](
-				grid_labels, brands_R + 1, &radii_labels, True)
-
-		for idx, row in df.iterrows():
-			if used[idx]:
-				continue
-			coords.lat = float(row[lat_col])
-			coords.lng = float(row[lng_col])
-			if not cur_grid.c_grid.GetSquareCoords(coords, &square_x, &square_y):
-				continue
-			used[idx] = True
-			for j, r in enumerate(radii):
-				df.set_value(
-						idx, prefix + 'competitors_' + str(r),
-						radii_quan[r // 100][square_x][square_y])
-
-			sorted_labels.clear()
-			for p in radii_labels[brands_R][square_x][square_y].data:
-				sorted_labels.push_back(pair[int, string](p.second, p.first))
-			sort(sorted_labels.begin(), sorted_labels.end())
-			sorted_labels = reversed(sorted_labels)
-			sorted_labels.resize(min(sorted_labels.size(), top_brands_count))
-			for i in range(sorted_labels.size()):
-				df.set_value(
-						idx, prefix + 'brands_top_' + str(i),
-						sorted_labels[i].second.decode('utf-8'))
-				df.set_value(
-						idx, prefix + 'brands_top_' + str(i) + '_count',
-						sorted_labels[i].first)
+	quan = numpy.zeros((len(radii), len(df)), dtype=numpy.int64)
+	label_ids = numpy.full((top_brands_count, len(df)), -1, dtype=numpy.int32)
+	label_counts = numpy.zeros((top_brands_count, len(df)), dtype=numpy.int64)
+
+	# every row gets into the first grid containing it
+	grid_ids, _ = PywrapGridIndex(grids).locate(lat, lng)
+	order = numpy.argsort(grid_ids, kind='stable')
+	ids, starts = numpy.unique(grid_ids[order], return_index=True)
+	grid_rows = dict(zip(ids, numpy.split(order, starts[1:])))
+
+	def calculate(cur_grid, rows):
+		grid_quan, grid_label_ids, grid_label_counts = _CalculateGridMart(
+				cur_grid, competitors, lat[rows], lng[rows], radii_idx, max_R,
+				brands_R,
+				top_brands_count, exclude_most_common, tolerance)
+		quan[:, rows] = grid_quan
+		label_ids[:, rows] = grid_label_ids
+		label_counts[:, rows] = grid_label_counts
+
+	with futures.ThreadPoolExecutor(max_workers=threads) as executor:
+		jobs = [
+				executor.submit(calculate, cur_grid, grid_rows[cur_grid.GetId()])
+				for cur_grid in grids if cur_grid.GetId() in grid_rows]
+		for job in jobs:
+			job.result()
+
+	# -1 picks the empty label name
+	labels = competitors.label_names[label_ids]
+	for j, r in enumerate(radii):
+		df[prefix + 'competitors_' + str(r)] = quan[j]
+	for k in range(top_brands_count):
+		df[prefix + 'brands_top_' + str(k)] = labels[k]
+		df[prefix + 'brands_top_' + str(k) + '_count'] = label_counts[k]
 
 
 def make_mart_inplace(args):
@@ -343,10 +562,11 @@ def make_mart_inplace(args):
 				args.dbport, args.dbname))
 
 	CalculateMart(
-			df, args.lat_col, args.lng_col,
-			engine, args.competitors_query,
+			df, args.lat_col, args.lng_col, LoadGridsMetadata(engine),
+			LoadCompetitors(engine, args.competitors_query),
 			args.radii, args.top_brands_count, args.brands_radius,
-			args.prefix, args.exclude_most_common, args.tolerance)
+			args.prefix, args.exclude_most_common, args.tolerance,
+			threads=args.threads_per_request)
 
 	if args.output_file is not None:
 		df.to_csv(args.output_file, index=False)
@@ -366,32 +586,44 @@ def execute_request(df, args):
 				('grpc.max_message_length', request_size_in_bytes)])
 	stub = CompetitiveAnalyserStub(channel)
 
-	request = MakeCompetitiveAnalysisMartRequest()
-	request.data_source.sql_query = args.competitors_query
-	request.radii.extend(args.radii)
-	request.top_brands_count = args.top_brands_count
-	if args.output_table is not None:
-		request.output_table = args.output_table
-	request.return_mart = args.output_file is not None
-	request.prefix = args.prefix
-	if args.address_column is not None:
-		request.address_column = args.address_column
-	if args.lat_col is not None:
-		request.lat_column = args.lat_col
-	if args.lng_col is not None:
-		request.lng_column = args.lng_col
-	request.exclude_most_common = args.exclude_most_common
-	request.tolerance = args.tolerance
-	request.source_mart.CopyFrom(create_datamart_from_df(df))
-
-	response = stub.MakeCompetitiveAnalysisMart(request)
-	if response.status != 0:
-		logging.error(response.comment)
-	else:
+	def requests():
+		for i, data in enumerate(iter_datamart_chunks(df)):
+			request = MakeCompetitiveAnalysisMartRequest()
+			request.source_mart.CopyFrom(data)
+			if i == 0:
+				request.data_source.sql_query = args.competitors_query
+				request.radii.extend(args.radii)
+				request.top_brands_count = args.top_brands_count
+				if args.output_table is not None:
+					request.output_table = args.output_table
+				request.return_mart = args.output_file is not None
+				request.prefix = args.prefix
+				if args.address_column is not None:
+					request.address_column = args.address_column
+				if args.lat_col is not None:
+					request.lat_column = args.lat_col
+				if args.lng_col is not None:
+					request.lng_column = args.lng_col
+				request.exclude_most_common = args.exclude_most_common
+				request.tolerance = args.tolerance
+			yield request
+
+	# the output file is written chunk by chunk as the responses come
+	responses = stub.StreamCompetitiveAnalysisMart(requests())
+	first = True
+	for response in responses:
+		if response.status != 0:
+			logging.error(response.comment)
+			responses.cancel()
+			break
 		if args.output_file is not None:
 			out_df = create_df_from_datamart(response.data_mart)
-			out_df.to_csv(args.output_file, index=False)
-			print(out_df.head())
+			out_df.to_csv(
+					args.output_file, index=False, header=first,
+					mode='w' if first else 'a')
+			if first:
+				print(out_df.head())
+		first = False
 	return response
 
 
@@ -411,7 +643,17 @@ def start_service(args):
 			'postgres://%s:%s@%s:%s/%s' % (args.dbuser, args.dbpass, args.dbhost,
 				args.dbport, args.dbname))
 
-	analyser = CompetitiveAnalyser(engine)
+	result_cache = None
+	if args.result_cache_dir is not None:
+		result_cache = ResultCache(
+				args.result_cache_dir, args.result_cache_mb * 1024 * 1024)
+	competitors_cache = None
+	if args.competitors_cache_mb > 0 and args.competitors_ttl > 0:
+		competitors_cache = MemoryCache(
+				args.competitors_cache_mb * 1024 * 1024, args.competitors_ttl,
+				size=lambda competitors: competitors.Bytes())
+	analyser = CompetitiveAnalyser(
+			engine, result_cache, args.threads_per_request, competitors_cache)
 	competitive_analysis_pb2_grpc.add_CompetitiveAnalyserServicer_to_server(
 			analyser, server)
 	server.add_insecure_port('[::]:%d' % args.grpc_port)
@@ -498,6 +740,16 @@ def main():
 			help='Max service request size in MBs')
 	parser.add_argument('--serving_threads', type=int, default=5,
 			help='Number of serving threads')
+	parser.add_argument('--threads_per_request', type=int, default=10,
+			help='Number of threads calculating one request')
+	parser.add_argument('--competitors_cache_mb', type=int, default=1024,
+			help='Memory in MBs for competitors kept between requests, 0 disables')
+	parser.add_argument('--competitors_ttl', type=int, default=600,
+			help='Seconds competitors of a query are kept without reloading')
+	parser.add_argument('--result_cache_dir', type=str, default=None,
+			help='Directory keeping results between requests and restarts')
+	parser.add_argument('--result_cache_mb', type=int, default=4096,
+			help='Disk space in MBs for the kept results')
 	parser.add_argument('--grpc_port', type=int, default=55557,
 			help='Port to serve on')
 	parser.add_argument('--http_port', type=int, default=44447,
@@ -1,23 +1,34 @@
+#include <algorithm>
+#include <chrono>
 #include <cmath>
+#include <cstring>
+#include <functional>
 
 #include <iostream>
+#include <map>
 #include <memory>
 #include <numeric>
 #include <string>
+#include <unordered_map>
+#include <vector>
 
 #include <boost/algorithm/string.hpp>
-#include <boost/asio/io_service.hpp>
-#include <boost/bind.hpp>
 #include <boost/filesystem.hpp>
-#include <boost/thread/thread.hpp>
 #include <grpc++/grpc++.h>
 #include <gflags/gflags.h>
 
 #include "easylogging++.h"
 
+#include "grids/grid_index.h"
 #include "grids/grid_metadata.h"
 #include "primary/data_mart_manager.grpc.pb.h"
+#include "processing/radii_cache.h"
+#include "processing/radii_writer.h"
+#include "utils/connection_pool.h"
+#include "utils/datamart.h"
 #include "utils/datamart.pb.h"
+#include "utils/result_cache.h"
+#include "utils/worker_pool.h"
 
 static bool ValidateMessageSize(const char*, int value) {
 	return 1 <= value && value < 2048;
@@ -27,6 +38,14 @@ static bool ValidateNonEmpty(const char*, const std::string &value) {
 	return !value.empty();
 }
 
+static bool ValidateNonNegative(const char*, int32_t value) {
+	return value >= 0;
+}
+
+static bool ValidatePositive(const char*, int32_t value) {
+	return value > 0;
+}
+
 DEFINE_string(dbhost, "127.0.0.1", "Address of DB to connect");
 DEFINE_validator(dbhost, &ValidateNonEmpty);
 DEFINE_int32(dbport, 5432, "Port where DB is serving");
@@ -38,7 +57,65 @@ DEFINE_validator(dbpass, &ValidateNonEmpty);
 DEFINE_int32(max_message_size, 2000, "Max gRPC message size in MiB");
 DEFINE_validator(max_message_size, &ValidateMessageSize);
 DEFINE_int32(port, 55556, "Port to serve on");
-DEFINE_int32(threads_per_request, 10, "Threads server can use per request");
+DEFINE_int32(workers, 16, "Threads processing tables of all the requests");
+DEFINE_validator(workers, &ValidatePositive);
+DEFINE_int32(db_connections, 16, "Connections to DB shared by the workers");
+DEFINE_validator(db_connections, &ValidatePositive);
+DEFINE_int32(
+		threads_per_request, 10,
+		"Workers processing tables of one request at once");
+DEFINE_validator(threads_per_request, &ValidatePositive);
+DEFINE_int32(
+		radii_cache_mb, 1024,
+		"Memory in MiB for radii kept between requests, 0 disables the cache");
+DEFINE_validator(radii_cache_mb, &ValidateNonNegative);
+DEFINE_string(
+		result_cache_dir, "",
+		"Directory keeping results between requests and restarts, none if empty");
+DEFINE_int32(result_cache_mb, 4096, "Disk space in MiB for the kept results");
+DEFINE_validator(result_cache_mb, &ValidateNonNegative);
+DEFINE_bool(
+		output_staging, true,
+		"Write output tables into a staging table swapped in at the end");
+
+const char kStagingSuffix[] = "_staging";
+
+// Values of result[table][radius] one after another.
+static void _SerializeResult(
+		const std::vector< std::vector< std::vector<int64_t> > > &result,
+		std::string *out) {
+	out->clear();
+	for (const auto &table : result) {
+		for (const auto &values : table) {
+			out->append(
+					reinterpret_cast<const char*>(values.data()),
+					values.size() * sizeof(int64_t));
+		}
+	}
+}
+
+static void _ParseResult(
+		const std::string &serialized,
+		const primary::MakeDataMartRequest &settings,
+		int rows,
+		std::vector< std::vector< std::vector<int64_t> > > *result) {
+	const char *data = serialized.data();
+	result->assign(settings.tables_size(), {});
+	for (int i = 0; i < settings.tables_size(); ++i) {
+		(*result)[i].assign(settings.tables(i).radii_size(), std::vector<int64_t>(rows));
+		for (auto &values : (*result)[i]) {
+			std::memcpy(values.data(), data, rows * sizeof(int64_t));
+			data += rows * sizeof(int64_t);
+		}
+	}
+}
+
+// Address of the peer without the port.
+static std::string _GetClient(const grpc::ServerContext &context) {
+	std::string peer = context.peer();
+	size_t port = peer.rfind(':');
+	return port == std::string::npos ? peer : peer.substr(0, port);
+}
 
 using utils::DataMart;
 using primary::DataMartManager;
@@ -48,20 +125,92 @@ using primary::MakeDataMartResponse;
 class DataMartManagerImpl final : public DataMartManager::Service {
 	public:
 		grpc::Status MakeDataMart(
-				grpc::ServerContext *,
+				grpc::ServerContext *context,
 				const MakeDataMartRequest *request,
 				MakeDataMartResponse *response) override {
 			LOG(INFO) << "MakeDataMart request recieved";
-			MakeDataMart(*request, response);
+			auto start = std::chrono::steady_clock::now();
+			std::string client = _GetClient(*context);
+			MakeDataMart(*request, client, response);
+			LogRequest(client, start);
 			return grpc::Status::OK;
 		}
 
+		grpc::Status StreamDataMart(
+				grpc::ServerContext *context,
+				grpc::ServerReaderWriter<MakeDataMartResponse, MakeDataMartRequest> *stream)
+				override {
+			LOG(INFO) << "StreamDataMart request recieved";
+			auto start = std::chrono::steady_clock::now();
+			std::string client = _GetClient(*context);
+			MakeDataMartRequest settings, request;
+			std::unique_ptr<pqxx::connection> db_conn;
+			std::unique_ptr<pqxx::work> trans;
+			int chunks = 0;
+			try {
+				while (stream->Read(&request)) {
+					if (chunks == 0) {
+						// the parameters are kept without the data of the first chunk
+						settings.Swap(&request);
+						request.mutable_data()->Swap(settings.mutable_data());
+						if (settings.output_table().size() > 0) {
+							db_conn.reset(new pqxx::connection(connection_string_));
+							trans.reset(new pqxx::work(*db_conn));
+							CreateOutputTable(trans.get(), settings, request.data());
+						}
+					}
+					MartChunk chunk;
+					CalculateChunk(settings, request.data(), client, &chunk);
+					if (trans) {
+						InsertRows(trans.get(), settings, request.data(), chunk);
+					}
+					MakeDataMartResponse response;
+					FillMart(settings, request.data(), chunk, response.mutable_data());
+					stream->Write(response);
+					LOG(DEBUG) << "Chunk " << chunks++ << " sent";
+				}
+				if (trans) {
+					FinishOutputTable(trans.get(), settings);
+					trans->commit();
+				}
+			} catch (const pqxx::sql_error &e) {
+				LOG(ERROR) << "SQL Error:\n" << e.what() << "Query:\n" << e.query();
+				MakeDataMartResponse response;
+				response.set_error(1);
+				response.set_comment(e.what());
+				stream->Write(response);
+			}
+			LOG(INFO) << "Stream of " << chunks << " chunks finished";
+			LogRequest(client, start);
+			return grpc::Status::OK;
+		}
+
+		// Requests share workers threads and db_connections connections, each
+		// of them uses at most threads_per_request workers at once.
+		// cache_bytes bounds the radii kept in memory between requests, 0
+		// disables the cache. Results are kept in result_cache_dir, if it is
+		// not empty, up to result_cache_bytes.
 		DataMartManagerImpl(
-				const std::string &connection_string, int threads)
-				: connection_string_(connection_string), threads_(threads) {
+				const std::string &connection_string,
+				int workers, int db_connections, int threads_per_request,
+				size_t cache_bytes, bool output_staging,
+				const std::string &result_cache_dir, size_t result_cache_bytes)
+				: connection_string_(connection_string), threads_(threads_per_request),
+				  output_staging_(output_staging),
+				  connections_(connection_string, db_connections), workers_(workers) {
+			if (cache_bytes > 0) {
+				cache_.reset(new processing::RadiiCache(cache_bytes));
+			}
+			if (!result_cache_dir.empty()) {
+				result_cache_.reset(
+						new utils::ResultCache(result_cache_dir, result_cache_bytes));
+			}
 			try {
 				pqxx::connection db_conn(connection_string_);
-				regions_ = grids::LoadGridMetadata(&db_conn);
+				index_.reset(new grids::GridIndex(grids::LoadGridMetadata(&db_conn)));
+				for (const auto &grid : index_->GetGrids()) {
+					grid_sides_[grid.GetId()] = grid.GetSide();
+				}
 			} catch (const pqxx::sql_error &e) {
 				LOG(ERROR) << "SQL Error:\n" << e.what() << "Query:\n" << e.query();
 				throw e;
@@ -69,99 +218,116 @@ class DataMartManagerImpl final : public DataMartManager::Service {
 		}
 
 	private:
-		std::pair<int, int> GetRegionAndSquare(float_t lat, float_t lng) {
-			for (std::size_t i = 0; i < regions_.size(); ++i) {
-				int id;
-				if (regions_[i].GetSquareId(utils::GeoCoords(lat, lng), &id)) {
-					return {regions_[i].GetId(), id};
-				}
+		void LogRequest(
+				const std::string &client,
+				std::chrono::steady_clock::time_point start) {
+			auto stats = workers_.GetStats();
+			LOG(INFO) << "Request of " << client << " took "
+				<< std::chrono::duration<double, std::milli>(
+						std::chrono::steady_clock::now() - start).count() << " ms;"
+				<< " workers: " << stats.running << " running, "
+				<< stats.queued << " tasks queued, mean wait "
+				<< stats.mean_wait_ms << " ms, max wait " << stats.max_wait_ms << " ms";
+		}
+
+		// Reads the whole stored grid and keeps it in the cache.
+		std::shared_ptr<const processing::StoredRadii> LoadGridRadii(
+				pqxx::work *trans, const std::string &radii_table,
+				int grid_id, const std::string &version) {
+			std::shared_ptr<const processing::StoredRadii> radii =
+				processing::LoadStoredRadii(trans, radii_table, grid_id);
+			LOG(DEBUG) << "Fetched grid number " << grid_id << "; "
+				<< radii->Squares() << " squares";
+			if (cache_) {
+				cache_->Put(radii_table, grid_id, version, radii);
 			}
-			return {0, 0};
+			return radii;
 		}
 
+		// Fills result[i][row] with the sum of the stored radii up to radii[i]
+		// of the square of the row, 0 for rows outside all the grids.
 		bool ProcessRubric(
 				const std::string radii_table,
 				const std::vector<int> radii,
-				const std::string &prefix,
-				const DataMart &mart,
-				std::vector< utils::DataMartColumn> *result) {
+				const std::vector<int> *grid_ids,
+				const std::vector<int> *square_ids,
+				std::vector< std::vector<int64_t> > *result) {
 			try {
 				LOG(INFO) << "Starting table " << radii_table;
-				pqxx::connection db_conn(connection_string_);
-				pqxx::work trans(db_conn);
+				auto db_conn = connections_.Acquire();
+				pqxx::work trans(*db_conn);
 
-				int rows = mart.nrows();
+				int rows = grid_ids->size();
 				int radii_count = trans.exec(
 						"SELECT * FROM " + radii_table + " LIMIT 1").columns() - 2;
 				int radii_requested = radii.size();
-				result->resize(radii_requested);
-				for (int i = 0; i < radii_requested; ++i) {
-					(*result)[i].set_name(
-							prefix + radii_table + "_" +
-							std::to_string(radii[i]));
-					for (int j = 0; j < rows; ++j) {
-						(*result)[i].add_cells();
-					}
-				}
+				result->assign(radii_requested, std::vector<int64_t>(rows));
 
 				std::vector<int> sorted_order(rows);
 				std::iota(sorted_order.begin(), sorted_order.end(), 0);
-				int grid_col = mart.columns_size() - 1;
-				int cell_col = mart.columns_size() - 2;
 				std::sort(
 						sorted_order.begin(), sorted_order.end(),
-						[grid_col, &mart](int a, int b) {
-							return (
-									mart.columns(grid_col).cells(a).int_val() <
-									mart.columns(grid_col).cells(b).int_val());
+						[grid_ids](int a, int b) {
+							return (*grid_ids)[a] < (*grid_ids)[b];
 						});
-				int cur_grid_id = 0;
-				std::vector< std::vector<int> > cur_grid;
-				for (int r_id : sorted_order) {
-					if (mart.columns(grid_col).cells(r_id).int_val() != cur_grid_id) {
-						cur_grid_id = mart.columns(grid_col).cells(r_id).int_val();
-						cur_grid.clear();
-						pqxx::result grid = trans.exec(
-								"SELECT * FROM " + radii_table +
-								" WHERE city_id = " + std::to_string(cur_grid_id) +
-								" ORDER BY square_id");
-						assert((int) grid.columns() == radii_count + 2);
-						LOG(DEBUG) << "Fetched grid number " << cur_grid_id << "; "
-							<< grid.columns() << " columns";
-						for (int i = 0; i < radii_count; ++i) {
-							assert(std::string(grid.column_name(i + 2)) ==
-									"_" + std::to_string(i * 100));
-						}
-						if (grid.size() > 0) {
-							cur_grid.resize(grid[grid.size() - 1][1].as<int>() + 1);
+				int max_column = radii.empty() ? 0 : (
+						*std::max_element(radii.begin(), radii.end()) / 100);
+				if (max_column >= radii_count) {
+					LOG(INFO) << "Radius " << max_column * 100 <<
+						" is out of range for table " << radii_table;
+					assert(false);
+				}
+
+				std::string version = processing::GetRadiiTableVersion(
+						&trans, radii_table);
+				std::vector<int> grid_squares;
+				for (int begin = 0, end = 0; begin < rows; begin = end) {
+					int grid_id = (*grid_ids)[sorted_order[begin]];
+					grid_squares.clear();
+					for (end = begin; end < rows; ++end) {
+						int r_id = sorted_order[end];
+						if ((*grid_ids)[r_id] != grid_id) break;
+						grid_squares.push_back((*square_ids)[r_id]);
+					}
+					std::sort(grid_squares.begin(), grid_squares.end());
+					grid_squares.erase(
+							std::unique(grid_squares.begin(), grid_squares.end()),
+							grid_squares.end());
+
+					// squares of rows outside all the grids (grid 0) stay zero
+					std::shared_ptr<const processing::StoredRadii> cur_grid;
+					std::unordered_map< int, std::vector<int> > cur_squares;
+					if (grid_id != 0) {
+						if (cache_) {
+							cur_grid = cache_->Get(radii_table, grid_id, version);
 						}
-						LOG(DEBUG) << "Names ok; total sqrs = " << grid.size();
-						for (const auto &row : grid) {
-							int row_id = row[1].as<int>();
-							cur_grid[row_id].resize(radii_requested);
-							for (int i = 0; i < radii_requested; ++i) {
-								int r = radii[i] / 100;
-								if (r + 2 >= (int) row.size()) {
-									LOG(INFO) << "Radius " << radii[i] <<
-										" is out of range for table " << radii_table;
-									assert(false);
-								}
-								cur_grid[row_id][i] = row[r + 2].as<int>();
-							}
-							std::partial_sum(
-									cur_grid[row_id].begin(), cur_grid[row_id].end(),
-									cur_grid[row_id].begin());
+						auto side = grid_sides_.find(grid_id);
+						if (!cur_grid && side != grid_sides_.end() &&
+								processing::PreferPointFetch(grid_squares.size(), side->second)) {
+							cur_squares = processing::LoadStoredSquares(
+									&trans, radii_table, grid_id, grid_squares, max_column + 1);
+							LOG(DEBUG) << "Fetched " << cur_squares.size()
+								<< " squares of grid number " << grid_id;
+						} else if (!cur_grid) {
+							cur_grid = LoadGridRadii(&trans, radii_table, grid_id, version);
 						}
-						LOG(DEBUG) << "Grid ok, max sqr = " << (int) cur_grid.size() - 1;
-					}
-					int cell_id = mart.columns(cell_col).cells(r_id).int_val();
-					std::vector<int> cur_radii;
-					if (!cur_grid.empty() && cell_id < (int) cur_grid.size()) {
-						cur_radii = cur_grid[cell_id];
 					}
-					if (cur_radii.empty()) cur_radii.assign(radii_requested, 0);
-					for (int i = 0; i < radii_requested; ++i) {
-						(*result)[i].mutable_cells(r_id)->set_int_val(cur_radii[i]);
+
+					for (int k = begin; k < end; ++k) {
+						int r_id = sorted_order[k];
+						int cell_id = (*square_ids)[r_id];
+						const int *stored = nullptr;
+						if (cur_grid && cell_id < cur_grid->Squares()) {
+							stored = (*cur_grid)[cell_id];
+						} else if (!cur_grid) {
+							auto it = cur_squares.find(cell_id);
+							if (it != cur_squares.end()) stored = it->second.data();
+						}
+						int sum = 0;
+						for (int i = 0; i < radii_requested; ++i) {
+							if (stored) sum += stored[radii[i] / 100];
+							(*result)[i][r_id] = sum;
+						}
 					}
 				}
 			} catch (const pqxx::sql_error &e) {
@@ -171,167 +337,286 @@ class DataMartManagerImpl final : public DataMartManager::Service {
 			return true;
 		}
 
-		void MakeDataMart(
-				const MakeDataMartRequest &request,
-				MakeDataMartResponse *response) {
-
-			response->mutable_data()->CopyFrom(request.data());
-			auto id_col = response->mutable_data()->add_columns();
-			id_col->set_name(request.prefix() + "square_id");
-			auto grid_col = response->mutable_data()->add_columns();
-			grid_col->set_name(request.prefix() + "grid_id");
-
-			int lat_idx = request.latitude_column();
-			int lng_idx = request.longitude_column();
-			const auto &req_data = request.data();
-			for (int i = 0; i < request.data().nrows(); ++i) {
-				auto grid_cell = grid_col->add_cells();
-				auto id_cell = id_col->add_cells();
-				int kFloatVal = utils::DataMartCell::DataTypeCase::kFloatVal;
-				if (req_data.columns(lat_idx).cells(i).data_type_case() == kFloatVal &&
-						req_data.columns(lng_idx).cells(i).data_type_case() == kFloatVal) {
-					float_t lat = request.data().columns(lat_idx).cells(i).float_val();
-					float_t lng = request.data().columns(lng_idx).cells(i).float_val();
-
-					auto id = GetRegionAndSquare(lat, lng);
-					grid_cell->set_int_val(id.first);
-					id_cell->set_int_val(id.second);
+		// Per row of a chunk: grid and square ids, both 0 for rows without
+		// coordinates or outside all the grids, and result[table][radius].
+		struct MartChunk {
+			std::vector<bool> has_coords;
+			std::vector<int> grid_ids, square_ids;
+			std::vector< std::vector< std::vector<int64_t> > > result;
+		};
+
+		// Tables are processed by the shared workers, at most threads_ of them
+		// at once, taking turns with the requests of other clients.
+		void CalculateChunk(
+				const MakeDataMartRequest &settings,
+				const DataMart &data,
+				const std::string &client,
+				MartChunk *chunk) {
+			int lat_idx = settings.latitude_column();
+			int lng_idx = settings.longitude_column();
+			int rows = data.nrows();
+			int kFloatVal = utils::DataMartCell::DataTypeCase::kFloatVal;
+			std::vector<float_t> lats(rows, NAN), lngs(rows, NAN);
+			chunk->has_coords.assign(rows, false);
+			for (int i = 0; i < rows; ++i) {
+				if (utils::GetValueType(data.columns(lat_idx), i) == kFloatVal &&
+						utils::GetValueType(data.columns(lng_idx), i) == kFloatVal) {
+					chunk->has_coords[i] = true;
+					lats[i] = utils::GetFloatValue(data.columns(lat_idx), i);
+					lngs[i] = utils::GetFloatValue(data.columns(lng_idx), i);
 				}
 			}
+			auto &grid_ids = chunk->grid_ids;
+			auto &square_ids = chunk->square_ids;
+			grid_ids.resize(rows);
+			square_ids.resize(rows);
+			index_->Locate(
+					lats.data(), lngs.data(), rows, grid_ids.data(), square_ids.data());
+			for (int i = 0; i < rows; ++i) {
+				grid_ids[i] = chunk->has_coords[i] ? std::max(grid_ids[i], 0) : 0;
+				square_ids[i] = chunk->has_coords[i] ? std::max(square_ids[i], 0) : 0;
+			}
+
+			LOG(INFO) << "Forming data mart for " << client << " using up to "
+				<< threads_ << " workers";
 
-			LOG(INFO) << "Forming data mart using " << threads_ << " threads";
-
-			std::vector< std::vector<utils::DataMartColumn> > result(
-					request.tables_size());
-			boost::asio::io_service ioService;
-			boost::thread_group threadpool;
-			do {
-				boost::asio::io_service::work work(ioService);
-				for (int i = 0; i < threads_; ++i) {
-					threadpool.create_thread(
-							boost::bind(&boost::asio::io_service::run, &ioService));
+			std::string key = result_cache_ ? ResultKey(settings, *chunk) : "";
+			if (key.empty()) {
+				ProcessTables(settings, client, chunk);
+				return;
+			}
+			bool computed = false;
+			std::string value = result_cache_->GetOrCompute(
+					key, [&](std::string *result) {
+						computed = true;
+						bool complete = ProcessTables(settings, client, chunk);
+						_SerializeResult(chunk->result, result);
+						return complete;
+					});
+			if (!computed) {
+				LOG(INFO) << "Result of " << client << " found in the cache";
+				_ParseResult(value, settings, rows, &chunk->result);
+			}
+		}
+
+		// Returns false if some of the tables failed.
+		bool ProcessTables(
+				const MakeDataMartRequest &settings,
+				const std::string &client,
+				MartChunk *chunk) {
+			chunk->result.assign(settings.tables_size(), {});
+			std::vector<char> complete(settings.tables_size());
+			auto batch = workers_.NewBatch(client, threads_);
+			for (int i = 0; i < settings.tables_size(); ++i) {
+				std::vector<int> r;
+				for (int j = 0; j < settings.tables(i).radii_size(); ++j) {
+					r.push_back(settings.tables(i).radii(j));
 				}
-				for (int i = 0; i < request.tables_size(); ++i) {
-					std::vector<int> r;
-					for (int j = 0; j < request.tables(i).radii_size(); ++j) {
-						r.push_back(request.tables(i).radii(j));
-					}
-					ioService.post(boost::bind(
-								&DataMartManagerImpl::ProcessRubric, this,
-								request.tables(i).table_name(), r, request.prefix(),
-								response->data(), &result[i]));
+				batch->Add([this, &settings, &complete, chunk, i, r]() {
+					complete[i] = ProcessRubric(
+							settings.tables(i).table_name(), r,
+							&chunk->grid_ids, &chunk->square_ids, &chunk->result[i]);
+				});
+			}
+			batch->Wait();
+			LOG(INFO) << "All jobs are finished";
+			return std::all_of(
+					complete.begin(), complete.end(), [](char done) { return done; });
+		}
+
+		// Key of the result of chunk in result_cache_: the squares of its rows
+		// and the radii and versions of the tables. Empty if a version is
+		// unknown.
+		std::string ResultKey(
+				const MakeDataMartRequest &settings, const MartChunk &chunk) {
+			utils::KeyHasher key;
+			key.Add(chunk.grid_ids).Add(chunk.square_ids);
+			try {
+				auto db_conn = connections_.Acquire();
+				pqxx::work trans(*db_conn);
+				for (const auto &table : settings.tables()) {
+					key.Add(table.table_name());
+					key.Add(processing::GetRadiiTableVersion(&trans, table.table_name()));
+					key.Add(std::vector<int>(table.radii().begin(), table.radii().end()));
 				}
-			} while (false);
-			threadpool.join_all();
-			ioService.stop();
-
-			LOG(INFO) << "All jobs are finished, creating response";
-			if (request.return_mart()) {
-				for (auto &cols: result) {
-					for (const utils::DataMartColumn &col: cols) {
-						response->mutable_data()->add_columns()->CopyFrom(col);
-					}
+			} catch (const pqxx::sql_error &e) {
+				LOG(ERROR) << "SQL Error:\n" << e.what() << "Query:\n" << e.query();
+				return "";
+			}
+			return key.Hex();
+		}
+
+		// data with the ids and, if the mart is to be returned, the radii of
+		// chunk appended, in the format of data.
+		void FillMart(
+				const MakeDataMartRequest &settings,
+				const DataMart &data,
+				const MartChunk &chunk,
+				DataMart *mart) {
+			mart->CopyFrom(data);
+			bool packed = utils::IsPacked(data);
+			auto id_col = mart->add_columns();
+			id_col->set_name(settings.prefix() + "square_id");
+			auto grid_col = mart->add_columns();
+			grid_col->set_name(settings.prefix() + "grid_id");
+			utils::SetIntValues(
+					std::vector<int64_t>(chunk.grid_ids.begin(), chunk.grid_ids.end()),
+					chunk.has_coords, packed, grid_col);
+			utils::SetIntValues(
+					std::vector<int64_t>(chunk.square_ids.begin(), chunk.square_ids.end()),
+					chunk.has_coords, packed, id_col);
+			if (!settings.return_mart()) return;
+			for (size_t i = 0; i < chunk.result.size(); ++i) {
+				for (size_t j = 0; j < chunk.result[i].size(); ++j) {
+					auto *col = mart->add_columns();
+					col->set_name(
+							settings.prefix() + settings.tables(i).table_name() + "_" +
+							std::to_string(settings.tables(i).radii(j)));
+					utils::SetIntValues(chunk.result[i][j], std::vector<bool>(), packed, col);
 				}
 			}
-			if (request.output_table().size() > 0) {
-				try {
-					pqxx::connection db_conn(connection_string_);
-					pqxx::work trans(db_conn);
-
-					std::string create_query = "DROP TABLE IF EXISTS " + request.output_table();
-					trans.exec(create_query);
-
-					std::string insert_query = (
-							"INSERT INTO " + request.output_table() + " VALUES (");
-					int insert_cnt = 0;
-					create_query = "CREATE TABLE " + request.output_table() + "(";
-					for (int i = 0; i < request.data().columns_size(); ++i) {
-						if (i > 0) {
-							insert_query += ", ";
-							create_query += ", ";
+		}
+
+		// Table the rows are written into: the staging table if it is swapped
+		// in for the output table at the end.
+		std::string WrittenTable(const MakeDataMartRequest &settings) const {
+			return settings.output_table() + (output_staging_ ? kStagingSuffix : "");
+		}
+
+		// Recreates the written table for the columns of data.
+		void CreateOutputTable(
+				pqxx::work *trans,
+				const MakeDataMartRequest &settings,
+				const DataMart &data) {
+			try {
+				std::string table = WrittenTable(settings);
+				trans->exec("DROP TABLE IF EXISTS " + table);
+
+				std::string create_query = (
+						"CREATE TABLE " + table + "(");
+				for (int i = 0; i < data.columns_size(); ++i) {
+					if (i > 0) create_query += ", ";
+					create_query += (
+							data.columns(i).name() + " " + utils::GetSqlType(data.columns(i)));
+				}
+				for (const char *name : {"grid_id", "square_id"}) {
+					create_query += ", " + settings.prefix() + name + " integer";
+				}
+				for (int i = 0; i < settings.tables_size(); ++i) {
+					for (int j = 0; j < settings.tables(i).radii_size(); ++j) {
+						std::string col_name = (
+								settings.prefix() + settings.tables(i).table_name() + "_"
+								+ std::to_string(settings.tables(i).radii(j)));
+						for (size_t z = 0; z < col_name.size(); ++z) {
+							if (col_name[z] == '.') col_name[z] = '_';
 						}
-						create_query += request.data().columns(i).name();
-						int kFloatVal = utils::DataMartCell::DataTypeCase::kFloatVal;
-						int kStrVal = utils::DataMartCell::DataTypeCase::kStrVal;
-						int kIntVal = utils::DataMartCell::DataTypeCase::kIntVal;
-						int type =  request.data().columns(i).cells(0).data_type_case();
-						if (type == kFloatVal) create_query += " float";
-						else if (type == kStrVal) create_query += " text";
-						else if (type == kIntVal) create_query += " integer";
-						insert_query += "$" + std::to_string(++insert_cnt);
+						create_query += ", " + col_name + " integer";
 					}
-					for (const auto &col: {grid_col, id_col}) {
-						create_query += ", ";
-						insert_query += ", ";
-						create_query += col->name();
-						create_query += " integer";
-						insert_query += "$" + std::to_string(++insert_cnt);
+				}
+				create_query += ")";
+				LOG(DEBUG) << "Creating table " << table;
+				trans->exec(create_query);
+			} catch (const pqxx::sql_error &e) {
+				LOG(ERROR) << "SQL Error:\n" << e.what() << "Query:\n" << e.query();
+				throw e;
+			}
+		}
+
+		// Appends the rows of chunk to the written table with COPY.
+		void InsertRows(
+				pqxx::work *trans,
+				const MakeDataMartRequest &settings,
+				const DataMart &data,
+				const MartChunk &chunk) {
+			try {
+				LOG(DEBUG) << "Copying " << data.nrows() << " rows";
+				pqxx::tablewriter writer(*trans, WrittenTable(settings));
+				std::string rows;
+				for (int i = 0; i < data.nrows(); ++i) {
+					for (const auto &column : data.columns()) {
+						utils::AppendCopyValue(column, i, &rows);
+						rows.push_back('\t');
 					}
-					for (size_t i = 0; i < result.size(); ++i) {
-						for (int j = 0; j < request.tables(i).radii_size(); ++j) {
-							create_query += ", ";
-							insert_query += ", ";
-							std::string col_name = (
-									request.prefix() + request.tables(i).table_name() + "_"
-									+ std::to_string(request.tables(i).radii(j)));
-							for (size_t z = 0; z < col_name.size(); ++z) {
-								if (col_name[z] == '.') col_name[z] = '_';
-							}
-							create_query += col_name;
-							create_query += " integer";
-							insert_query += "$" + std::to_string(++insert_cnt);
+					rows += std::to_string(chunk.grid_ids[i]);
+					rows.push_back('\t');
+					rows += std::to_string(chunk.square_ids[i]);
+					for (const auto &table : chunk.result) {
+						for (const auto &values : table) {
+							rows.push_back('\t');
+							rows += std::to_string(values[i]);
 						}
 					}
-					create_query += ")";
-					insert_query += ")";
-					LOG(DEBUG) << "Creating table";
-					trans.exec(create_query);
-
-					LOG(DEBUG) << "Inserting rows";
-					db_conn.prepare("insert_row", insert_query);
-
-					for (int i = 0; i < request.data().nrows(); ++i) {
-						auto query = trans.prepared("insert_row");
-						for (int j = 0; j < request.data().columns_size(); ++j) {
-							int kFloatVal = utils::DataMartCell::DataTypeCase::kFloatVal;
-							int kStrVal = utils::DataMartCell::DataTypeCase::kStrVal;
-							int kIntVal = utils::DataMartCell::DataTypeCase::kIntVal;
-							int type =  request.data().columns(j).cells(i).data_type_case();
-							if (type == kFloatVal)
-								query(request.data().columns(j).cells(i).float_val());
-							else if (type == kStrVal)
-								query(request.data().columns(j).cells(i).str_val());
-							else if (type == kIntVal)
-								query(request.data().columns(j).cells(i).int_val());
-						}
-						query(grid_col->cells(i).int_val());
-						query(id_col->cells(i).int_val());
-						for (size_t z = 0; z < result.size(); ++z) {
-							for (int j = 0; j < request.tables(z).radii_size(); ++j) {
-								query(result[z][j].cells(i).int_val());
-							}
-						}
-						query.exec();
+					rows.push_back('\n');
+					if (rows.size() >= processing::kDefaultWriterBatchBytes) {
+						writer.write_raw_line(rows);
+						rows.clear();
 					}
-					trans.commit();
-				} catch (const pqxx::sql_error &e) {
-					LOG(ERROR) << "SQL Error:\n" << e.what() << "Query:\n" << e.query();
-					throw e;
 				}
+				if (!rows.empty()) writer.write_raw_line(rows);
+				writer.complete();
+			} catch (const pqxx::sql_error &e) {
+				LOG(ERROR) << "SQL Error:\n" << e.what() << "Query:\n" << e.query();
+				throw e;
+			}
+		}
+
+		// Swaps the staging table in for the output table. The old table is
+		// locked only from here to the end of trans.
+		void FinishOutputTable(
+				pqxx::work *trans, const MakeDataMartRequest &settings) {
+			if (!output_staging_) return;
+			try {
+				const std::string &table = settings.output_table();
+				std::string staging = WrittenTable(settings);
+				trans->exec("DROP TABLE IF EXISTS " + table);
+				trans->exec(
+						"ALTER TABLE " + staging + " RENAME TO " +
+						table.substr(table.rfind('.') + 1));
+			} catch (const pqxx::sql_error &e) {
+				LOG(ERROR) << "SQL Error:\n" << e.what() << "Query:\n" << e.query();
+				throw e;
+			}
+		}
+
+		void MakeDataMart(
+				const MakeDataMartRequest &request,
+				const std::string &client,
+				MakeDataMartResponse *response) {
+			MartChunk chunk;
+			CalculateChunk(request, request.data(), client, &chunk);
+			FillMart(request, request.data(), chunk, response->mutable_data());
+			if (request.output_table().size() > 0) {
+				pqxx::connection db_conn(connection_string_);
+				pqxx::work trans(db_conn);
+				CreateOutputTable(&trans, request, request.data());
+				InsertRows(&trans, request, request.data(), chunk);
+				FinishOutputTable(&trans, request);
+				trans.commit();
 			}
 			LOG(INFO) << "Response created";
 		}
 
 		std::string connection_string_;
-		std::vector<grids::GridMetadata> regions_;
+		std::unique_ptr<grids::GridIndex> index_;
+		std::map<int, int> grid_sides_;
 		int threads_;
+		bool output_staging_;
+		std::unique_ptr<processing::RadiiCache> cache_;
+		std::unique_ptr<utils::ResultCache> result_cache_;
+		utils::ConnectionPool connections_;
+		utils::WorkerPool workers_;
 };
 
 void RunServer(
 		const std::string &connection_string,
-		int port, int max_message_size, int threads_per_request) {
+		int port, int max_message_size,
+		int workers, int db_connections, int threads_per_request,
+		size_t cache_bytes, bool output_staging,
+		const std::string &result_cache_dir, size_t result_cache_bytes) {
 	int max_message_size_bytes = max_message_size * 1024 * 1024;
-	DataMartManagerImpl service(connection_string, threads_per_request);
+	DataMartManagerImpl service(
+			connection_string, workers, db_connections, threads_per_request,
+			cache_bytes, output_staging, result_cache_dir, result_cache_bytes);
 
 	std::string server_address = std::string("0.0.0.0:") + std::to_string(port);
 
@@ -360,6 +645,9 @@ int main(int argc, char **argv) {
 	gflags::ParseCommandLineFlags(&argc, &argv, true);
 	RunServer(
 			GetConnectionString(), FLAGS_port, FLAGS_max_message_size,
-			FLAGS_threads_per_request);
+			FLAGS_workers, FLAGS_db_connections, FLAGS_threads_per_request,
+			(size_t) FLAGS_radii_cache_mb << 20,
+			FLAGS_output_staging,
+			FLAGS_result_cache_dir, (size_t) FLAGS_result_cache_mb << 20);
 	return 0;
 }
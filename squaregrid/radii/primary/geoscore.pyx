@@ -14,7 +14,7 @@ from utils.datamart_pb2 import DataMart
 from grids.pywrap_grid_metadata cimport GridMetadata, PywrapGridMetadata
 from grids.pywrap_grid_metadata import LoadGridsMetadata
 from processing.geocoder import geocode
-from utils.datamart import create_datamart_from_df, create_df_from_datamart
+from utils.datamart import create_df_from_datamart, iter_datamart_chunks
 from utils.pywrap_common cimport float_t, GeoCoords
 from utils.pywrap_helpers cimport Averager
 
@@ -71,24 +71,30 @@ def do_geoscore(args):
 	channel = grpc.insecure_channel(args.dmm_url, grpc_options)
 	stub = DataMartManagerStub(channel)
 
+	def requests(target):
+		for i, data in enumerate(iter_datamart_chunks(df)):
+			request = MakeDataMartRequest()
+			request.data.CopyFrom(data)
+			if i == 0:
+				request.latitude_column = list(df.columns).index('%s_lat' % target)
+				request.longitude_column = list(df.columns).index('%s_lng' % target)
+				request.prefix = '%s_' % target
+				radii_table = request.tables.add()
+				radii_table.table_name = 'radii.bank'
+				radii_table.radii.extend(args.radii)
+				request.return_mart = True
+			yield request
+
 	for target in ['fact', 'wrk']:
-		request = MakeDataMartRequest()
-		data = create_datamart_from_df(df)
-		request.data.CopyFrom(data)
-		request.latitude_column = list(df.columns).index('%s_lat' % target)
-		request.longitude_column = list(df.columns).index('%s_lng' % target)
-		request.prefix = '%s_' % target
-		radii_table = request.tables.add()
-		radii_table.table_name = 'radii.bank'
-		radii_table.radii.extend(args.radii)
-		request.return_mart = True
 		logging.debug(
 				'Sending request to DMManager: attaching radii for %s' % target)
-		response = stub.MakeDataMart(request)
-		if response.error != 0:
-			logging.error(response.comment)
-			raise RuntimeError('Failed to execute request to DMManager')
-		df = create_df_from_datamart(response.data)
+		chunks = list()
+		for response in stub.StreamDataMart(requests(target)):
+			if response.error != 0:
+				logging.error(response.comment)
+				raise RuntimeError('Failed to execute request to DMManager')
+			chunks.append(create_df_from_datamart(response.data))
+		df = pandas.concat(chunks, ignore_index=True)
 
 		df['banks_closer_to_%s' % target] = [0] * len(df)
 		for idx, row in df.iterrows():
@@ -21,14 +21,20 @@ int main(int argc, char **argv) {
 	START_EASYLOGGINGPP(argc, argv);
 	gflags::ParseCommandLineFlags(&argc, &argv, true);
 
-	auto cells = grids::EnumerateGridCells(FLAGS_grid_half_size);
+	int count = 4 * FLAGS_grid_half_size * FLAGS_grid_half_size;
+	std::vector<int> ids(count), legacy_ids(count);
+	for (int id = 0; id < count; ++id) {
+		ids[id] = id;
+	}
+	grids::ConvertCellIds(
+			ids.data(), count, FLAGS_grid_half_size,
+			grids::CellNumeration::kSpiral, grids::CellNumeration::kLegacy,
+			legacy_ids.data());
 	std::ostream *out = (
 			FLAGS_output.empty() ? &std::cout : new std::ofstream(FLAGS_output));
 	(*out) << "id" << FLAGS_delimiter << "legacy_id" << std::endl;
-	for (size_t id = 0; id < cells.size(); ++id) {
-		(*out) << id << FLAGS_delimiter;
-		(*out) << cells[id].first * 2 * FLAGS_grid_half_size + cells[id].second;
-		(*out) << std::endl;
+	for (int id = 0; id < count; ++id) {
+		(*out) << id << FLAGS_delimiter << legacy_ids[id] << std::endl;
 	}
 	if (!FLAGS_output.empty()) {
 		delete out;
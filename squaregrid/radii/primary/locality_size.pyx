@@ -1,12 +1,10 @@
-from libcpp.vector cimport vector
-from libcpp.utility cimport pair
+from grids.pywrap_grid_metadata import cell_coords
 
-from grids.pywrap_grid_metadata cimport EnumerateGridCells
-from processing.pywrap_data_grid cimport DataGrid
-from processing.pywrap_radii_summation cimport CalculateRadii
+from processing.pywrap_radii_summation import CalculateRadiiFromGrid
 
 import argparse
 import logging
+import numpy
 import pandas
 
 def main():
@@ -31,20 +29,14 @@ def main():
 			logging.error('All radii must be multiple of 100')
 			return
 
-	cdef int n = 2 * args.grid_half_size, max_R = max(args.radii) // 100, i, j
-	cdef DataGrid[int] grid = DataGrid[int](n)
-	cdef vector[DataGrid[int]] radii
-	cdef vector[pair[int,int]] cells = EnumerateGridCells(args.grid_half_size)
+	cdef int n = 2 * args.grid_half_size, max_R = max(args.radii) // 100
+	cells_x, cells_y = cell_coords(numpy.arange(n * n), args.grid_half_size)
 
-	for i in range(n):
-		for j in range(n):
-			grid[i][j] = 1
-
-	CalculateRadii[int](grid, max_R + 1, &radii, True)
+	radii = CalculateRadiiFromGrid(
+			numpy.ones((n, n), dtype=numpy.int32), max_R + 1, True)
 	df = pandas.DataFrame({'square_id': range(n * n)})
 	for r in args.radii:
-		df['locality_' + str(r)] = df['square_id'].apply(
-				lambda x: radii[r // 100][cells[x].first][cells[x].second])
+		df['locality_' + str(r)] = radii[r // 100][cells_x, cells_y]
 	df.to_csv(args.output_file, index=False)
 	print(df.head())
 
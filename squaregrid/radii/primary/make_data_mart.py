@@ -15,7 +15,7 @@ from primary.data_mart_manager_pb2 import MakeDataMartRequest
 from utils.datamart_pb2 import DataMart
 
 from processing.geocoder import geocode
-from utils.datamart import create_datamart_from_df, create_df_from_datamart
+from utils.datamart import CHUNK_ROWS, create_df_from_datamart, iter_datamart_chunks
 
 options=[
 	('grpc.max_send_message_length', 2000 * 1024 * 1024),
@@ -24,38 +24,43 @@ options=[
 
 def make_data_mart(
 		df, prefix, lat_col, lng_col, tables, url,
-		output_table, output_file):
+		output_table, output_file, chunk_rows=CHUNK_ROWS):
 
 	channel = grpc.insecure_channel(url, options)
 	stub = DataMartManagerStub(channel)
 
-	request = MakeDataMartRequest()
-
-	data = create_datamart_from_df(df)
-	request.data.CopyFrom(data)
-	request.longitude_column = list(df.columns).index(lng_col)
-	request.latitude_column = list(df.columns).index(lat_col)
-	request.prefix = prefix
-	for t in tables:
-		r = tables[t]
-		cur = request.tables.add()
-		cur.table_name = t
-		cur.radii.extend(r)
-	if output_table is not None:
-		request.output_table = output_table
-	request.return_mart = output_file is not None
-
-	logging.debug('Sending request to DMManager')
-
-	response = stub.MakeDataMart(request)
-	if response.error != 0:
-		logging.error(response.comment)
-		raise RuntimeError('Failed to execute request to DMManager')
-
-	df = create_df_from_datamart(response.data)
-	if output_file is not None:
-		print(df.head())
-		df.to_csv(output_file, index=False)
+	def requests():
+		for i, data in enumerate(iter_datamart_chunks(df, chunk_rows)):
+			request = MakeDataMartRequest()
+			request.data.CopyFrom(data)
+			if i == 0:
+				request.longitude_column = list(df.columns).index(lng_col)
+				request.latitude_column = list(df.columns).index(lat_col)
+				request.prefix = prefix
+				for t in tables:
+					r = tables[t]
+					cur = request.tables.add()
+					cur.table_name = t
+					cur.radii.extend(r)
+				if output_table is not None:
+					request.output_table = output_table
+				request.return_mart = output_file is not None
+			yield request
+
+	logging.debug('Streaming request to DMManager')
+
+	first = True
+	for response in stub.StreamDataMart(requests()):
+		if response.error != 0:
+			logging.error(response.comment)
+			raise RuntimeError('Failed to execute request to DMManager')
+		if output_file is not None:
+			chunk = create_df_from_datamart(response.data)
+			if first:
+				print(chunk.head())
+			chunk.to_csv(
+					output_file, index=False, header=first, mode='w' if first else 'a')
+		first = False
 
 def main():
 	logging.basicConfig(
@@ -88,6 +93,8 @@ def main():
 			help='File with JSON with description of needed radii tables')
 	parser.add_argument('--data_mart_manager_url', type=str,
 			default='localhost:55556', help='Address of DMManager service')
+	parser.add_argument('--chunk_rows', type=int, default=CHUNK_ROWS,
+			help='Rows sent to DMManager per message')
 
 	parser.add_argument('--geocode', action='store_true', help='Geocode data?')
 	parser.add_argument('--geocoder_url', type=str, default='localhost:55555',
@@ -115,7 +122,7 @@ def main():
 		df = make_data_mart(
 				df, args.prefix, args.lat_col, args.lng_col,
 				tables, args.data_mart_manager_url,
-				args.output_table, args.output_file)
+				args.output_table, args.output_file, args.chunk_rows)
 
 if __name__ == '__main__':
 	main()
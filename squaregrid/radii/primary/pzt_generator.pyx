@@ -4,7 +4,8 @@ from primary.pzt_generator_pb2_grpc import PZTGeneratorServicer
 from primary.pzt_generator_pb2_grpc import PZTGeneratorStub
 from primary.pzt_legacy_code import make_pzt
 from processing.geocoder import geocode
-from utils.datamart import create_df_from_datamart, create_datamart_from_df
+from utils.datamart import create_df_from_datamart, create_datamart_from_df, is_packed
+from utils.datamart import iter_datamart_chunks
 from utils.flask import FlaskServingThread
 
 import argparse
@@ -21,7 +22,45 @@ class PZTGenerator(PZTGeneratorServicer):
 	# gRPC API
 	def MakePZTMart(self, request, context):
 		logging.debug('MakePZTMartRequest recieved')
-		df = create_df_from_datamart(request.source_mart)
+		return self.MakeMart_(request, request.source_mart)
+
+	def StreamPZTMart(self, request_iterator, context):
+		logging.debug('StreamPZTMart request recieved')
+		# make_pzt matches organizations against all the offices at once, so
+		# the chunks are gathered and only the response is streamed
+		settings = None
+		dfs = []
+		for request in request_iterator:
+			if settings is None:
+				settings = request
+			dfs.append(create_df_from_datamart(request.source_mart))
+		if settings is None:
+			return
+		status, result_df = self.Calculate_(
+				settings, pandas.concat(dfs, ignore_index=True))
+		del dfs
+		if not settings.return_mart:
+			yield status
+			return
+		for data in iter_datamart_chunks(
+				result_df, packed=is_packed(settings.source_mart)):
+			response = MakePZTMartResponse()
+			response.CopyFrom(status)
+			response.data_mart.CopyFrom(data)
+			yield response
+	# end of gRPC API
+
+	def MakeMart_(self, request, source_mart):
+		response, result_df = self.Calculate_(
+				request, create_df_from_datamart(source_mart))
+		if request.return_mart:
+			response.data_mart.CopyFrom(create_datamart_from_df(
+					result_df, packed=is_packed(source_mart)))
+		return response
+
+	def Calculate_(self, request, df):
+		"""Response to the request without data_mart and the PZT of the
+		offices of df."""
 		logging.debug('Starting geocoding')
 		request_size_in_bytes = self.max_request_size_ * 1024 * 1024
 		df = geocode(
@@ -48,10 +87,7 @@ class PZTGenerator(PZTGeneratorServicer):
 				response.comment = (
 						'Failed to insert data into DB. '
 						'Table already exists (and does not match?)')
-		if request.return_mart:
-			response.data_mart.CopyFrom(create_datamart_from_df(result_df))
-		return response
-	# end of gRPC API
+		return response, result_df
 
 	def __init__(
 			self, sql_engine, geocoder_url, max_request_size, cores_per_request):
@@ -146,23 +182,34 @@ def execute_request(df, args):
 				('grpc.max_message_length', request_size_in_bytes)])
 	stub = PZTGeneratorStub(channel)
 
-	request = MakePZTMartRequest()
-	request.rank = args.rank
-	request.distance = args.distance
-	request.chunk_size = args.chunksize
-	if args.output_table is not None:
-		request.output_table = args.output_table
-	request.return_mart = args.output_file is not None
-	request.address_column = args.address_column
-	request.source_mart.CopyFrom(create_datamart_from_df(df))
-
-	response = stub.MakePZTMart(request)
-	if response.status != 0:
-		logging.error(response.comment)
-	else:
+	def requests():
+		for i, data in enumerate(iter_datamart_chunks(df)):
+			request = MakePZTMartRequest()
+			request.source_mart.CopyFrom(data)
+			if i == 0:
+				request.rank = args.rank
+				request.distance = args.distance
+				request.chunk_size = args.chunksize
+				if args.output_table is not None:
+					request.output_table = args.output_table
+				request.return_mart = args.output_file is not None
+				request.address_column = args.address_column
+			yield request
+
+	# the output file is written chunk by chunk as the responses come
+	responses = stub.StreamPZTMart(requests())
+	first = True
+	for response in responses:
+		if response.status != 0:
+			logging.error(response.comment)
+			responses.cancel()
+			break
 		if args.output_file is not None:
 			out_df = create_df_from_datamart(response.data_mart)
-			out_df.to_csv(args.output_file, index=False)
+			out_df.to_csv(
+					args.output_file, index=False, header=first,
+					mode='w' if first else 'a')
+		first = False
 	return response
 
 
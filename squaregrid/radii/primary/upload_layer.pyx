@@ -1,7 +1,6 @@
 from libcpp.vector cimport vector
-from libcpp.utility cimport pair
 
-from grids.pywrap_grid_metadata cimport EnumerateGridCells
+from grids.pywrap_grid_metadata import cell_coords
 import time
 import argparse
 import logging
@@ -58,7 +57,6 @@ def main():
 
 	cdef int n = 2 * int(args.grid_halfsize)
 	cdef int x, y, i
-	cdef vector[pair[int, int]] cells = EnumerateGridCells(args.grid_halfsize)
 	cdef vector[vector[float]] data = vector[vector[float]](n, vector[float](n))
 
 	if args.input_file is not None:
@@ -77,13 +75,10 @@ def main():
 	else:
 		raise ValueError('One of --input_file or --input_query must be specified')
 
-	for cur_id, cur_value in zip(df[args.id_col], df[args.data_col]):
-		if not args.legacy_ids:
-			x = cells[cur_id].first
-			y = cells[cur_id].second
-		else:
-			x = cur_id // n
-			y = cur_id % n
+	xs, ys = cell_coords(
+			df[args.id_col].values, args.grid_halfsize,
+			'legacy' if args.legacy_ids else 'spiral')
+	for x, y, cur_value in zip(xs, ys, df[args.data_col]):
 		# invert latitude axis
 		data[n - 1 - x][y] = cur_value
 
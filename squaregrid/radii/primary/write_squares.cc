@@ -80,9 +80,10 @@ int main(int argc, char **argv) {
 	for (const auto &grid : grids) {
 		LOG(INFO) << grid.GetName();
 		pqxx::work trans(db_conn);
-		auto cells = grids::EnumerateGridCells(grid.GetSide());
-		for (size_t id = 0; id < cells.size(); ++id) {
-			int lat_i = cells[id].first, lng_j = cells[id].second;
+		int n = 2 * grid.GetSide();
+		for (int id = 0; id < n * n; ++id) {
+			int lat_i, lng_j;
+			grids::GetCellCoords(id, grid.GetSide(), &lat_i, &lng_j);
 			auto query = trans.prepared("insert_square")
 				(grid.GetId())(id)(lat_i * grid.GetSide() * 2 + lng_j)
 				(grid.GetCenter(lat_i, lng_j).lat)
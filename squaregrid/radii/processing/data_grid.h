@@ -1,48 +1,137 @@
 #pragma once
 
+#include <algorithm>
+#include <memory>
 #include <vector>
 
 #include "grids/grid_metadata.h"
+#include "utils/aligned_allocator.h"
 
 namespace processing {
+	// Non-owning view of one DataGrid row.
+	template<typename DataType> class DataGridRow {
+		public:
+			DataGridRow(DataType *data, int size): data_(data), size_(size) {}
+
+			DataType& operator [] (int col_idx) const {
+				return data_[col_idx];
+			}
+
+			DataType* begin() const {
+				return data_;
+			}
+
+			DataType* end() const {
+				return data_ + size_;
+			}
+
+			int size() const {
+				return size_;
+			}
+
+		private:
+			DataType *data_;
+			int size_;
+	};
+
+	// Row-major grid in a single cache-aligned buffer. Rows are padded to a
+	// whole number of cache lines when the cell size allows it, so every row
+	// starts aligned.
 	template<typename DataType> class DataGrid {
 		public:
-			DataGrid(const grids::GridMetadata &metadata) {
-				data_.assign(
-						metadata.GetSide() * 2,
-						std::vector<DataType>(metadata.GetSide() * 2));
+			typedef std::vector<DataType, utils::AlignedAllocator<DataType> > Buffer;
+
+			DataGrid(const grids::GridMetadata &metadata)
+					: DataGrid(metadata.GetSide() * 2, metadata.GetSide() * 2) {}
+
+			DataGrid(int side): DataGrid(side, side) {}
+
+			DataGrid(int n, int m)
+					: DataGrid(n, m, std::make_shared<Buffer>(
+							(size_t) n * GetStride_(m)), 0) {}
+
+			DataGrid(): DataGrid(0, 0) {}
+
+			DataGrid(const DataGrid<DataType> &g): DataGrid(g.rows_, g.cols_) {
+				std::copy(g.cells_, g.cells_ + (size_t) g.rows_ * g.stride_, cells_);
 			}
 
-			DataGrid(const DataGrid<DataType> &g): data_(g.data_) {}
-			DataGrid(int side): data_(side, std::vector<DataType>(side)) {}
-			DataGrid(int n, int m): data_(n, std::vector<DataType>(m)) {}
-			DataGrid(): data_() {}
+			DataGrid(DataGrid<DataType> &&g) = default;
 
-			std::vector<DataType>& operator [] (int row_idx) {
-				return data_[row_idx];
+			DataGrid<DataType>& operator = (const DataGrid<DataType> &g) {
+				if (this != &g) *this = DataGrid<DataType>(g);
+				return *this;
 			}
 
-			const std::vector<DataType>& operator [] (int row_idx) const {
-				return data_[row_idx];
+			DataGrid<DataType>& operator = (DataGrid<DataType> &&g) = default;
+
+			// count grids of the same shape placed one after another in a single
+			// buffer, so the whole stack can be exposed as one 3D array. Copies of
+			// the grids get their own buffers.
+			static std::vector< DataGrid<DataType> > MakeStack(int count, int n, int m) {
+				size_t size = (size_t) n * GetStride_(m);
+				auto storage = std::make_shared<Buffer>(count * size);
+				std::vector< DataGrid<DataType> > stack;
+				stack.reserve(count);
+				for (int i = 0; i < count; ++i) {
+					stack.push_back(DataGrid<DataType>(n, m, storage, i * size));
+				}
+				return stack;
 			}
 
-			std::vector< std::vector<DataType> >& data() {
-				return data_;
+			DataGridRow<DataType> operator [] (int row_idx) {
+				return DataGridRow<DataType>(cells_ + (size_t) row_idx * stride_, cols_);
 			}
 
-			const std::vector< std::vector<DataType> >& data() const {
-				return data_;
+			DataGridRow<const DataType> operator [] (int row_idx) const {
+				return DataGridRow<const DataType>(
+						cells_ + (size_t) row_idx * stride_, cols_);
+			}
+
+			// Pointer to the first cell; cell (i, j) is at i * Stride() + j.
+			DataType* data() {
+				return cells_;
+			}
+
+			const DataType* data() const {
+				return cells_;
+			}
+
+			std::vector< std::vector<DataType> > ToVector() const {
+				std::vector< std::vector<DataType> > result;
+				for (int i = 0; i < rows_; ++i) {
+					auto row = (*this)[i];
+					result.emplace_back(row.begin(), row.end());
+				}
+				return result;
 			}
 
 			int NumRows() const {
-				return data_.size();
+				return rows_;
 			}
 
 			int NumCols() const {
-				if (data_.empty()) return 0;
-				return data_[0].size();
+				return cols_;
+			}
+
+			int Stride() const {
+				return stride_;
 			}
+
 		private:
-			std::vector< std::vector<DataType> > data_;
+			int rows_, cols_, stride_;
+			std::shared_ptr<Buffer> storage_;
+			DataType *cells_;
+
+			DataGrid(int n, int m, std::shared_ptr<Buffer> storage, size_t offset)
+					: rows_(n), cols_(m), stride_(GetStride_(m)),
+					  storage_(storage), cells_(storage->data() + offset) {}
+
+			static int GetStride_(int cols) {
+				const int size = sizeof(DataType), line = utils::kCacheLineSize;
+				if (size > line || line % size != 0) return cols;
+				const int cells_per_line = line / size;
+				return (cols + cells_per_line - 1) / cells_per_line * cells_per_line;
+			}
 	};
 }
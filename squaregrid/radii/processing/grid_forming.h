@@ -2,8 +2,12 @@
 
 #include <algorithm>
 #include <cmath>
+#include <functional>
+#include <unordered_map>
+#include <utility>
 #include <vector>
 
+#include "grids/grid_index.h"
 #include "grids/grid_metadata.h"
 #include "processing/data_grid.h"
 #include "utils/common.h"
@@ -12,29 +16,37 @@ namespace processing {
 
 using utils::GeoCoords;
 
-template<typename DataType> void FillDataGrid(
-		const std::vector< std::pair<GeoCoords, DataType> > &data,
-		const grids::GridMetadata &grid,
-		bool exclude_most_common, float_t tolerance,
-		DataGrid<DataType> *result) {
-	auto equal = [tolerance](
-			const std::pair<GeoCoords, DataType> &a,
-			const std::pair<GeoCoords, DataType> &b) {
-		return (
-				std::abs(a.first.lat - b.first.lat) < tolerance &&
-				std::abs(a.first.lng - b.first.lng) < tolerance);
-	};
+// A location where several points coincide up to tolerance.
+struct Hotspot {
+	GeoCoords location;
+	int count;
+};
 
-	auto compare = [](
-			const std::pair<GeoCoords, DataType> &a,
-			const std::pair<GeoCoords, DataType> &b) {
-		return (
-				std::make_pair(a.first.lat, a.first.lng) <
-				std::make_pair(b.first.lat, b.first.lng));
-	};
+struct _QuantizedCoordsHash {
+	size_t operator()(const std::pair<double, double> &key) const {
+		size_t h = std::hash<double>()(key.first);
+		return h ^ (std::hash<double>()(key.second) + 0x9e3779b9 + (h << 6) + (h >> 2));
+	}
+};
 
+// Cell of the tolerance sized lattice containing c; points of one cell are
+// considered to be at the same location.
+inline std::pair<double, double> _QuantizeCoords(
+		const GeoCoords &c, float_t tolerance) {
+	if (tolerance <= 0) return std::make_pair(c.lat, c.lng);
+	return std::make_pair(
+			std::floor(c.lat / tolerance), std::floor(c.lng / tolerance));
+}
 
-	*result = DataGrid<DataType>(grid);
+// Points of data inside the grid bbox. With exclude_most_common the most
+// frequent location (up to tolerance) is dropped if it holds more than one
+// point, and returned in excluded when it is not null.
+template<typename DataType> std::vector< std::pair<GeoCoords, DataType> >
+_SelectGridPoints(
+		const std::vector< std::pair<GeoCoords, DataType> > &data,
+		const grids::GridMetadata &grid,
+		bool exclude_most_common, float_t tolerance,
+		Hotspot *excluded = nullptr) {
 	std::vector< std::pair<GeoCoords, DataType> > coords;
 	for (const auto &row : data) {
 		float_t lat = row.first.lat, lng = row.first.lng;
@@ -43,32 +55,112 @@ template<typename DataType> void FillDataGrid(
 				coords.emplace_back(row);
 		}
 	}
+	if (excluded) {
+		*excluded = Hotspot{GeoCoords(), 0};
+	}
+	if (!exclude_most_common) return coords;
 
-	if (exclude_most_common && data.size() > 0) {
-		std::sort(coords.begin(), coords.end(), compare);
-		int max_cnt = 1, cur_cnt = 1;
-		auto max_it = coords.end();
-		for (auto it = ++coords.begin(); it != coords.end(); ++it) {
-			cur_cnt += equal(*it, *(it - 1)) ? 1 : -cur_cnt;
-			if (cur_cnt > max_cnt) {
-				max_cnt = cur_cnt;
-				max_it = it;
-			}
+	// count and the first point of every location
+	std::unordered_map<
+		std::pair<double, double>, std::pair<int, size_t>, _QuantizedCoordsHash> counts;
+	counts.reserve(coords.size());
+	int max_cnt = 1;
+	std::pair<double, double> max_key;
+	GeoCoords max_location;
+	for (size_t i = 0; i < coords.size(); ++i) {
+		auto key = _QuantizeCoords(coords[i].first, tolerance);
+		auto &count = counts.emplace(key, std::make_pair(0, i)).first->second;
+		if (++count.first > max_cnt) {
+			max_cnt = count.first;
+			max_key = key;
+			max_location = coords[count.second].first;
 		}
-		auto it = max_it;
-		while (it != coords.begin() && equal(*(it - 1), *it)) --it;
-		coords.erase(it, max_it + 1);
 	}
+	if (max_cnt < 2) return coords;
+	coords.erase(
+			std::remove_if(
+				coords.begin(), coords.end(),
+				[&](const std::pair<GeoCoords, DataType> &row) {
+					return _QuantizeCoords(row.first, tolerance) == max_key;
+				}),
+			coords.end());
+	if (excluded) {
+		*excluded = Hotspot{max_location, max_cnt};
+	}
+	return coords;
+}
 
-	for (const auto &row : coords) {
-		float_t lat = row.first.lat;
-		float_t lng = row.first.lng;
-		int x = std::floor((lat - grid.GetLatMin()) / grid.GetLatStep());
-		int y = std::floor((lng - grid.GetLngMin()) / grid.GetLngStep());
-		x = std::min(x, grid.GetSide() * 2 - 1);
-		y = std::min(y, grid.GetSide() * 2 - 1);
+inline void _GetGridCell(
+		const grids::GridMetadata &grid, const GeoCoords &c, int *x, int *y) {
+	*x = std::floor((c.lat - grid.GetLatMin()) / grid.GetLatStep());
+	*y = std::floor((c.lng - grid.GetLngMin()) / grid.GetLngStep());
+	*x = std::min(*x, grid.GetSide() * 2 - 1);
+	*y = std::min(*y, grid.GetSide() * 2 - 1);
+}
+
+// See _SelectGridPoints for exclude_most_common and excluded.
+template<typename DataType> void FillDataGrid(
+		const std::vector< std::pair<GeoCoords, DataType> > &data,
+		const grids::GridMetadata &grid,
+		bool exclude_most_common, float_t tolerance,
+		DataGrid<DataType> *result,
+		Hotspot *excluded = nullptr) {
+	*result = DataGrid<DataType>(grid);
+	for (const auto &row : _SelectGridPoints(
+				data, grid, exclude_most_common, tolerance, excluded)) {
+		int x, y;
+		_GetGridCell(grid, row.first, &x, &y);
 		(*result)[x][y] += row.second;
 	}
 }
 
+// Fills layers [first_layer, first_layer + channels) of (layer, value) points
+// into one grid with interleaved channels: layer l of the cell (x, y) is
+// stored at [x][y * channels + l - first_layer]. Every layer is filled as
+// FillDataGrid would do it on its own.
+template<typename DataType> void FillLayeredDataGrid(
+		const std::vector< std::pair<GeoCoords, std::pair<int, DataType> > > &data,
+		const grids::GridMetadata &grid,
+		int first_layer, int channels,
+		bool exclude_most_common, float_t tolerance,
+		DataGrid<DataType> *result) {
+	std::vector< std::vector< std::pair<GeoCoords, DataType> > > layers(channels);
+	for (const auto &row : data) {
+		int channel = row.second.first - first_layer;
+		if (channel < 0 || channel >= channels) continue;
+		layers[channel].emplace_back(row.first, row.second.second);
+	}
+
+	int side = grid.GetSide();
+	*result = DataGrid<DataType>(2 * side, 2 * side * channels);
+	for (int channel = 0; channel < channels; ++channel) {
+		if (layers[channel].empty()) continue;
+		for (const auto &row : _SelectGridPoints(
+					layers[channel], grid, exclude_most_common, tolerance)) {
+			int x, y;
+			_GetGridCell(grid, row.first, &x, &y);
+			(*result)[x][y * channels + channel] += row.second;
+		}
+	}
+}
+
+// Splits points by the grids of the index in a single pass. A point gets into
+// every grid whose bbox contains it, so FillDataGrid on a part gives the same
+// result as on the whole data.
+template<typename DataType>
+std::vector< std::vector< std::pair<GeoCoords, DataType> > > PartitionByGrids(
+		const std::vector< std::pair<GeoCoords, DataType> > &data,
+		const grids::GridIndex &index) {
+	std::vector< std::vector< std::pair<GeoCoords, DataType> > > result(
+			index.Size());
+	std::vector<int> found;
+	for (const auto &row : data) {
+		index.FindGrids(row.first, &found);
+		for (int grid : found) {
+			result[grid].emplace_back(row);
+		}
+	}
+	return result;
+}
+
 }  // namespace processing
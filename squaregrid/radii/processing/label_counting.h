@@ -0,0 +1,185 @@
+#pragma once
+
+#include <algorithm>
+#include <functional>
+#include <numeric>
+#include <queue>
+#include <utility>
+#include <vector>
+
+#include "grids/grid_metadata.h"
+#include "processing/grid_forming.h"
+#include "processing/radii_summation.h"
+#include "utils/common.h"
+
+namespace processing {
+
+// Points labelled with integer ids as sparse per-cell counts. The (label,
+// count) pairs of the cell (x, y), sorted by label, are entries[i] for
+// offsets[x * cols + y] <= i < offsets[x * cols + y + 1].
+struct LabelGrid {
+	int rows = 0, cols = 0;
+	std::vector<size_t> offsets;
+	std::vector< std::pair<int, int> > entries;
+};
+
+// Same as FillDataGrid of utils::OccurrenceCounter values for (label,
+// quantity) points, without a map per cell. Labels must be non-negative.
+inline void FillLabelGrid(
+		const std::vector< std::pair<GeoCoords, std::pair<int, int> > > &data,
+		const grids::GridMetadata &grid,
+		bool exclude_most_common, float_t tolerance,
+		LabelGrid *result) {
+	int side = grid.GetSide() * 2;
+	// (cell, (label, quantity))
+	std::vector< std::pair<int, std::pair<int, int> > > points;
+	for (const auto &row : _SelectGridPoints(
+				data, grid, exclude_most_common, tolerance)) {
+		int x, y;
+		_GetGridCell(grid, row.first, &x, &y);
+		points.emplace_back(x * side + y, row.second);
+	}
+	std::sort(points.begin(), points.end());
+
+	result->rows = result->cols = side;
+	result->offsets.assign((size_t) side * side + 1, 0);
+	result->entries.clear();
+	for (size_t i = 0; i < points.size(); ++i) {
+		if (i > 0 && points[i].first == points[i - 1].first &&
+				points[i].second.first == points[i - 1].second.first) {
+			result->entries.back().second += points[i].second.second;
+			continue;
+		}
+		result->entries.push_back(points[i].second);
+		++result->offsets[points[i].first + 1];
+	}
+	std::partial_sum(
+			result->offsets.begin(), result->offsets.end(), result->offsets.begin());
+}
+
+// Label counts of a set of cells of a LabelGrid that cells can be added to
+// and removed from, with the labels of positive counts listed, so that the
+// top ones are found without scanning all the labels.
+class _LabelWindow {
+	public:
+		_LabelWindow(const LabelGrid &grid, int labels)
+				: grid_(grid), counts_(labels), positions_(labels, -1) {}
+
+		void Add(int x, int y, int sign) {
+			size_t cell = (size_t) x * grid_.cols + y;
+			for (size_t i = grid_.offsets[cell]; i < grid_.offsets[cell + 1]; ++i) {
+				int label = grid_.entries[i].first;
+				counts_[label] += sign * grid_.entries[i].second;
+				if (counts_[label] > 0 && positions_[label] < 0) {
+					positions_[label] = active_.size();
+					active_.push_back(label);
+				} else if (counts_[label] <= 0 && positions_[label] >= 0) {
+					positions_[active_.back()] = positions_[label];
+					active_[positions_[label]] = active_.back();
+					active_.pop_back();
+					positions_[label] = -1;
+				}
+			}
+		}
+
+		void Clear() {
+			for (int label : active_) {
+				counts_[label] = 0;
+				positions_[label] = -1;
+			}
+			active_.clear();
+		}
+
+		// At most k (label, count) pairs of the largest counts, largest first,
+		// ties broken by the larger label.
+		void Top(int k, std::vector< std::pair<int, int> > *top) const {
+			// (count, label) with the smallest of the kept ones on top
+			std::priority_queue<
+				std::pair<int, int>, std::vector< std::pair<int, int> >,
+				std::greater< std::pair<int, int> > > heap;
+			for (int label : active_) {
+				auto item = std::make_pair(counts_[label], label);
+				if ((int) heap.size() < k) {
+					heap.push(item);
+				} else if (k > 0 && heap.top() < item) {
+					heap.pop();
+					heap.push(item);
+				}
+			}
+			top->resize(heap.size());
+			for (int i = (int) heap.size() - 1; i >= 0; --i) {
+				(*top)[i] = std::make_pair(heap.top().second, heap.top().first);
+				heap.pop();
+			}
+		}
+
+	private:
+		const LabelGrid &grid_;
+		std::vector<int> counts_;
+		// index in active_, -1 for labels of zero count
+		std::vector<int> positions_;
+		std::vector<int> active_;
+};
+
+// For every (x, y) of cells, the top k (label, count) pairs of the labels in
+// the disk of radius R around it, i.e. of the cells CalculateRadii sums into
+// the cumulative radius R, as _LabelWindow::Top orders them. Cells of a row
+// are visited left to right sliding the disk: a move by one cell removes and
+// adds O(R) cells instead of summing O(R^2) of them.
+inline void CalculateTopLabels(
+		const LabelGrid &grid, int R, int k,
+		const std::vector< std::pair<int, int> > &cells,
+		std::vector< std::vector< std::pair<int, int> > > *result) {
+	result->assign(cells.size(), {});
+	if (cells.empty() || k <= 0) return;
+
+	int labels = 0;
+	for (const auto &entry : grid.entries) {
+		labels = std::max(labels, entry.first + 1);
+	}
+	// heights[R + x] is the max y such that the disk holds (x, y), -1 if none
+	std::vector<int> heights(2 * R + 1, -1);
+	for (int x = -R; x <= R; ++x) {
+		for (int y = 0; y <= R && _GetOffsetRadius(x, y) <= R; ++y) {
+			heights[R + x] = y;
+		}
+	}
+
+	std::vector<size_t> order(cells.size());
+	std::iota(order.begin(), order.end(), 0);
+	std::sort(order.begin(), order.end(), [&cells](size_t a, size_t b) {
+		return cells[a] < cells[b];
+	});
+
+	_LabelWindow window(grid, labels);
+	// center of the disk in window, x < 0 if none
+	int x = -1, y = 0;
+	for (size_t i : order) {
+		int next_x = cells[i].first, next_y = cells[i].second;
+		if (next_x != x || next_y - y > R) {
+			// a new disk is cheaper than a long slide
+			window.Clear();
+			x = next_x;
+			y = next_y;
+			for (int dx = -R; dx <= R; ++dx) {
+				if (heights[R + dx] < 0 || x + dx < 0 || x + dx >= grid.rows) continue;
+				int from = std::max(0, y - heights[R + dx]);
+				int to = std::min(grid.cols - 1, y + heights[R + dx]);
+				for (int ny = from; ny <= to; ++ny) {
+					window.Add(x + dx, ny, 1);
+				}
+			}
+		}
+		for (; y < next_y; ++y) {
+			for (int dx = -R; dx <= R; ++dx) {
+				int height = heights[R + dx];
+				if (height < 0 || x + dx < 0 || x + dx >= grid.rows) continue;
+				if (y - height >= 0) window.Add(x + dx, y - height, -1);
+				if (y + height + 1 < grid.cols) window.Add(x + dx, y + height + 1, 1);
+			}
+		}
+		window.Top(k, &(*result)[i]);
+	}
+}
+
+}  // namespace processing
@@ -2,7 +2,13 @@ from libcpp.vector cimport vector
 
 from grids.pywrap_grid_metadata cimport GridMetadata
 
-cdef extern from "processing/data_grid.h" namespace "processing":
+cdef extern from "processing/data_grid.h" namespace "processing" nogil:
+	cdef cppclass DataGridRow[DataType]:
+		DataType& operator[](int)
+		DataType* begin()
+		DataType* end()
+		int size()
+
 	cdef cppclass DataGrid[DataType]:
 		DataGrid(const GridMetadata&)
 		DataGrid(const DataGrid[DataType]&)
@@ -10,8 +16,10 @@ cdef extern from "processing/data_grid.h" namespace "processing":
 		DataGrid(int)
 		DataGrid(int, int)
 
-		vector[DataType]& operator[](int)
-		vector[vector[DataType]]& data()
+		DataGridRow[DataType] operator[](int)
+		DataType* data()
+		vector[vector[DataType]] ToVector() const
 
 		int NumRows() const
 		int NumCols() const
+		int Stride() const
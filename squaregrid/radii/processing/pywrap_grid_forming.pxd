@@ -6,7 +6,7 @@ from grids.pywrap_grid_metadata cimport GridMetadata
 from processing.pywrap_data_grid cimport DataGrid
 from utils.pywrap_common cimport GeoCoords, float_t
 
-cdef extern from "processing/grid_forming.h" namespace "processing":
+cdef extern from "processing/grid_forming.h" namespace "processing" nogil:
 	void FillDataGrid[DataType](
 		const vector[pair[GeoCoords, DataType]] &data,
 		const GridMetadata &grid,
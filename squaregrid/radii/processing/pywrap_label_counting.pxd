@@ -0,0 +1,24 @@
+from libcpp.vector cimport vector
+from libcpp.utility cimport pair
+from libcpp cimport bool as bool_t
+
+from grids.pywrap_grid_metadata cimport GridMetadata
+from utils.pywrap_common cimport GeoCoords, float_t
+
+cdef extern from "processing/label_counting.h" namespace "processing" nogil:
+	cdef cppclass LabelGrid:
+		int rows
+		int cols
+		vector[size_t] offsets
+		vector[pair[int, int]] entries
+
+	void FillLabelGrid(
+		const vector[pair[GeoCoords, pair[int, int]]] &data,
+		const GridMetadata &grid,
+		bool_t exclude_most_common, float_t tolerance,
+		LabelGrid *result)
+
+	void CalculateTopLabels(
+		const LabelGrid &grid, int R, int k,
+		const vector[pair[int, int]] &cells,
+		vector[vector[pair[int, int]]] *result)
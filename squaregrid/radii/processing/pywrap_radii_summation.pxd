@@ -1,10 +1,28 @@
 from libcpp.vector cimport vector
+from libcpp.string cimport string
 from libcpp cimport bool as bool_t
 
 from processing.pywrap_data_grid cimport DataGrid
 
-cdef extern from "processing/radii_summation.h" namespace "processing":
+cdef extern from "processing/radii_summation.h" namespace "processing" nogil:
+	cdef enum RadiiEngine "processing::RadiiEngine":
+		kAuto "processing::RadiiEngine::kAuto"
+
+	bool_t ParseRadiiEngine(const string&, RadiiEngine*)
+
 	void CalculateRadii[DataType](
 			const DataGrid[DataType] &grid, int radii_count,
 			vector[DataGrid[DataType]] *result,
 			bool_t cumulative)
+
+	void CalculateRadii[DataType](
+			const DataGrid[DataType] &grid, int radii_count,
+			vector[DataGrid[DataType]] *result,
+			bool_t cumulative, RadiiEngine engine)
+
+cdef class PywrapRadii:
+	cdef vector[DataGrid[int]] c_radii
+	cdef Py_ssize_t shape[3]
+	cdef Py_ssize_t strides[3]
+
+	cdef void SetShape(self) except *
@@ -0,0 +1,138 @@
+from grids.pywrap_grid_metadata cimport PywrapGridMetadata
+from processing.pywrap_data_grid cimport DataGrid
+from processing.pywrap_grid_forming cimport FillDataGrid
+from utils.pywrap_common cimport GeoCoords, float_t
+
+cimport cython
+from cpython.buffer cimport (
+		PyBUF_ANY_CONTIGUOUS, PyBUF_C_CONTIGUOUS, PyBUF_F_CONTIGUOUS,
+		PyBUF_FORMAT, PyBUF_ND, PyBUF_STRIDES)
+from libcpp.vector cimport vector
+from libcpp.utility cimport pair
+from libcpp cimport bool as bool_t
+
+import numpy
+
+cdef class PywrapRadii:
+	"""Radii of one grid, exported as a (R + 1, rows, cols) int32 buffer.
+
+	The memory belongs to the C++ DataGrid stack; numpy.asarray() on this
+	object does not copy it.
+	"""
+	cdef void SetShape(self) except *:
+		cdef size_t r
+		cdef int rows = self.c_radii[0].NumRows()
+		cdef int stride = self.c_radii[0].Stride()
+		for r in range(self.c_radii.size()):
+			if self.c_radii[r].data() != self.c_radii[0].data() + r * rows * stride:
+				raise RuntimeError('Radii are not stored contiguously')
+		self.shape[0] = self.c_radii.size()
+		self.shape[1] = rows
+		self.shape[2] = self.c_radii[0].NumCols()
+		self.strides[2] = sizeof(int)
+		self.strides[1] = stride * sizeof(int)
+		self.strides[0] = rows * self.strides[1]
+
+	def __getbuffer__(self, Py_buffer *buffer, int flags):
+		# rows of the DataGrid may be padded beyond NumCols()
+		cdef bool_t padded = self.strides[1] != self.shape[2] * self.strides[2]
+		if padded and (flags & PyBUF_STRIDES) != PyBUF_STRIDES:
+			raise BufferError('Radii rows are padded, strides are required')
+		if padded and (
+				(flags & PyBUF_C_CONTIGUOUS) == PyBUF_C_CONTIGUOUS or
+				(flags & PyBUF_ANY_CONTIGUOUS) == PyBUF_ANY_CONTIGUOUS):
+			raise BufferError('Radii rows are padded, the buffer is not contiguous')
+		if (flags & PyBUF_F_CONTIGUOUS) == PyBUF_F_CONTIGUOUS:
+			raise BufferError('Radii are not Fortran contiguous')
+		buffer.buf = self.c_radii[0].data()
+		buffer.obj = self
+		buffer.len = self.shape[0] * self.shape[1] * self.shape[2] * sizeof(int)
+		buffer.readonly = 0
+		buffer.itemsize = sizeof(int)
+		buffer.format = NULL
+		if flags & PyBUF_FORMAT:
+			buffer.format = 'i'
+		buffer.ndim = 3
+		buffer.shape = NULL
+		if flags & PyBUF_ND:
+			buffer.shape = self.shape
+		buffer.strides = NULL
+		if (flags & PyBUF_STRIDES) == PyBUF_STRIDES:
+			buffer.strides = self.strides
+		buffer.suboffsets = NULL
+		buffer.internal = NULL
+
+	def __releasebuffer__(self, Py_buffer *buffer):
+		pass
+
+
+@cython.boundscheck(False)
+def CalculateRadiiArray(
+		lat, lng, values, PywrapGridMetadata grid, int radii_count,
+		bool_t cumulative=False, bool_t exclude_most_common=False,
+		float_t tolerance=1e-6, engine='auto'):
+	"""Sums values of points (lat[i], lng[i]) in radii of every grid cell.
+
+	values may be None to count points. Returns an int32 array of shape
+	(radii_count + 1, 2 * side, 2 * side) sharing memory with the C++ result.
+	The GIL is released while the grid is filled and radii are summed.
+	"""
+	cdef RadiiEngine c_engine
+	if not ParseRadiiEngine(engine.encode('utf-8'), &c_engine):
+		raise ValueError('Unknown radii engine: %s' % engine)
+	if radii_count < 0:
+		raise ValueError('radii_count must be non-negative')
+	if values is None:
+		values = numpy.ones(len(lat), dtype=numpy.int32)
+	if not len(lat) == len(lng) == len(values):
+		raise ValueError('lat, lng and values must have equal lengths')
+
+	cdef const float_t[::1] lat_view = numpy.ascontiguousarray(
+			lat, dtype=numpy.float32)
+	cdef const float_t[::1] lng_view = numpy.ascontiguousarray(
+			lng, dtype=numpy.float32)
+	cdef const int[::1] values_view = numpy.ascontiguousarray(
+			values, dtype=numpy.int32)
+	cdef vector[pair[GeoCoords, int]] data
+	cdef GeoCoords coords
+	cdef DataGrid[int] data_grid
+	cdef PywrapRadii result = PywrapRadii()
+	cdef Py_ssize_t i
+
+	with nogil:
+		data.reserve(lat_view.shape[0])
+		for i in range(lat_view.shape[0]):
+			coords.lat = lat_view[i]
+			coords.lng = lng_view[i]
+			data.push_back(pair[GeoCoords, int](coords, values_view[i]))
+		FillDataGrid[int](
+				data, grid.c_grid[0], exclude_most_common, tolerance, &data_grid)
+		CalculateRadii[int](
+				data_grid, radii_count, &result.c_radii, cumulative, c_engine)
+	result.SetShape()
+	return numpy.asarray(result)
+
+
+@cython.boundscheck(False)
+def CalculateRadiiFromGrid(
+		values, int radii_count, bool_t cumulative=False, engine='auto'):
+	"""Same as CalculateRadiiArray for an already filled 2D grid of values."""
+	cdef RadiiEngine c_engine
+	if not ParseRadiiEngine(engine.encode('utf-8'), &c_engine):
+		raise ValueError('Unknown radii engine: %s' % engine)
+	if radii_count < 0:
+		raise ValueError('radii_count must be non-negative')
+	cdef const int[:, :] values_view = numpy.asarray(values, dtype=numpy.int32)
+	cdef DataGrid[int] data_grid = DataGrid[int](
+			values_view.shape[0], values_view.shape[1])
+	cdef PywrapRadii result = PywrapRadii()
+	cdef int i, j
+
+	with nogil:
+		for i in range(values_view.shape[0]):
+			for j in range(values_view.shape[1]):
+				data_grid[i][j] = values_view[i, j]
+		CalculateRadii[int](
+				data_grid, radii_count, &result.c_radii, cumulative, c_engine)
+	result.SetShape()
+	return numpy.asarray(result)
@@ -0,0 +1,161 @@
+#pragma once
+
+#include <list>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+#include <pqxx/pqxx>
+
+#include "processing/radii_versions.h"
+
+namespace processing {
+
+// Fraction of the squares of a grid below which reading them by id is
+// cheaper than reading the whole grid.
+const double kPointFetchMaxDensity = 1. / 32;
+
+// Radii of one grid as stored in a radii table: row square_id holds the
+// columns _0, _100, ... of the square, zeros for squares without a row.
+struct StoredRadii {
+	int columns = 0;
+	std::vector<int> values;
+
+	int Squares() const {
+		return columns ? values.size() / columns : 0;
+	}
+
+	const int* operator[](int square_id) const {
+		return values.data() + (size_t) square_id * columns;
+	}
+
+	size_t Bytes() const {
+		return values.size() * sizeof(int);
+	}
+};
+
+// Thread-safe LRU cache of StoredRadii by table and grid id, bounded by the
+// total size of the values. Every entry keeps the version of the table it
+// was read from and is dropped once the table has another one, see
+// GetRadiiTableVersion.
+class RadiiCache {
+	public:
+		explicit RadiiCache(size_t budget_bytes)
+				: budget_bytes_(budget_bytes), bytes_(0) {}
+
+		RadiiCache(const RadiiCache&) = delete;
+		RadiiCache& operator=(const RadiiCache&) = delete;
+
+		std::shared_ptr<const StoredRadii> Get(
+				const std::string &table, int grid_id, const std::string &version) {
+			std::lock_guard<std::mutex> lock(mutex_);
+			auto it = entries_.find(std::make_pair(table, grid_id));
+			if (it == entries_.end()) return nullptr;
+			if (it->second->version != version) {
+				Erase_(it);
+				return nullptr;
+			}
+			lru_.splice(lru_.begin(), lru_, it->second);
+			return it->second->radii;
+		}
+
+		// Values larger than the whole budget are not kept.
+		void Put(
+				const std::string &table, int grid_id, const std::string &version,
+				std::shared_ptr<const StoredRadii> radii) {
+			std::lock_guard<std::mutex> lock(mutex_);
+			Key key(table, grid_id);
+			auto it = entries_.find(key);
+			if (it != entries_.end()) Erase_(it);
+			if (radii->Bytes() > budget_bytes_) return;
+			bytes_ += radii->Bytes();
+			lru_.push_front(Entry{key, version, std::move(radii)});
+			entries_[key] = lru_.begin();
+			while (bytes_ > budget_bytes_) {
+				Erase_(entries_.find(lru_.back().key));
+			}
+		}
+
+		size_t Bytes() const {
+			std::lock_guard<std::mutex> lock(mutex_);
+			return bytes_;
+		}
+
+	private:
+		typedef std::pair<std::string, int> Key;
+		struct Entry {
+			Key key;
+			std::string version;
+			std::shared_ptr<const StoredRadii> radii;
+		};
+
+		size_t budget_bytes_, bytes_;
+		std::list<Entry> lru_;
+		std::map<Key, std::list<Entry>::iterator> entries_;
+		mutable std::mutex mutex_;
+
+		void Erase_(std::map<Key, std::list<Entry>::iterator>::iterator it) {
+			bytes_ -= it->second->radii->Bytes();
+			lru_.erase(it->second);
+			entries_.erase(it);
+		}
+};
+
+inline std::shared_ptr<StoredRadii> LoadStoredRadii(
+		pqxx::work *trans, const std::string &table, int grid_id) {
+	pqxx::result grid = trans->exec(
+			"SELECT * FROM " + table +
+			" WHERE city_id = " + std::to_string(grid_id) +
+			" ORDER BY square_id");
+	auto radii = std::make_shared<StoredRadii>();
+	radii->columns = grid.columns() - 2;
+	if (grid.empty()) return radii;
+	int squares = grid[grid.size() - 1][1].as<int>() + 1;
+	radii->values.assign((size_t) squares * radii->columns, 0);
+	for (const auto &row : grid) {
+		int *values = radii->values.data() + (size_t) row[1].as<int>() * radii->columns;
+		for (int i = 0; i < radii->columns; ++i) {
+			values[i] = row[i + 2].as<int>();
+		}
+	}
+	return radii;
+}
+
+inline bool PreferPointFetch(size_t squares, int side) {
+	return squares < kPointFetchMaxDensity * 4 * side * side;
+}
+
+// Columns _0 ... _{100 * (columns - 1)} of the stored squares among
+// square_ids, by square id.
+inline std::unordered_map< int, std::vector<int> > LoadStoredSquares(
+		pqxx::work *trans, const std::string &table, int grid_id,
+		const std::vector<int> &square_ids, int columns) {
+	std::string select = "SELECT square_id", ids = "{";
+	for (int i = 0; i < columns; ++i) {
+		select += ", _" + std::to_string(i * 100);
+	}
+	for (size_t i = 0; i < square_ids.size(); ++i) {
+		if (i) ids += ",";
+		ids += std::to_string(square_ids[i]);
+	}
+	ids += "}";
+	pqxx::result res = trans->parameterized(
+			select + " FROM " + table +
+			" WHERE city_id = $1 AND square_id = ANY($2::integer[])")
+		(grid_id)(ids).exec();
+	std::unordered_map< int, std::vector<int> > squares;
+	for (const auto &row : res) {
+		auto &values = squares[row[0].as<int>()];
+		values.resize(columns);
+		for (int i = 0; i < columns; ++i) {
+			values[i] = row[i + 1].as<int>();
+		}
+	}
+	return squares;
+}
+
+}  // namespace processing
@@ -0,0 +1,359 @@
+#pragma once
+
+#include <functional>
+#include <map>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#include <boost/bind.hpp>
+#include <boost/thread/thread.hpp>
+#include <easylogging++.h>
+#include <pqxx/pqxx>
+#include <pqxx/tablewriter>
+
+#include "grids/grid_index.h"
+#include "grids/grid_metadata.h"
+#include "processing/data_grid.h"
+#include "processing/grid_forming.h"
+#include "processing/radii_summation.h"
+#include "processing/radii_writer.h"
+#include "processing/table_creation.h"
+#include "utils/common.h"
+#include "utils/connection_pool.h"
+
+namespace processing {
+
+// A unit of work: radii of the points of data_query in one grid, written to
+// output_table. cost is used to run expensive jobs first.
+struct RadiiJob {
+	int id;
+	std::string data_query;
+	std::string output_table;
+	int city_id;
+	double cost;
+};
+
+// Points of the job times the number of cells of its grid.
+inline double EstimateRadiiJobCost(int points, const grids::GridMetadata &grid) {
+	return (double) points * 4. * grid.GetSide() * grid.GetSide();
+}
+
+// Persistent table of radii jobs shared by any number of worker processes.
+// A worker claims a pending job by marking it as running on its connection,
+// which counts an attempt, and then writes the radii and marks the job as
+// done in one transaction. A running job whose connection is gone belongs to
+// a crashed worker and can be claimed again, until kMaxAttempts attempts.
+class RadiiJobTable {
+	public:
+		static const int kMaxAttempts = 3;
+
+		RadiiJobTable(pqxx::connection *conn, const std::string &table)
+				: conn_(conn), table_(table) {}
+
+		void Create() {
+			pqxx::work trans(*conn_);
+			trans.exec("DROP TABLE IF EXISTS " + table_ + ";");
+			trans.exec(
+					"CREATE TABLE " + table_ + " ("
+					"id serial PRIMARY KEY, data_query text NOT NULL,"
+					" output_table text NOT NULL, city_id integer NOT NULL,"
+					" cost double precision NOT NULL,"
+					" state text NOT NULL DEFAULT 'pending',"
+					" attempts integer NOT NULL DEFAULT 0, error text,"
+					" claimed_by integer, finished_at timestamp,"
+					" UNIQUE (output_table, city_id));");
+			trans.exec(
+					"CREATE INDEX ON " + table_ + " (cost DESC)"
+					" WHERE state <> 'done';");
+			trans.commit();
+		}
+
+		void Add(const std::vector<RadiiJob> &jobs) {
+			const std::vector<std::string> columns{
+				"data_query", "output_table", "city_id", "cost"};
+			pqxx::work trans(*conn_);
+			pqxx::tablewriter writer(trans, table_, columns.begin(), columns.end());
+			for (const auto &job : jobs) {
+				writer << std::vector<std::string>{
+					job.data_query, job.output_table,
+					std::to_string(job.city_id), std::to_string(job.cost)};
+			}
+			writer.complete();
+			trans.commit();
+		}
+
+		// Marks the most expensive pending or abandoned job as running on this
+		// connection and counts the attempt.
+		bool Claim(RadiiJob *job) {
+			pqxx::work trans(*conn_);
+			pqxx::result res = trans.exec(
+					"UPDATE " + table_ + " SET state = 'running',"
+					" attempts = attempts + 1, claimed_by = pg_backend_pid()"
+					" WHERE id = (SELECT id FROM " + table_ +
+					" WHERE attempts < " + std::to_string(kMaxAttempts) +
+					" AND (state = 'pending' OR state = 'running' AND claimed_by NOT IN"
+					" (SELECT pid FROM pg_stat_activity))"
+					" ORDER BY cost DESC LIMIT 1 FOR UPDATE SKIP LOCKED)"
+					" RETURNING id, data_query, output_table, city_id, cost;");
+			trans.commit();
+			if (res.empty()) return false;
+			job->id = res[0][0].as<int>();
+			job->data_query = res[0][1].as<std::string>();
+			job->output_table = res[0][2].as<std::string>();
+			job->city_id = res[0][3].as<int>();
+			job->cost = res[0][4].as<double>();
+			return true;
+		}
+
+		void Finish(pqxx::work *trans, const RadiiJob &job) {
+			trans->exec(
+					"UPDATE " + table_ + " SET state = 'done', finished_at = now()"
+					" WHERE id = " + std::to_string(job.id) + ";");
+		}
+
+		// Returns a job claimed on this connection to the pending ones; it is
+		// retried until kMaxAttempts attempts.
+		void Fail(const RadiiJob &job, const std::string &error) {
+			pqxx::work trans(*conn_);
+			trans.exec(
+					"UPDATE " + table_ + " SET state = 'pending', error = " +
+					trans.quote(error) + " WHERE id = " + std::to_string(job.id) +
+					" AND state = 'running' AND claimed_by = pg_backend_pid();");
+			trans.commit();
+		}
+
+		// Jobs which are not done.
+		int CountPending() {
+			pqxx::work trans(*conn_);
+			pqxx::result res = trans.exec(
+					"SELECT count(*) FROM " + table_ + " WHERE state <> 'done';");
+			trans.commit();
+			return res[0][0].as<int>();
+		}
+
+	private:
+		pqxx::connection *conn_;
+		std::string table_;
+};
+
+// Ring radii of the points in the grid as COPY rows, see _FormatRadiiRows.
+// Returns false if some value does not fit into smallint.
+inline bool _FormatRadiiJobRows(
+		const std::vector< std::pair<GeoCoords, int> > &values,
+		const grids::GridMetadata &grid,
+		int radii_count,
+		bool exclude_most_common, float_t tolerance,
+		RadiiEngine engine,
+		std::string *rows) {
+	DataGrid<int> data_grid(0, 0);
+	FillDataGrid(values, grid, exclude_most_common, tolerance, &data_grid);
+	std::vector< DataGrid<int> > radii;
+	CalculateRadii(data_grid, radii_count, &radii, false, engine);
+	return _FormatRadiiRows(grid, radii, 0, rows);
+}
+
+// Reads the points of the job and formats its rows, see _FormatRadiiJobRows.
+inline bool _CalculateRadiiJob(
+		pqxx::connection *conn,
+		const RadiiJob &job,
+		const grids::GridMetadata &grid,
+		int radii_count,
+		bool exclude_most_common, float_t tolerance,
+		RadiiEngine engine,
+		std::string *rows) {
+	std::vector< std::pair<GeoCoords, int> > values;
+	{
+		pqxx::work trans(*conn);
+		_ReadPoints<int, int>(&trans, job.data_query, &values);
+		trans.commit();
+	}
+	return _FormatRadiiJobRows(
+			values, grid, radii_count, exclude_most_common, tolerance, engine, rows);
+}
+
+// Turns the radii columns of table into integer unless they already are. It
+// is committed on its own before the job locks any rows of table: ALTER TABLE
+// in the job transaction would wait for the other jobs writing table while
+// holding the lock of its DELETE, which they may be waiting for.
+inline void _WidenRadiiJobColumns(
+		pqxx::connection *conn, const std::string &table, int radii_count) {
+	pqxx::work trans(*conn);
+	pqxx::result narrow = trans.exec(
+			"SELECT count(*) FROM pg_attribute WHERE attrelid = to_regclass(" +
+			trans.quote(table) + ") AND attnum > 2 AND NOT attisdropped"
+			" AND atttypid = 'smallint'::regtype;");
+	if (narrow[0][0].as<int>() > 0) {
+		_WidenRadiiColumns(&trans, table, radii_count);
+	}
+	trans.commit();
+}
+
+// Replaces the grid rows of the job in its output_table with rows within
+// trans and bumps the version of the table.
+inline void _WriteRadiiJob(
+		pqxx::work *trans, const RadiiJob &job, const std::string &rows) {
+	trans->exec(
+			"DELETE FROM " + job.output_table +
+			" WHERE city_id = " + std::to_string(job.city_id) + ";");
+	if (!rows.empty()) {
+		pqxx::tablewriter writer(*trans, job.output_table);
+		writer.write_raw_line(rows);
+		writer.complete();
+	}
+	BumpRadiiTableVersion(trans, job.output_table);
+}
+
+inline void _RunRadiiJobsWorker(
+		const std::string &connection_string,
+		const std::vector<grids::GridMetadata> &grids,
+		const std::string &jobs_table,
+		int radii_count,
+		bool exclude_most_common, float_t tolerance,
+		RadiiEngine engine) {
+	std::map<int, const grids::GridMetadata*> grids_by_id;
+	for (const auto &grid : grids) {
+		grids_by_id[grid.GetId()] = &grid;
+	}
+	pqxx::connection conn(connection_string);
+	RadiiJobTable table(&conn, jobs_table);
+	while (true) {
+		RadiiJob job = RadiiJob();
+		try {
+			if (!table.Claim(&job)) break;
+			auto grid = grids_by_id.find(job.city_id);
+			if (grid == grids_by_id.end()) {
+				throw std::runtime_error(
+						"Unknown grid " + std::to_string(job.city_id));
+			}
+			std::string rows;
+			bool fits = _CalculateRadiiJob(
+					&conn, job, *grid->second, radii_count,
+					exclude_most_common, tolerance, engine, &rows);
+			if (!fits) {
+				_WidenRadiiJobColumns(&conn, job.output_table, radii_count);
+			}
+			pqxx::work trans(conn);
+			_WriteRadiiJob(&trans, job, rows);
+			table.Finish(&trans, job);
+			trans.commit();
+			LOG(INFO) << "Finished grid " << grid->second->GetName() << " in "
+			          << job.output_table;
+		} catch (const std::exception &e) {
+			LOG(ERROR) << "Job " << job.id << " failed. Grid " << job.city_id
+			           << " in " << job.output_table << "\nerror = " << e.what();
+			try {
+				table.Fail(job, e.what());
+			} catch (const pqxx::failure &e) {
+				LOG(ERROR) << "Failed to record the error: " << e.what();
+				return;
+			}
+		}
+	}
+}
+
+// A job for each layer and grid with any of the (point, (layer, value)) rows
+// of values, with the cost of its number of points, see ScheduleRadiiJobs.
+inline std::vector<RadiiJob> _PlanRadiiJobs(
+		const std::vector< std::pair< GeoCoords, std::pair<int, int> > > &values,
+		const std::vector<grids::GridMetadata> &grids,
+		const std::function<std::string(int, const grids::GridMetadata&)> &grid_query,
+		const std::vector<std::string> &output_tables) {
+	int layers = output_tables.size();
+	grids::GridIndex index(grids);
+	std::vector< std::vector<int> > points(layers, std::vector<int>(grids.size()));
+	std::vector<int> found;
+	for (const auto &row : values) {
+		index.FindGrids(row.first, &found);
+		for (int grid : found) {
+			++points[row.second.first][grid];
+		}
+	}
+
+	std::vector<RadiiJob> jobs;
+	for (int layer = 0; layer < layers; ++layer) {
+		for (size_t i = 0; i < grids.size(); ++i) {
+			if (!points[layer][i]) continue;
+			jobs.push_back(RadiiJob{
+					0, grid_query(layer, grids[i]), output_tables[layer],
+					grids[i].GetId(), EstimateRadiiJobCost(points[layer][i], grids[i])});
+		}
+	}
+	return jobs;
+}
+
+// Recreates jobs_table and output_tables for the layers of layered_query,
+// whose (lat, lng, layer) rows give the points of every layer. A job is added
+// for each layer and grid with any points; it reads the points from
+// grid_query(layer, grid), which must select at least those in the grid bbox.
+inline void ScheduleRadiiJobs(
+		const std::string &connection_string,
+		const std::vector<grids::GridMetadata> &grids,
+		const std::string &jobs_table,
+		const std::string &layered_query,
+		const std::function<std::string(int, const grids::GridMetadata&)> &grid_query,
+		const std::vector<std::string> &output_tables,
+		int radii_count) {
+	int layers = output_tables.size();
+	std::vector< std::pair< GeoCoords, std::pair<int, int> > > values;
+	pqxx::connection conn(connection_string);
+	{
+		pqxx::work trans(conn);
+		int skipped = _ReadLayeredPoints<int, int>(
+				&trans, layered_query, layers, &values);
+		if (skipped) {
+			LOG(WARNING) << skipped << " rows skipped because of null or malformed values";
+		}
+		trans.commit();
+	}
+
+	std::vector<RadiiJob> jobs = _PlanRadiiJobs(
+			values, grids, grid_query, output_tables);
+
+	utils::ConnectionPool pool(connection_string, 1);
+	for (const auto &table : output_tables) {
+		RadiiWriter<int>(&pool, table).ResetTable(radii_count);
+	}
+	RadiiJobTable table(&conn, jobs_table);
+	table.Create();
+	table.Add(jobs);
+	LOG(INFO) << "Scheduled " << jobs.size() << " jobs in " << jobs_table;
+}
+
+// Runs threads workers claiming jobs of jobs_table until none is pending.
+// Any number of processes may run it against the same table concurrently.
+//
+// The claim, failure and retry rules need a DB. To check them with several
+// local processes, schedule the jobs of a few rubrics and run them:
+//   calculate_radii_objects --dbpass=... --jobs_table=test.radii_jobs
+//       --schedule_jobs --rbound=3
+// and, once "Scheduled ... jobs" is logged, start a few more processes with
+// the same flags except --schedule_jobs, each in a terminal of its own. Kill
+// some of them with kill -9 while they run: their running jobs are taken
+// over once their connections are gone, and
+//   SELECT state, attempts, claimed_by, error FROM test.radii_jobs
+// shows every job done after at most kMaxAttempts attempts.
+inline void RunRadiiJobs(
+		const std::string &connection_string,
+		const std::vector<grids::GridMetadata> &grids,
+		const std::string &jobs_table,
+		int radii_count,
+		bool exclude_most_common, float_t tolerance,
+		int threads,
+		RadiiEngine engine = RadiiEngine::kAuto) {
+	boost::thread_group workers;
+	for (int i = 0; i < threads; ++i) {
+		workers.create_thread(boost::bind(
+					_RunRadiiJobsWorker, boost::cref(connection_string),
+					boost::cref(grids), boost::cref(jobs_table), radii_count,
+					exclude_most_common, tolerance, engine));
+	}
+	workers.join_all();
+	pqxx::connection conn(connection_string);
+	int pending = RadiiJobTable(&conn, jobs_table).CountPending();
+	if (pending) {
+		LOG(WARNING) << pending << " jobs of " << jobs_table << " are not done";
+	}
+}
+
+}  // namespace processing
@@ -1,42 +1,118 @@
 #pragma once
 
+#include <algorithm>
 #include <cmath>
+#include <string>
+#include <tuple>
+#include <type_traits>
 #include <vector>
 
 #include "processing/data_grid.h"
+#include "utils/fft.h"
+#include "utils/helpers.h"
 
 namespace processing {
 
-template <typename DataType> void CalculateRadii(
-		const DataGrid<DataType> &grid,
-		int max_R,
-		std::vector< DataGrid<DataType> > *result,
-		bool cumulative) {
+enum class RadiiEngine {
+	kAuto,
+	kStencil,
+	kPrefixSums,
+	kFFT,
+};
+
+inline bool ParseRadiiEngine(const std::string &name, RadiiEngine *engine) {
+	if (name == "auto") {
+		*engine = RadiiEngine::kAuto;
+	} else if (name == "stencil") {
+		*engine = RadiiEngine::kStencil;
+	} else if (name == "prefix_sums") {
+		*engine = RadiiEngine::kPrefixSums;
+	} else if (name == "fft") {
+		*engine = RadiiEngine::kFFT;
+	} else {
+		return false;
+	}
+	return true;
+}
+
+// Types whose sums do not depend on the order of additions and which support
+// subtraction, so radii can be computed from prefix sums with bit-identical
+// results.
+template <typename DataType> struct IsExactlyAdditive
+		: std::is_integral<DataType> {};
+
+template <typename DataType>
+struct IsExactlyAdditive< utils::Averager<DataType> >
+		: std::is_integral<DataType> {};
+
+// Real-valued components of exactly additive types, used by the FFT engine.
+template <typename DataType> struct FFTChannels {
+	static const int kCount = 1;
+
+	static double Get(const DataType &value, int) {
+		return value;
+	}
 
+	static void Set(int, double value, DataType *result) {
+		*result = static_cast<DataType>(std::llround(value));
+	}
+};
+
+template <typename DataType> struct FFTChannels< utils::Averager<DataType> > {
+	static const int kCount = 2;
+
+	static double Get(const utils::Averager<DataType> &value, int channel) {
+		return channel == 0 ? value.sum : value.count;
+	}
+
+	static void Set(int channel, double value, utils::Averager<DataType> *result) {
+		if (channel == 0) {
+			result->sum = static_cast<DataType>(std::llround(value));
+		} else {
+			result->count = static_cast<int>(std::llround(value));
+		}
+	}
+};
+
+// Ring number of the cell shifted by (x, y) from the center one.
+inline int _GetOffsetRadius(int x, int y) {
+	float_t x_ = x, y_ = y;
+	if (x > 0) x_ = x + 0.5;
+	if (x < 0) x_ = x - 0.5;
+	if (y > 0) y_ = y + 0.5;
+	if (y < 0) y_ = y - 0.5;
+	return std::max(0, int(std::round(std::hypot(x_, y_))) - 1);
+}
+
+// All (radius, x, y) offsets of cells within max_R rings from the center.
+inline std::vector< std::tuple<int, int, int> > _GetRadiiOffsets(int max_R) {
 	std::vector< std::tuple<int, int, int> > radii;
 	for (int x = -max_R ; x <= max_R; x++) {
 		for (int y = -max_R ; y <= max_R; y++) {
-			float_t x_ = x, y_ = y;
-			if (x > 0) x_ = x + 0.5;
-			if (x < 0) x_ = x - 0.5;
-			if (y > 0) y_ = y + 0.5;
-			if (y < 0) y_ = y - 0.5;
-
-			int radius = std::max(0, int(std::round(std::hypot(x_, y_))) - 1);
+			int radius = _GetOffsetRadius(x, y);
 			if (radius > max_R) continue;
 			radii.emplace_back(radius, x, y);
 		}
 	}
+	return radii;
+}
+
+template <typename DataType> void CalculateRadiiStencil(
+		const DataGrid<DataType> &grid,
+		int max_R,
+		std::vector< DataGrid<DataType> > *result,
+		bool cumulative) {
 
-	*result = std::vector< DataGrid<DataType> >(
-			max_R + 1, grid.data().size());
+	auto radii = _GetRadiiOffsets(max_R);
+
+	int n = grid.NumRows(), m = grid.NumCols();
+	*result = DataGrid<DataType>::MakeStack(max_R + 1, n, m);
 
-	int n = grid.data().size();
 	for (int x = 0; x < n; ++x) {
-		for (int y = 0; y < n; ++y) {
+		for (int y = 0; y < m; ++y) {
 			for (const auto &t: radii) {
 				int nx = x + std::get<1>(t), ny = y + std::get<2>(t);
-				if (nx < 0 || nx >= n || ny < 0 || ny >= n) continue;
+				if (nx < 0 || nx >= n || ny < 0 || ny >= m) continue;
 				(*result)[std::get<0>(t)][x][y] += grid[nx][ny];
 			}
 		}
@@ -44,7 +120,7 @@ template <typename DataType> void CalculateRadii(
 	if (cumulative) {
 		for (int t = 1; t <= max_R; ++t) {
 			for (int x = 0; x < n; ++x) {
-				for (int y = 0; y < n; ++y) {
+				for (int y = 0; y < m; ++y) {
 					(*result)[t][x][y] += (*result)[t - 1][x][y];
 				}
 			}
@@ -52,4 +128,227 @@ template <typename DataType> void CalculateRadii(
 	}
 }
 
+// Padded side of the FFT engine: a power of two fitting the grid and a halo.
+inline int _GetFFTSide(int n, int m, int max_R) {
+	int side = 1;
+	while (side < std::max(n, m) + max_R) side *= 2;
+	return side;
+}
+
+// Rough cost model for kAuto. The prefix sums engine does ~(R + 1)^2 / 2 row
+// operations per cell, the FFT engine one padded 2D transform per disk and
+// channel. The weight of a butterfly relative to an integer row operation
+// was measured on 400x400 to 900x900 grids.
+inline bool _IsFFTCheaper(int n, int m, int max_R, int channels) {
+	const double kButterflyWeight = 5.5;
+	double side = _GetFFTSide(n, m, max_R);
+	double prefix_cost = 0.5 * n * m * (max_R + 1.) * (max_R + 2.);
+	double fft_cost = (
+			kButterflyWeight * channels * (max_R + 1.) *
+			side * side * std::log2(side));
+	return fft_cost < prefix_cost;
+}
+
+// Turns cumulative disk sums into ring sums in place.
+template <typename DataType> void _DisksToRings(
+		std::vector< DataGrid<DataType> > *result) {
+	for (int r = (int) result->size() - 1; r > 0; --r) {
+		auto &outer = (*result)[r];
+		const auto &inner = (*result)[r - 1];
+		for (int x = 0; x < outer.NumRows(); ++x) {
+			for (int y = 0; y < outer.NumCols(); ++y) {
+				outer[x][y] -= inner[x][y];
+			}
+		}
+	}
+}
+
+// Every disk {(x, y) : radius(x, y) <= r} is symmetric and convex along both
+// axes, so it splits into column pairs {-w, w} of height 2 * h_r(w) + 1. The
+// sum over such a column pair is a difference of two column prefix sums,
+// which makes each disk cost O(R) row operations instead of O(R^2) offsets.
+// Rings are obtained as differences of consecutive disks.
+// With channels > 1 every row holds NumCols() / channels cells of interleaved
+// independent layers; the inner loops then run over all layers at once.
+template <typename DataType> void CalculateRadiiPrefixSums(
+		const DataGrid<DataType> &grid,
+		int max_R,
+		std::vector< DataGrid<DataType> > *result,
+		bool cumulative,
+		int channels = 1) {
+	int n = grid.NumRows(), m = grid.NumCols();
+
+	// heights[r][w] is the max |x| such that radius(x, w) <= r, -1 if none.
+	std::vector< std::vector<int> > heights(
+			max_R + 1, std::vector<int>(max_R + 1, -1));
+	for (int r = 0; r <= max_R; ++r) {
+		for (int w = 0; w <= r; ++w) {
+			while (heights[r][w] < max_R &&
+					_GetOffsetRadius(heights[r][w] + 1, w) <= r) {
+				++heights[r][w];
+			}
+		}
+	}
+
+	*result = DataGrid<DataType>::MakeStack(max_R + 1, n, m);
+
+	// column[i][y] is the sum of cells (i', y - w) and (i', y + w) for i' < i.
+	DataGrid<DataType> column(n + 1, m);
+	for (int w = 0; w <= max_R; ++w) {
+		int shift = w * channels;
+		for (int i = 0; i < n; ++i) {
+			const auto row = grid[i];
+			const auto prev = column[i];
+			auto cur = column[i + 1];
+			for (int y = 0; y < m; ++y) {
+				cur[y] = prev[y];
+				if (y - shift >= 0) cur[y] += row[y - shift];
+				if (w > 0 && y + shift < m) cur[y] += row[y + shift];
+			}
+		}
+		for (int r = w; r <= max_R; ++r) {
+			int h = heights[r][w];
+			auto &disk = (*result)[r];
+			for (int x = 0; x < n; ++x) {
+				const DataType *__restrict lo = column[std::max(0, x - h)].begin();
+				const DataType *__restrict hi = column[std::min(n, x + h + 1)].begin();
+				DataType *__restrict out = disk[x].begin();
+				for (int y = 0; y < m; ++y) {
+					out[y] += hi[y] - lo[y];
+				}
+			}
+		}
+	}
+
+	if (!cumulative) {
+		_DisksToRings(result);
+	}
+}
+
+// Convolves the grid with every disk mask in the frequency domain, two masks
+// per transform (as real and imaginary parts). Cost is O(N^2 log N) per disk
+// where N is the padded side, independent of the radius. Values are rounded
+// back to integers, which is exact while sums stay well below 2^50.
+template <typename DataType> void CalculateRadiiFFT(
+		const DataGrid<DataType> &grid,
+		int max_R,
+		std::vector< DataGrid<DataType> > *result,
+		bool cumulative) {
+	typedef FFTChannels<DataType> Channels;
+	int n = grid.NumRows(), m = grid.NumCols();
+	int side = _GetFFTSide(n, m, max_R);
+	utils::FFTPlan plan(side);
+
+	std::vector< std::vector<utils::Complex> > spectra(
+			Channels::kCount, std::vector<utils::Complex>(side * side));
+	for (int c = 0; c < Channels::kCount; ++c) {
+		for (int x = 0; x < n; ++x) {
+			for (int y = 0; y < m; ++y) {
+				spectra[c][x * side + y] = Channels::Get(grid[x][y], c);
+			}
+		}
+		plan.Transform2D(&spectra[c], false);
+	}
+
+	*result = DataGrid<DataType>::MakeStack(max_R + 1, n, m);
+
+	std::vector<utils::Complex> mask(side * side), product(side * side);
+	for (int r = 0; r <= max_R; r += 2) {
+		bool has_pair = r + 1 <= max_R;
+		int mask_R = has_pair ? r + 1 : r;
+		std::fill(mask.begin(), mask.end(), utils::Complex());
+		for (int dx = -mask_R; dx <= mask_R; ++dx) {
+			for (int dy = -mask_R; dy <= mask_R; ++dy) {
+				int radius = _GetOffsetRadius(dx, dy);
+				auto &cell = mask[
+						((dx + side) % side) * side + (dy + side) % side];
+				cell = utils::Complex(
+						radius <= r ? 1 : 0, has_pair && radius <= r + 1 ? 1 : 0);
+			}
+		}
+		plan.Transform2D(&mask, false);
+		for (int c = 0; c < Channels::kCount; ++c) {
+			for (int i = 0; i < side * side; ++i) {
+				product[i] = spectra[c][i] * mask[i];
+			}
+			plan.Transform2D(&product, true, n);
+			for (int x = 0; x < n; ++x) {
+				for (int y = 0; y < m; ++y) {
+					const auto &value = product[x * side + y];
+					Channels::Set(c, value.real(), &(*result)[r][x][y]);
+					if (has_pair) {
+						Channels::Set(c, value.imag(), &(*result)[r + 1][x][y]);
+					}
+				}
+			}
+		}
+	}
+
+	if (!cumulative) {
+		_DisksToRings(result);
+	}
+}
+
+template <typename DataType> void CalculateRadii(
+		const DataGrid<DataType> &grid,
+		int max_R,
+		std::vector< DataGrid<DataType> > *result,
+		bool cumulative,
+		RadiiEngine engine = RadiiEngine::kAuto) {
+	if constexpr (IsExactlyAdditive<DataType>::value) {
+		if (engine == RadiiEngine::kAuto) {
+			bool fft = _IsFFTCheaper(
+					grid.NumRows(), grid.NumCols(), max_R,
+					FFTChannels<DataType>::kCount);
+			engine = fft ? RadiiEngine::kFFT : RadiiEngine::kPrefixSums;
+		}
+		if (engine == RadiiEngine::kFFT) {
+			CalculateRadiiFFT(grid, max_R, result, cumulative);
+			return;
+		}
+		if (engine == RadiiEngine::kPrefixSums) {
+			CalculateRadiiPrefixSums(grid, max_R, result, cumulative);
+			return;
+		}
+	}
+	CalculateRadiiStencil(grid, max_R, result, cumulative);
+}
+
+// Radii of rows [row_begin, row_end) of the grid only. Radii never reach
+// further than max_R cells, so it is enough to sum the band together with a
+// max_R rows halo on both sides: memory is O((band + R) * m * R) instead of
+// O(n * m * R). result[r] has row_end - row_begin rows. Grids of several
+// interleaved channels are always summed with prefix sums.
+template <typename DataType> void CalculateRadiiBand(
+		const DataGrid<DataType> &grid,
+		int max_R,
+		int row_begin, int row_end,
+		std::vector< DataGrid<DataType> > *result,
+		bool cumulative,
+		RadiiEngine engine = RadiiEngine::kAuto,
+		int channels = 1) {
+	int n = grid.NumRows(), m = grid.NumCols();
+	int halo_begin = std::max(0, row_begin - max_R);
+	int halo_end = std::min(n, row_end + max_R);
+
+	DataGrid<DataType> band(halo_end - halo_begin, m);
+	for (int x = halo_begin; x < halo_end; ++x) {
+		std::copy(grid[x].begin(), grid[x].end(), band[x - halo_begin].begin());
+	}
+	std::vector< DataGrid<DataType> > band_radii;
+	if (channels > 1) {
+		CalculateRadiiPrefixSums(band, max_R, &band_radii, cumulative, channels);
+	} else {
+		CalculateRadii(band, max_R, &band_radii, cumulative, engine);
+	}
+
+	*result = DataGrid<DataType>::MakeStack(max_R + 1, row_end - row_begin, m);
+	for (int r = 0; r <= max_R; ++r) {
+		for (int x = row_begin; x < row_end; ++x) {
+			const auto row = band_radii[r][x - halo_begin];
+			std::copy(row.begin(), row.end(), (*result)[r][x - row_begin].begin());
+		}
+	}
+}
+
 }  // namespace processing
@@ -0,0 +1,298 @@
+#pragma once
+
+#include <algorithm>
+#include <cctype>
+#include <map>
+#include <string>
+#include <tuple>
+#include <vector>
+
+#include <easylogging++.h>
+#include <pqxx/pqxx>
+#include <pqxx/tablewriter>
+
+#include "grids/grid_index.h"
+#include "grids/grid_metadata.h"
+#include "processing/grid_forming.h"
+#include "processing/radii_summation.h"
+#include "processing/radii_writer.h"
+#include "processing/table_creation.h"
+#include "utils/common.h"
+
+namespace processing {
+
+// Ring sums are linear in point values, so a set of added (positive) and
+// removed (negative) points changes only squares within max_R of them.
+// Returns these changes by square id, without squares whose rings do not
+// change at all.
+inline std::map< int, std::vector<int> > _CalculateRadiiDelta(
+		const std::vector< std::pair<GeoCoords, int> > &changes,
+		const grids::GridMetadata &grid,
+		int max_R) {
+	auto offsets = _GetRadiiOffsets(max_R);
+	int n = 2 * grid.GetSide();
+	std::map< int, std::vector<int> > delta;
+	for (const auto &change : changes) {
+		int x, y;
+		if (!grid.GetSquareCoords(change.first, &x, &y)) continue;
+		for (const auto &t : offsets) {
+			int cx = x - std::get<1>(t), cy = y - std::get<2>(t);
+			if (cx < 0 || cx >= n || cy < 0 || cy >= n) continue;
+			auto &rings = delta[grids::GetCellId(cx, cy, grid.GetSide())];
+			if (rings.empty()) rings.resize(max_R + 1);
+			rings[std::get<0>(t)] += change.second;
+		}
+	}
+	for (auto it = delta.begin(); it != delta.end(); ) {
+		bool zero = std::all_of(
+				it->second.begin(), it->second.end(), [](int v) { return v == 0; });
+		it = zero ? delta.erase(it) : ++it;
+	}
+	return delta;
+}
+
+// Adds delta to the stored rows of the grid: affected rows are read, deleted
+// and written back, rows which become empty are not.
+inline void _ApplyRadiiDelta(
+		pqxx::work *trans, const std::string &table,
+		const grids::GridMetadata &grid,
+		std::map< int, std::vector<int> > delta,
+		int max_R) {
+	const size_t kIdsPerQuery = 10000;
+	std::vector<std::string> id_lists;
+	size_t count = 0;
+	for (const auto &it : delta) {
+		if (count++ % kIdsPerQuery == 0) id_lists.emplace_back();
+		if (!id_lists.back().empty()) id_lists.back() += ",";
+		id_lists.back() += std::to_string(it.first);
+	}
+	std::string columns;
+	for (int i = 0; i <= max_R; ++i) {
+		columns += ", _" + std::to_string(i * 100);
+	}
+
+	std::string where = " WHERE city_id = " + std::to_string(grid.GetId());
+	for (const auto &ids : id_lists) {
+		pqxx::result stored = trans->exec(
+				"SELECT square_id" + columns + " FROM " + table + where +
+				" AND square_id IN (" + ids + ");");
+		for (const auto &row : stored) {
+			auto &rings = delta[row[0].as<int>()];
+			for (int i = 0; i <= max_R; ++i) {
+				rings[i] += row[i + 1].as<int>();
+			}
+		}
+		trans->exec(
+				"DELETE FROM " + table + where + " AND square_id IN (" + ids + ");");
+	}
+
+	bool fits = true;
+	for (const auto &it : delta) {
+		for (int value : it.second) {
+			fits &= -(1 << 15) <= value && value < (1 << 15);
+		}
+	}
+	if (!fits) {
+		_WidenRadiiColumns(trans, table, max_R);
+	}
+
+	pqxx::tablewriter writer(*trans, table);
+	std::vector<int> row;
+	for (const auto &it : delta) {
+		if (std::all_of(
+					it.second.begin(), it.second.end(), [](int v) { return v == 0; })) {
+			continue;
+		}
+		row = {grid.GetId(), it.first};
+		row.insert(row.end(), it.second.begin(), it.second.end());
+		writer.insert(row);
+	}
+	writer.complete();
+}
+
+// Updates radii of output_table in one transaction: added_query and
+// removed_query yield (lat, lng[, value]) rows of points which appeared and
+// disappeared since the table was computed. Either of them may be empty.
+// The version of output_table is bumped, see GetRadiiTableVersion.
+inline void _UpdateRadiiTable(
+		pqxx::work *trans,
+		const std::vector<grids::GridMetadata> &grids,
+		const std::string &added_query, const std::string &removed_query,
+		const std::string &output_table,
+		int radii_count) {
+	std::vector< std::pair<GeoCoords, int> > changes, removed;
+	int skipped = 0;
+	if (!added_query.empty()) {
+		skipped += _ReadPoints<int>(trans, added_query, &changes);
+	}
+	if (!removed_query.empty()) {
+		skipped += _ReadPoints<int>(trans, removed_query, &removed);
+	}
+	if (skipped) {
+		LOG(WARNING) << skipped << " rows skipped because of null or malformed values";
+	}
+	LOG(INFO) << changes.size() << " points added, "
+	          << removed.size() << " points removed";
+	for (const auto &row : removed) {
+		changes.emplace_back(row.first, -row.second);
+	}
+
+	auto parts = PartitionByGrids(changes, grids::GridIndex(grids));
+	for (size_t i = 0; i < grids.size(); ++i) {
+		if (parts[i].empty()) continue;
+		auto delta = _CalculateRadiiDelta(parts[i], grids[i], radii_count);
+		size_t squares = delta.size();
+		_ApplyRadiiDelta(trans, output_table, grids[i], std::move(delta), radii_count);
+		LOG(INFO) << "Updated " << squares << " squares of grid "
+		          << grids[i].GetName() << " in " << output_table;
+	}
+	// the table may predate the versions
+	CreateRadiiVersionsTable(trans);
+	BumpRadiiTableVersion(trans, output_table);
+}
+
+inline std::string _StripQuery(std::string query) {
+	while (!query.empty() && (std::isspace(query.back()) || query.back() == ';')) {
+		query.pop_back();
+	}
+	return query;
+}
+
+// Whether table exists with the columns city_id, square_id and the radii_count
+// + 1 rings _CalculateRadiiDelta yields, so that deltas can be applied to it.
+inline bool _HasRadiiColumns(
+		pqxx::work *trans, const std::string &table, int radii_count) {
+	pqxx::result columns = trans->exec(
+			"SELECT count(*) FROM pg_attribute WHERE attrelid = to_regclass(" +
+			trans->quote(table) + ") AND attnum > 0 AND NOT attisdropped;");
+	return columns[0][0].as<int>() == radii_count + 3;
+}
+
+// Incremental counterpart of CreateRadiiTableFromSQLConcurrently for summed
+// radii; see _UpdateRadiiTable. Returns false if output_table was not
+// updated, e.g. as it was computed for another radii_count.
+inline bool UpdateRadiiTableFromSQL(
+		const std::string &connection_string,
+		const std::vector<grids::GridMetadata> &grids,
+		const std::string &added_query, const std::string &removed_query,
+		const std::string &output_table,
+		int radii_count) {
+	try {
+		pqxx::connection conn(connection_string);
+		pqxx::work trans(conn);
+		if (!_HasRadiiColumns(&trans, output_table, radii_count)) {
+			LOG(ERROR) << output_table << " does not hold " << radii_count
+			           << " radii";
+			return false;
+		}
+		_UpdateRadiiTable(
+				&trans, grids, added_query, removed_query, output_table, radii_count);
+		trans.commit();
+	} catch (const pqxx::sql_error &e) {
+		LOG(ERROR) << "SQL error"
+		           << "\nerror = " << e.what()
+		           << "\nquery = " << e.query();
+		return false;
+	}
+	return true;
+}
+
+// Table data_query is saved into before radii are computed from it, it
+// becomes snapshot_table only once they are written.
+inline std::string FreshSnapshotTable(const std::string &snapshot_table) {
+	return snapshot_table + "_fresh";
+}
+
+// Replaces snapshot_table with the result of data_query.
+inline void SaveSnapshot(
+		const std::string &connection_string,
+		const std::string &data_query, const std::string &snapshot_table) {
+	pqxx::connection conn(connection_string);
+	pqxx::work trans(conn);
+	trans.exec("DROP TABLE IF EXISTS " + snapshot_table + ";");
+	trans.exec(
+			"CREATE TABLE " + snapshot_table + " AS " +
+			_StripQuery(data_query) + ";");
+	trans.commit();
+}
+
+inline void _ReplaceSnapshot(
+		pqxx::work *trans,
+		const std::string &fresh, const std::string &snapshot_table) {
+	trans->exec("DROP TABLE IF EXISTS " + snapshot_table + ";");
+	std::string name = snapshot_table.substr(snapshot_table.find('.') + 1);
+	trans->exec("ALTER TABLE " + fresh + " RENAME TO " + name + ";");
+}
+
+// Makes the fresh snapshot of snapshot_table, saved by SaveSnapshot, the one
+// radii are computed from, after they were written successfully. Radii
+// computed from it can later be updated by UpdateRadiiTableFromSnapshot.
+inline void CommitSnapshot(
+		const std::string &connection_string, const std::string &snapshot_table) {
+	pqxx::connection conn(connection_string);
+	pqxx::work trans(conn);
+	_ReplaceSnapshot(&trans, FreshSnapshotTable(snapshot_table), snapshot_table);
+	trans.commit();
+}
+
+// Drops snapshot_table and its fresh snapshot when radii computed from the
+// latter failed to be written: the table matches neither of them, so it has
+// to be recomputed in full next time.
+inline void DropSnapshot(
+		const std::string &connection_string, const std::string &snapshot_table) {
+	pqxx::connection conn(connection_string);
+	pqxx::work trans(conn);
+	trans.exec("DROP TABLE IF EXISTS " + snapshot_table + ";");
+	trans.exec(
+			"DROP TABLE IF EXISTS " + FreshSnapshotTable(snapshot_table) + ";");
+	trans.commit();
+}
+
+// Whether output_table can be updated by UpdateRadiiTableFromSnapshot: the
+// snapshot exists and the table holds radii_count radii.
+inline bool CanUpdateFromSnapshot(
+		const std::string &connection_string,
+		const std::string &snapshot_table, const std::string &output_table,
+		int radii_count) {
+	pqxx::connection conn(connection_string);
+	pqxx::work trans(conn);
+	pqxx::result snapshot = trans.exec(
+			"SELECT to_regclass(" + trans.quote(snapshot_table) + ") IS NOT NULL;");
+	return snapshot[0][0].as<bool>() &&
+			_HasRadiiColumns(&trans, output_table, radii_count);
+}
+
+// Brings output_table, computed from the points of snapshot_table, up to
+// date with data_query: only the difference of the two is applied, and the
+// snapshot is replaced in the same transaction. Returns false if nothing was
+// changed because of an error.
+inline bool UpdateRadiiTableFromSnapshot(
+		const std::string &connection_string,
+		const std::vector<grids::GridMetadata> &grids,
+		const std::string &data_query, const std::string &snapshot_table,
+		const std::string &output_table,
+		int radii_count) {
+	try {
+		pqxx::connection conn(connection_string);
+		pqxx::work trans(conn);
+		const std::string fresh = FreshSnapshotTable(snapshot_table);
+		trans.exec("DROP TABLE IF EXISTS " + fresh + ";");
+		trans.exec(
+				"CREATE TABLE " + fresh + " AS " + _StripQuery(data_query) + ";");
+		_UpdateRadiiTable(
+				&trans, grids,
+				"SELECT * FROM " + fresh + " EXCEPT ALL SELECT * FROM " + snapshot_table,
+				"SELECT * FROM " + snapshot_table + " EXCEPT ALL SELECT * FROM " + fresh,
+				output_table, radii_count);
+		_ReplaceSnapshot(&trans, fresh, snapshot_table);
+		trans.commit();
+	} catch (const pqxx::sql_error &e) {
+		LOG(ERROR) << "SQL error"
+		           << "\nerror = " << e.what()
+		           << "\nquery = " << e.query();
+		return false;
+	}
+	return true;
+}
+
+}  // namespace processing
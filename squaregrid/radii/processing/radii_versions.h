@@ -0,0 +1,55 @@
+#pragma once
+
+#include <string>
+
+#include <pqxx/pqxx>
+
+namespace processing {
+
+// Versions of radii tables by table oid. Writers and updaters of a radii
+// table bump its version with or after the commit of every change of its
+// rows. Readers get the version before the rows, so rows cached under a
+// version are never newer than it, and older ones are dropped by the bump.
+const char kRadiiVersionsTable[] = "metadata.radii_versions";
+
+inline void CreateRadiiVersionsTable(pqxx::work *trans) {
+	trans->exec(
+			std::string("CREATE TABLE IF NOT EXISTS ") + kRadiiVersionsTable +
+			" (table_oid oid PRIMARY KEY, version bigint NOT NULL,"
+			" updated_at timestamp NOT NULL);");
+}
+
+// The version row stays locked until trans ends, so concurrent writers of
+// the table wait for each other from here: bump right before the commit.
+inline void BumpRadiiTableVersion(pqxx::work *trans, const std::string &table) {
+	trans->exec(
+			std::string("INSERT INTO ") + kRadiiVersionsTable + " AS v VALUES (" +
+			trans->quote(table) + "::regclass, 1, now())"
+			" ON CONFLICT (table_oid) DO UPDATE"
+			" SET version = v.version + 1, updated_at = now();");
+}
+
+// Changes whenever the table is recreated or a change of its rows is
+// committed, see BumpRadiiTableVersion. Until some writer creates
+// kRadiiVersionsTable, versions are those of never bumped tables.
+inline std::string GetRadiiTableVersion(
+		pqxx::work *trans, const std::string &table) {
+	pqxx::result versions = trans->exec(
+			std::string("SELECT to_regclass(") + trans->quote(kRadiiVersionsTable) +
+			") IS NOT NULL;");
+	std::string query = "SELECT c.oid, 0 FROM pg_class c";
+	if (versions[0][0].as<bool>()) {
+		query = (
+				std::string("SELECT c.oid, coalesce(v.version, 0) FROM pg_class c") +
+				" LEFT JOIN " + kRadiiVersionsTable + " v ON v.table_oid = c.oid");
+	}
+	pqxx::result res = trans->exec(
+			query + " WHERE c.oid = " + trans->quote(table) + "::regclass;");
+	std::string version;
+	for (const auto &field : res[0]) {
+		version += field.as<std::string>() + ":";
+	}
+	return version;
+}
+
+}  // namespace processing
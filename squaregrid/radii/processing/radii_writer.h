@@ -1,23 +1,139 @@
 #pragma once
 
 #include <algorithm>
+#include <atomic>
+#include <charconv>
+#include <functional>
+#include <memory>
+#include <mutex>
 #include <string>
+#include <utility>
 #include <vector>
 
 #include <pqxx/pqxx>
 #include <pqxx/tablewriter>
 
+#include "grids/grid_metadata.h"
 #include "processing/data_grid.h"
+#include "processing/radii_versions.h"
+#include "utils/connection_pool.h"
 
 namespace processing {
 
+const size_t kDefaultWriterBatchBytes = 4 << 20;
+
+inline void _AppendInt(int value, std::string *out) {
+	char buffer[16];
+	char *end = std::to_chars(buffer, buffer + sizeof(buffer), value).ptr;
+	out->append(buffer, end);
+}
+
+// Turns smallint radii columns _0 ... _{100 * max_R} of the table into integer.
+inline void _WidenRadiiColumns(
+		pqxx::work *trans, const std::string &table, int max_R) {
+	for (int i = 0; i <= max_R; ++i) {
+		std::string query = (
+				"ALTER TABLE " + table +
+				" ALTER COLUMN _" + std::to_string(i * 100) +
+				" SET DATA TYPE integer;");
+		trans->exec(query);
+	}
+}
+
+// Appends non-empty cells to out as COPY text rows (city_id, square_id,
+// radius_0, ...). radii may hold a band of the grid starting at first_row,
+// and channels interleaved layers of which only channel is written.
+// Returns false if some value does not fit into smallint.
+template<typename DataType> bool _FormatRadiiRows(
+		const grids::GridMetadata &grid,
+		const std::vector< DataGrid<DataType> > &radii,
+		int first_row,
+		std::string *out,
+		int channel = 0, int channels = 1) {
+	int n = radii[0].NumRows(), m = radii[0].NumCols() / channels;
+	int R = radii.size();
+	bool fits = true;
+	std::vector<int> values(R);
+	for (int x = 0; x < n; ++x) {
+		for (int y = 0; y < m; ++y) {
+			bool empty = true;
+			for (int i = 0; i < R; ++i) {
+				const DataType &value = radii[i][x][y * channels + channel];
+				empty &= value == DataType();
+				values[i] = (int) value;
+			}
+			if (empty) continue;
+			_AppendInt(grid.GetId(), out);
+			out->push_back('\t');
+			_AppendInt(grids::GetCellId(first_row + x, y, grid.GetSide()), out);
+			for (int value : values) {
+				out->push_back('\t');
+				_AppendInt(value, out);
+				fits &= value < (1 << 15);
+			}
+			out->push_back('\n');
+		}
+	}
+	return fits;
+}
+
+// Rows of one grid, which may be spread over several batches of several
+// writers. The producer of the rows and every batch holding some of them keep
+// a reference, and done(ok) is called once the last one is released: ok is
+// false if any of them failed.
+class GridProgress {
+	public:
+		explicit GridProgress(std::function<void(bool)> done)
+				: done_(std::move(done)), failed_(false) {}
+
+		GridProgress(const GridProgress&) = delete;
+		GridProgress& operator=(const GridProgress&) = delete;
+
+		~GridProgress() {
+			done_(!failed_);
+		}
+
+		void Fail() {
+			failed_ = true;
+		}
+
+	private:
+		std::function<void(bool)> done_;
+		std::atomic<bool> failed_;
+};
+
+// Writes radii of many grids into one table. Rows are rendered straight from
+// the radii buffers and gathered into batches of about batch_bytes, each sent
+// as a single COPY over a pooled connection. A batch may hold rows of several
+// grids: if its COPY fails, all of them are failed and the error is rethrown.
+// WriteRadii may be called from several threads; Flush() must be called after
+// the last of them, grids with rows left unflushed are failed. The version of
+// the table is bumped by ResetTable and once more by Flush, not by every
+// batch, whose commits would otherwise all wait for the same version row.
 template<typename DataType> class RadiiWriter {
 	public:
-		RadiiWriter(pqxx::connection *conn, const std::string &table)
-				: conn_(conn), table_(table), changed_type_(false) {}
+		RadiiWriter(
+				utils::ConnectionPool *pool, const std::string &table,
+				size_t batch_bytes = kDefaultWriterBatchBytes)
+				: pool_(pool), table_(table), batch_bytes_(batch_bytes),
+				  batch_wide_(false), changed_type_(false), max_R_(0) {}
+
+		RadiiWriter(const RadiiWriter&) = delete;
+		RadiiWriter& operator=(const RadiiWriter&) = delete;
+
+		~RadiiWriter() {
+			for (const auto &grid : batch_grids_) {
+				grid->Fail();
+			}
+		}
 
 		void ResetTable(int max_R) {
-			pqxx::work trans(*conn_);
+			{
+				std::lock_guard<std::mutex> lock(batch_mutex_);
+				max_R_ = max_R;
+			}
+			auto conn = pool_->Acquire();
+			pqxx::work trans(*conn);
 
 			std::string query = "DROP TABLE IF EXISTS " + table_;
 			trans.exec(query);
@@ -29,67 +145,131 @@ template<typename DataType> class RadiiWriter {
 			}
 			query += ", UNIQUE (city_id, square_id)) TABLESPACE md0space;";
 			trans.exec(query);
+			CreateRadiiVersionsTable(&trans);
+			BumpRadiiTableVersion(&trans, table_);
 			trans.commit();
 		}
 
+		// radii may hold only a band of the grid rows starting at first_row
+		// and several interleaved layers, see _FormatRadiiRows.
 		void WriteRadii(
 				const grids::GridMetadata &grid,
-				const std::vector< DataGrid<DataType> > &radii) {
-
-			int n = radii[0].data().size(), R = radii.size();
-			auto cells = grids::EnumerateGridCells(n / 2);
+				const std::vector< DataGrid<DataType> > &radii,
+				const std::shared_ptr<GridProgress> &progress,
+				int first_row = 0,
+				int channel = 0, int channels = 1) {
+			std::string rows;
+			bool wide = !_FormatRadiiRows(
+					grid, radii, first_row, &rows, channel, channels);
 
+			std::string full_batch;
+			bool full_batch_wide = false;
+			std::vector< std::shared_ptr<GridProgress> > full_batch_grids;
 			{
-				// hack for shortint DB values
-				int max_value;
-				for (size_t id = 0; id < cells.size(); ++id) {
-					auto p = cells[id];
-					for (int i = 0; i < R; ++i) {
-						max_value = std::max(max_value, (int) radii[i][p.first][p.second]);
-					}
+				std::lock_guard<std::mutex> lock(batch_mutex_);
+				max_R_ = radii.size() - 1;
+				if (rows.empty()) return;
+				batch_ += rows;
+				batch_wide_ |= wide;
+				if (batch_grids_.empty() || batch_grids_.back() != progress) {
+					batch_grids_.push_back(progress);
 				}
-				if (max_value >= (1 << 15)) {
-					ChangeColumnTypes_(R - 1);
+				if (batch_.size() >= batch_bytes_) {
+					full_batch.swap(batch_);
+					full_batch_wide = batch_wide_;
+					batch_wide_ = false;
+					full_batch_grids.swap(batch_grids_);
 				}
 			}
+			if (!full_batch.empty()) {
+				Copy_(full_batch, full_batch_wide, full_batch_grids);
+			}
+		}
 
-			pqxx::work trans(*conn_);
-			pqxx::tablewriter writer(trans, table_);
-			for (size_t id = 0; id < cells.size(); ++id) {
-				auto p = cells[id];
-				bool empty = true;
-				for (int i = 0; i < R; ++i) {
-					empty &= radii[i][p.first][p.second] == DataType();
-				}
-				if (!empty) {
-					std::vector<int> row = {grid.GetId(), (int) id};
-					for (int i = 0; i < R; ++i) {
-						row.push_back((int) radii[i][p.first][p.second]);
-					}
-					writer.insert(row);
+		const std::string& GetTable() const {
+			return table_;
+		}
+
+		void Flush() {
+			std::string rows;
+			bool wide;
+			std::vector< std::shared_ptr<GridProgress> > grids;
+			{
+				std::lock_guard<std::mutex> lock(batch_mutex_);
+				rows.swap(batch_);
+				wide = batch_wide_;
+				batch_wide_ = false;
+				grids.swap(batch_grids_);
+			}
+			try {
+				if (!rows.empty()) {
+					Copy_(rows, wide, grids);
 				}
+			} catch (...) {
+				// rows of the other batches may have been committed
+				BumpVersion_();
+				throw;
 			}
-			writer.complete();
-			trans.commit();
+			BumpVersion_();
 		}
 
 	private:
-		pqxx::connection *conn_;
+		utils::ConnectionPool *pool_;
 		std::string table_;
+		size_t batch_bytes_;
+
+		std::mutex batch_mutex_;
+		std::string batch_;
+		bool batch_wide_;
+		// grids with rows in batch_
+		std::vector< std::shared_ptr<GridProgress> > batch_grids_;
+
+		std::mutex type_mutex_;
 		bool changed_type_;
+		int max_R_;
 
-		void ChangeColumnTypes_(int count) {
-			pqxx::work trans(*conn_);
+		void Copy_(
+				const std::string &rows, bool wide,
+				const std::vector< std::shared_ptr<GridProgress> > &grids) {
+			try {
+				if (wide) {
+					ChangeColumnTypes_();
+				}
+				auto conn = pool_->Acquire();
+				pqxx::work trans(*conn);
+				pqxx::tablewriter writer(trans, table_);
+				writer.write_raw_line(rows);
+				writer.complete();
+				trans.commit();
+			} catch (...) {
+				for (const auto &grid : grids) {
+					grid->Fail();
+				}
+				throw;
+			}
+		}
+
+		void BumpVersion_() {
+			auto conn = pool_->Acquire();
+			pqxx::work trans(*conn);
+			BumpRadiiTableVersion(&trans, table_);
+			trans.commit();
+		}
+
+		// hack for shortint DB values
+		void ChangeColumnTypes_() {
+			std::lock_guard<std::mutex> lock(type_mutex_);
 			if (changed_type_) return;
-			for (int i = 0; i <= count; ++i) {
-				std::string query = (
-						"ALTER TABLE " + table_ +
-						" ALTER COLUMN _" + std::to_string(i * 100) +
-						" SET DATA TYPE integer;");
-				trans.exec(query);
+			int max_R;
+			{
+				std::lock_guard<std::mutex> batch_lock(batch_mutex_);
+				max_R = max_R_;
 			}
-			changed_type_ = true;
+			auto conn = pool_->Acquire();
+			pqxx::work trans(*conn);
+			_WidenRadiiColumns(&trans, table_, max_R);
 			trans.commit();
+			changed_type_ = true;
 		}
 
 };
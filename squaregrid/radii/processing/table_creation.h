@@ -1,15 +1,21 @@
 #pragma once
 
+#include <algorithm>
+#include <atomic>
+#include <memory>
 #include <vector>
 #include <string>
 
-#include <boost/asio/io_service.hpp>
 #include <boost/bind.hpp>
+#include <boost/ref.hpp>
 #include <boost/thread/thread.hpp>
 #include <easylogging++.h>
 #include <pqxx/pqxx>
 
+#include "utils/bounded_queue.h"
 #include "utils/common.h"
+#include "utils/connection_pool.h"
+#include "grids/grid_index.h"
 #include "grids/grid_metadata.h"
 #include "processing/data_grid.h"
 #include "processing/grid_forming.h"
@@ -18,93 +24,398 @@
 
 namespace processing {
 
-template<typename DataType> void _ProcessGrid(
-		const std::string &connection_string,
+const int kFetchBatchSize = 1 << 16;
+
+// Reads (lat, lng[, value]) rows of the query through a server-side cursor,
+// so only one batch of the result is held in memory. Returns the number of
+// rows skipped because of null or malformed fields.
+template <typename InputDataType, typename ProcessingDataType> int _ReadPoints(
+		pqxx::work *trans, const std::string &sql_query,
+		std::vector< std::pair<GeoCoords, ProcessingDataType> > *values) {
+	int skipped = 0;
+	pqxx::icursorstream stream(*trans, sql_query, "points", kFetchBatchSize);
+	pqxx::result batch;
+	while (stream >> batch) {
+		for (const auto &row : batch) {
+			GeoCoords coords;
+			InputDataType value = 1;
+			bool has_value = row.size() > 2;
+			if (row[0].is_null() || row[1].is_null() ||
+					(has_value && row[2].is_null())) {
+				++skipped;
+				continue;
+			}
+			try {
+				row[0].to(coords.lat);
+				row[1].to(coords.lng);
+				if (has_value) row[2].to(value);
+			} catch (const pqxx::conversion_error &e) {
+				++skipped;
+				continue;
+			}
+			values->emplace_back(coords, value);
+		}
+	}
+	return skipped;
+}
+
+// Same as _ReadPoints for (lat, lng, layer[, value]) rows. Rows with a layer
+// outside [0, layers) are skipped as well.
+template <typename InputDataType, typename ProcessingDataType>
+int _ReadLayeredPoints(
+		pqxx::work *trans, const std::string &sql_query, int layers,
+		std::vector<
+			std::pair< GeoCoords, std::pair<int, ProcessingDataType> > > *values) {
+	int skipped = 0;
+	pqxx::icursorstream stream(*trans, sql_query, "layered_points", kFetchBatchSize);
+	pqxx::result batch;
+	while (stream >> batch) {
+		for (const auto &row : batch) {
+			GeoCoords coords;
+			int layer;
+			InputDataType value = 1;
+			bool has_value = row.size() > 3;
+			if (row[0].is_null() || row[1].is_null() || row[2].is_null() ||
+					(has_value && row[3].is_null())) {
+				++skipped;
+				continue;
+			}
+			try {
+				row[0].to(coords.lat);
+				row[1].to(coords.lng);
+				row[2].to(layer);
+				if (has_value) row[3].to(value);
+			} catch (const pqxx::conversion_error &e) {
+				++skipped;
+				continue;
+			}
+			if (layer < 0 || layer >= layers) {
+				++skipped;
+				continue;
+			}
+			values->emplace_back(
+					coords, std::make_pair(layer, ProcessingDataType(value)));
+		}
+	}
+	return skipped;
+}
+
+const int kDefaultQueueDepth = 4;
+const int kReportedHotspots = 10;
+
+// Logs the largest of the locations excluded from the grids, which are
+// likely to be geocoding defaults rather than real points.
+inline void _LogHotspots(
+		const std::vector<const grids::GridMetadata*> &grids,
+		const std::vector<Hotspot> &hotspots,
+		int count) {
+	std::vector<size_t> order;
+	for (size_t i = 0; i < hotspots.size(); ++i) {
+		if (hotspots[i].count) order.push_back(i);
+	}
+	count = std::min<int>(count, order.size());
+	std::partial_sort(
+			order.begin(), order.begin() + count, order.end(),
+			[&](size_t a, size_t b) { return hotspots[a].count > hotspots[b].count; });
+	for (int i = 0; i < count; ++i) {
+		const Hotspot &hotspot = hotspots[order[i]];
+		LOG(INFO) << "Excluded " << hotspot.count << " points at ("
+		          << hotspot.location.lat << ", " << hotspot.location.lng
+		          << ") in grid " << grids[order[i]]->GetName();
+	}
+}
+
+template<typename DataType> struct _RadiiJob {
+	const grids::GridMetadata *grid;
+	int first_row;
+	// radii of channels interleaved layers, layer c is written by writers[c]
+	std::vector< DataGrid<DataType> > radii;
+	RadiiWriter<DataType> *const *writers;
+	int channels;
+	// shared by all the jobs of the grid
+	std::shared_ptr<GridProgress> progress;
+};
+
+// Sums radii of the filled grid and pushes them to the queue, in bands of
+// band_rows rows if band_rows is positive and as a whole otherwise. The grid
+// is logged as finished once all its rows are committed, and as failed,
+// counted in failed_grids, if some of them are not.
+template<typename DataType> void _QueueRadii(
 		const grids::GridMetadata &grid,
-		const std::vector< std::pair<GeoCoords, DataType> > &values,
-		const std::string output_table,
-		bool exclude_most_common,
-		float_t tolerance,
-		int radii_count) {
+		const DataGrid<DataType> &data_grid,
+		int radii_count,
+		RadiiEngine engine,
+		int band_rows,
+		RadiiWriter<DataType> *const *writers, int channels,
+		std::atomic<int> *failed_grids,
+		utils::BoundedQueue< _RadiiJob<DataType> > *queue) {
+	int n = data_grid.NumRows();
+	int band = (band_rows > 0) ? std::min(band_rows, n) : n;
+	std::string table = writers[0]->GetTable();
+	auto progress = std::make_shared<GridProgress>(
+			[&grid, table, channels, failed_grids](bool ok) {
+				if (ok) {
+					LOG(INFO) << "Finished grid " << grid.GetName() << " in " << table
+					          << (channels > 1 ? " and other layers" : "");
+				} else {
+					LOG(ERROR) << "Failed grid " << grid.GetName() << " in " << table
+					           << (channels > 1 ? " and other layers" : "");
+					++*failed_grids;
+				}
+			});
+	for (int row = 0; row < n; row += band) {
+		_RadiiJob<DataType> job{&grid, row, {}, writers, channels, progress};
+		if (band == n && channels == 1) {
+			processing::CalculateRadii(
+					data_grid, radii_count, &job.radii, false, engine);
+		} else {
+			processing::CalculateRadiiBand(
+					data_grid, radii_count, row, std::min(n, row + band),
+					&job.radii, false, engine, channels);
+		}
+		queue->Push(std::move(job));
+	}
+}
+
+template<typename DataType> void _WriteGrids(
+		utils::BoundedQueue< _RadiiJob<DataType> > *queue) {
+	_RadiiJob<DataType> job;
+	while (queue->Pop(&job)) {
+		const grids::GridMetadata &grid = *job.grid;
+		try {
+			for (int c = 0; c < job.channels; ++c) {
+				job.writers[c]->WriteRadii(
+						grid, job.radii, job.progress, job.first_row, c, job.channels);
+			}
+		} catch (const pqxx::sql_error &e) {
+			// the failed batch may hold rows of other grids as well, they are
+			// reported as failed when released
+			job.progress->Fail();
+			LOG(ERROR) << "SQL error writing " << job.writers[0]->GetTable()
+			           << " at grid " << grid.GetName()
+			           << "\nerror = " << e.what()
+			           << "\nquery = " << e.query();
+		} catch (const pqxx::failure &e) {
+			job.progress->Fail();
+			LOG(ERROR) << "DB error writing " << job.writers[0]->GetTable()
+			           << " at grid " << grid.GetName()
+			           << "\nerror = " << e.what();
+		}
+		job = _RadiiJob<DataType>();
+	}
+}
+
+// Sends the last batch of writer, failing its grids on error.
+template<typename DataType> void _FlushWriter(RadiiWriter<DataType> *writer) {
 	try {
-		pqxx::connection conn(connection_string);
-		processing::DataGrid<DataType> data_grid(0, 0);
-		processing::FillDataGrid(
-				values, grid, exclude_most_common, tolerance, &data_grid);
-
-		std::vector< processing::DataGrid<DataType> > radii;
-		processing::CalculateRadii(data_grid, radii_count, &radii, false);
-		processing::RadiiWriter<DataType> writer(&conn, output_table);
-		writer.WriteRadii(grid, radii);
-		LOG(INFO) << "Finished grid " << grid.GetName() << " in " << output_table;
+		writer->Flush();
 	} catch (const pqxx::sql_error &e) {
-		LOG(ERROR) << "SQL error. Grid " << grid.GetName()
+		LOG(ERROR) << "SQL error flushing " << writer->GetTable()
 		           << "\nerror = " << e.what()
 		           << "\nquery = " << e.query();
-		return;
+	} catch (const pqxx::failure &e) {
+		LOG(ERROR) << "DB error flushing " << writer->GetTable()
+		           << "\nerror = " << e.what();
 	}
 }
 
+// Two-stage pipeline: compute_threads call compute(i, &queue) for every i in
+// [0, count), writer_threads send the queued radii to the DB. The stages are
+// connected by a queue of queue_depth jobs, so a slow DB holds back the
+// computation instead of piling up radii in memory.
+template<typename DataType, typename ComputeFunction> void _RunRadiiPipeline(
+		size_t count, ComputeFunction compute,
+		int compute_threads, int writer_threads, int queue_depth) {
+	utils::BoundedQueue< _RadiiJob<DataType> > queue(queue_depth);
+	std::atomic<size_t> next(0);
+	boost::thread_group writers, computers;
+	for (int i = 0; i < writer_threads; ++i) {
+		writers.create_thread(boost::bind(_WriteGrids<DataType>, &queue));
+	}
+	for (int i = 0; i < compute_threads; ++i) {
+		computers.create_thread([&]() {
+			for (size_t k = next++; k < count; k = next++) {
+				compute(k, &queue);
+			}
+		});
+	}
+	computers.join_all();
+	queue.Close();
+	writers.join_all();
+}
+
+// Grids are filled and summed by compute_threads and written by
+// writer_threads, see _RunRadiiPipeline. With positive band_rows radii are
+// computed and queued in bands of that many rows, which bounds memory by the
+// band height instead of the grid size. Returns false if some grid could not
+// be written, the errors are logged.
 template <typename InputDataType, typename ProcessingDataType>
-void CreateRadiiTableFromSQLConcurrently(
+bool CreateRadiiTableFromSQLConcurrently(
 		const std::string &connection_string,
 		const std::vector<grids::GridMetadata> &grids,
 		const std::string &sql_query, const std::string &output_table,
 		int radii_count,
 		bool exclude_most_common, float_t tolerance,
-		int threads) {
+		int compute_threads, int writer_threads,
+		RadiiEngine engine = RadiiEngine::kAuto,
+		int queue_depth = kDefaultQueueDepth,
+		int band_rows = 0) {
+	std::atomic<int> failed_grids(0);
 	try {
-		pqxx::result data;
 		std::vector< std::pair<GeoCoords, ProcessingDataType> > values;
+		std::vector< std::vector< std::pair<GeoCoords, ProcessingDataType> > > parts;
+		utils::ConnectionPool pool(connection_string, writer_threads);
+		RadiiWriter<ProcessingDataType> writer(&pool, output_table);
+		RadiiWriter<ProcessingDataType> *const writers[] = {&writer};
 		do {
-			pqxx::connection conn(connection_string);
-			pqxx::work trans(conn);
-			data = trans.exec(sql_query);
-			if (data.size() > 0) {
-				int skipped = 0;
-				for (size_t i = 0; i < data.size(); ++i) {
-					try {
-						values.emplace_back(
-								GeoCoords{data[i][0].as<float_t>(), data[i][1].as<float_t>()},
-								(data[i].size() > 2) ? data[i][2].as<InputDataType>() : 1);
-					} catch (pqxx::conversion_error &e) {
-						++skipped;
-						continue;
-					}
-				}
-				if (skipped) {
-					LOG(WARNING) << skipped << " rows skipped because of null values";
-				}
+			auto conn = pool.Acquire();
+			pqxx::work trans(*conn);
+			int skipped = _ReadPoints<InputDataType>(&trans, sql_query, &values);
+			if (skipped) {
+				LOG(WARNING) << skipped << " rows skipped because of null or malformed values";
 			}
 			trans.commit();
 
-			processing::RadiiWriter<ProcessingDataType> writer(&conn, output_table);
-			writer.ResetTable(radii_count);
+			parts = PartitionByGrids(values, grids::GridIndex(grids));
+			std::vector< std::pair<GeoCoords, ProcessingDataType> >().swap(values);
 		} while (false);
+		writer.ResetTable(radii_count);
 
-		boost::asio::io_service io_service;
-		boost::thread_group threadpool;
+		std::vector<size_t> order;
+		for (size_t i = 0; i < grids.size(); ++i) {
+			if (parts[i].empty()) {
+				LOG(INFO) << "Skipped empty grid " << grids[i].GetName();
+				continue;
+			}
+			order.push_back(i);
+		}
 
-		do {
-			boost::asio::io_service::work work(io_service);
-			for (int i = 0; i < threads; ++i) {
-				threadpool.create_thread(
-						boost::bind(&boost::asio::io_service::run, &io_service));
+		std::vector<Hotspot> hotspots(order.size());
+		_RunRadiiPipeline<ProcessingDataType>(
+				order.size(),
+				[&](size_t k, utils::BoundedQueue< _RadiiJob<ProcessingDataType> > *queue) {
+					const grids::GridMetadata &grid = grids[order[k]];
+					DataGrid<ProcessingDataType> data_grid(0, 0);
+					FillDataGrid(
+							parts[order[k]], grid, exclude_most_common, tolerance, &data_grid,
+							&hotspots[k]);
+					std::vector< std::pair<GeoCoords, ProcessingDataType> >().swap(
+							parts[order[k]]);
+					_QueueRadii(
+							grid, data_grid, radii_count, engine, band_rows, writers, 1,
+							&failed_grids, queue);
+				},
+				compute_threads, writer_threads, queue_depth);
+		_FlushWriter(&writer);
+		if (exclude_most_common) {
+			std::vector<const grids::GridMetadata*> hotspot_grids;
+			for (size_t i : order) {
+				hotspot_grids.push_back(&grids[i]);
 			}
-			for (size_t i = 0; i < grids.size(); ++i) {
-				io_service.post(boost::bind(
-							_ProcessGrid<ProcessingDataType>, connection_string, grids[i],
-							values, output_table,
-							exclude_most_common, tolerance, radii_count));
+			_LogHotspots(hotspot_grids, hotspots, kReportedHotspots);
+		}
+	} catch (const pqxx::sql_error &e) {
+		LOG(ERROR) << "SQL error"
+		           << "\nerror = " << e.what()
+		           << "\nquery = " << e.query();
+		return false;
+	}
+	if (failed_grids) {
+		LOG(ERROR) << failed_grids << " grids failed";
+	}
+	return failed_grids == 0;
+}
+
+// Batch version of CreateRadiiTableFromSQLConcurrently for many layers:
+// sql_query yields (lat, lng, layer[, value]) rows where layer indexes
+// output_tables. The query is read and partitioned by grids once. Then every
+// grid is filled with layers_per_pass layers at a time as interleaved
+// channels and summed in one pass, and each layer is written to its table.
+// Memory of a job grows with layers_per_pass, use band_rows to bound it.
+// Returns false if some grid of some layer could not be written.
+template <typename InputDataType, typename ProcessingDataType>
+bool CreateLayeredRadiiTablesFromSQLConcurrently(
+		const std::string &connection_string,
+		const std::vector<grids::GridMetadata> &grids,
+		const std::string &sql_query,
+		const std::vector<std::string> &output_tables,
+		int radii_count,
+		bool exclude_most_common, float_t tolerance,
+		int compute_threads, int writer_threads,
+		int layers_per_pass,
+		int queue_depth = kDefaultQueueDepth,
+		int band_rows = 0) {
+	static_assert(
+			IsExactlyAdditive<ProcessingDataType>::value,
+			"layers are summed with prefix sums");
+	typedef std::pair< GeoCoords, std::pair<int, ProcessingDataType> > Point;
+	int layers = output_tables.size();
+	std::atomic<int> failed_grids(0);
+	try {
+		std::vector<Point> values;
+		std::vector< std::vector<Point> > parts;
+		utils::ConnectionPool pool(connection_string, writer_threads);
+		do {
+			auto conn = pool.Acquire();
+			pqxx::work trans(*conn);
+			int skipped = _ReadLayeredPoints<InputDataType>(
+					&trans, sql_query, layers, &values);
+			if (skipped) {
+				LOG(WARNING) << skipped << " rows skipped because of null or malformed values";
 			}
+			trans.commit();
+
+			parts = PartitionByGrids(values, grids::GridIndex(grids));
+			std::vector<Point>().swap(values);
 		} while (false);
-		threadpool.join_all();
-		io_service.stop();
+
+		std::vector<size_t> order;
+		for (size_t i = 0; i < grids.size(); ++i) {
+			if (!parts[i].empty()) order.push_back(i);
+		}
+
+		for (int first = 0; first < layers; first += layers_per_pass) {
+			int channels = std::min(layers_per_pass, layers - first);
+			LOG(INFO) << "Starting layers " << first << " - " << first + channels - 1
+			          << " of " << layers;
+			size_t batch_bytes = std::max<size_t>(
+					kDefaultWriterBatchBytes / channels, 1 << 16);
+			std::vector< std::unique_ptr< RadiiWriter<ProcessingDataType> > > owners;
+			std::vector< RadiiWriter<ProcessingDataType>* > writers;
+			for (int c = 0; c < channels; ++c) {
+				owners.emplace_back(new RadiiWriter<ProcessingDataType>(
+							&pool, output_tables[first + c], batch_bytes));
+				owners.back()->ResetTable(radii_count);
+				writers.push_back(owners.back().get());
+			}
+
+			_RunRadiiPipeline<ProcessingDataType>(
+					order.size(),
+					[&](size_t k, utils::BoundedQueue< _RadiiJob<ProcessingDataType> > *queue) {
+						const grids::GridMetadata &grid = grids[order[k]];
+						DataGrid<ProcessingDataType> data_grid(0, 0);
+						FillLayeredDataGrid(
+								parts[order[k]], grid, first, channels,
+								exclude_most_common, tolerance, &data_grid);
+						_QueueRadii(
+								grid, data_grid, radii_count, RadiiEngine::kPrefixSums,
+								band_rows, writers.data(), channels, &failed_grids, queue);
+					},
+					compute_threads, writer_threads, queue_depth);
+			for (auto *writer : writers) {
+				_FlushWriter(writer);
+			}
+		}
 	} catch (const pqxx::sql_error &e) {
 		LOG(ERROR) << "SQL error"
 		           << "\nerror = " << e.what()
 		           << "\nquery = " << e.query();
+		return false;
+	}
+	if (failed_grids) {
+		LOG(ERROR) << failed_grids << " grids failed";
 	}
+	return failed_grids == 0;
 }
 
 }  // namespace processing
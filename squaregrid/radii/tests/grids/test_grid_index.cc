@@ -0,0 +1,72 @@
+#include <cmath>
+#include <random>
+#include <vector>
+
+#include <gtest/gtest.h>
+
+#include "utils/common.h"
+#include "grids/grid_index.h"
+#include "grids/grid_metadata.h"
+
+using utils::GeoCoords;
+
+TEST(TestGridIndex, TestMatchesLinearScan) {
+	std::mt19937 gen(7);
+	std::uniform_real_distribution<float_t> corner(40., 60.), size(0.1, 3.);
+	std::vector<grids::GridMetadata> grids;
+	for (int i = 0; i < 50; ++i) {
+		float_t lat = corner(gen), lng = corner(gen), lat_size = size(gen);
+		float_t lng_size = size(gen);
+		grids.emplace_back(
+				lat, lat + lat_size, lng, lng + lng_size,
+				lat_size / 10, lng_size / 10, 5, "a", "b", i);
+	}
+	grids::GridIndex index(grids);
+	EXPECT_EQ(index.Size(), grids.size());
+
+	std::uniform_real_distribution<float_t> point(38., 65.);
+	std::vector<GeoCoords> points;
+	for (int i = 0; i < 10000; ++i) {
+		points.emplace_back(point(gen), point(gen));
+	}
+	// corners lie on the bbox boundaries, which are inclusive
+	for (const auto &grid : grids) {
+		points.emplace_back(grid.GetLatMin(), grid.GetLngMin());
+		points.emplace_back(grid.GetLatMax(), grid.GetLngMax());
+	}
+
+	std::vector<int> found;
+	for (const auto &c : points) {
+		std::vector<int> expected;
+		for (size_t i = 0; i < grids.size(); ++i) {
+			if (grids[i].GetLatMin() <= c.lat && c.lat <= grids[i].GetLatMax() &&
+					grids[i].GetLngMin() <= c.lng && c.lng <= grids[i].GetLngMax()) {
+				expected.push_back(i);
+			}
+		}
+		index.FindGrids(c, &found);
+		EXPECT_EQ(found, expected);
+		EXPECT_EQ(index.FindGrid(c), expected.empty() ? -1 : expected[0]);
+	}
+}
+
+TEST(TestGridIndex, TestLocate) {
+	std::vector<grids::GridMetadata> grids = {
+		grids::GridMetadata(9., 17, 9., 17., 4., 4., 1, "a", "b", 5),
+		grids::GridMetadata(13., 21., 13., 21., 4., 4., 1, "c", "d", 8),
+	};
+	grids::GridIndex index(grids);
+	std::vector<float_t> lat = {10., 15., 20., 50., NAN};
+	std::vector<float_t> lng = {10., 15., 14., 50., 10.};
+	std::vector<int> grid_ids(lat.size()), square_ids(lat.size());
+	index.Locate(
+			lat.data(), lng.data(), lat.size(), grid_ids.data(), square_ids.data());
+	EXPECT_EQ(grid_ids, std::vector<int>({5, 5, 8, -1, -1}));
+	for (size_t i = 0; i < 3; ++i) {
+		int expected;
+		const auto &grid = grids[i < 2 ? 0 : 1];
+		ASSERT_TRUE(grid.GetSquareId(GeoCoords(lat[i], lng[i]), &expected));
+		EXPECT_EQ(square_ids[i], expected);
+	}
+	EXPECT_EQ(square_ids[3], -1);
+}
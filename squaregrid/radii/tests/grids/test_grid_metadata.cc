@@ -27,6 +27,7 @@ TEST(TestGridMetadata, TestGridNumeration) {
 	for (size_t i = 0; i < cells.size(); ++i) {
 		const auto &p = cells[i];
 		EXPECT_EQ(expected_numeration[p.first][p.second], i);
+		EXPECT_EQ(grids::GetCellId(p.first, p.second, side), i);
 	}
 	for (int i = 0; i < 2 * side; ++i) {
 		for (int j = 0; j < 2 * side; ++j) {
@@ -46,3 +47,47 @@ TEST(TestGridMetadata, TestGridNumeration) {
 		}
 	}
 }
+
+TEST(TestGridMetadata, TestCellNumerations) {
+	using grids::CellNumeration;
+	int side = 7, n = 4 * side * side;
+	std::vector<int> ids(n), x(n), y(n), result(n);
+	for (int i = 0; i < n; ++i) {
+		ids[i] = i;
+	}
+	grids::GetCellsCoords(
+			ids.data(), n, side, CellNumeration::kSpiral, x.data(), y.data());
+	auto cells = grids::EnumerateGridCells(side);
+	for (int i = 0; i < n; ++i) {
+		EXPECT_EQ(grids::GetCellId(x[i], y[i], side), i);
+		EXPECT_EQ(cells[i], std::make_pair(x[i], y[i]));
+	}
+
+	grids::GetCellIds(
+			x.data(), y.data(), n, side, CellNumeration::kLegacy, result.data());
+	for (int i = 0; i < n; ++i) {
+		EXPECT_EQ(result[i], x[i] * 2 * side + y[i]);
+	}
+	std::vector<int> legacy = result;
+	grids::ConvertCellIds(
+			legacy.data(), n, side, CellNumeration::kLegacy, CellNumeration::kSpiral,
+			result.data());
+	EXPECT_EQ(result, ids);
+
+	// bin ids of the first two rings
+	grids::ConvertCellIds(
+			ids.data(), 16, side, CellNumeration::kSpiral, CellNumeration::kBin,
+			result.data());
+	EXPECT_EQ(
+			std::vector<int>(result.begin(), result.begin() + 16),
+			std::vector<int>({4, 3, 2, 1, 14, 13, 12, 11, 10, 9, 8, 7, 6, 5, 16, 15}));
+	grids::ConvertCellIds(
+			ids.data(), n, side, CellNumeration::kSpiral, CellNumeration::kBin,
+			result.data());
+	std::vector<int> bin = result;
+	grids::GetCellsCoords(
+			bin.data(), n, side, CellNumeration::kBin, x.data(), y.data());
+	for (int i = 0; i < n; ++i) {
+		EXPECT_EQ(cells[i], std::make_pair(x[i], y[i]));
+	}
+}
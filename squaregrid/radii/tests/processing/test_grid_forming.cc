@@ -1,9 +1,11 @@
+#include <cstdint>
 #include <vector>
 #include <tuple>
 
 #include <gtest/gtest.h>
 
 #include "utils/common.h"
+#include "grids/grid_index.h"
 #include "grids/grid_metadata.h"
 #include "processing/data_grid.h"
 #include "processing/grid_forming.h"
@@ -33,6 +35,122 @@ TEST(TestGridForming, TestFillDataGrid) {
 		processing::DataGrid<int> result(0);
 		processing::FillDataGrid(data, grids[i], false, 0, &result);
 
-		EXPECT_EQ(result.data(), expected_result[i]);
+		EXPECT_EQ(result.ToVector(), expected_result[i]);
+	}
+}
+
+TEST(TestGridForming, TestExcludeMostCommon) {
+	std::vector< std::pair<GeoCoords, int> > data = {
+		std::make_pair(GeoCoords{10., 10.}, 1),
+		std::make_pair(GeoCoords{15.001, 15.001}, 2),
+		std::make_pair(GeoCoords{10.001, 10.001}, 4),
+		std::make_pair(GeoCoords{15.004, 15.002}, 8),
+		std::make_pair(GeoCoords{15.003, 15.004}, 16),
+		std::make_pair(GeoCoords{10.002, 10.003}, 32),
+	};
+	grids::GridMetadata grid(9., 17, 9., 17., 4., 4., 1, "a", "b", 0);
+
+	processing::DataGrid<int> result(0);
+	processing::Hotspot excluded;
+	processing::FillDataGrid(data, grid, true, 0.01, &result, &excluded);
+	EXPECT_EQ(result.ToVector(), std::vector< std::vector<int> >({{37, 0}, {0, 0}}));
+	EXPECT_EQ(excluded.count, 3);
+	EXPECT_FLOAT_EQ(excluded.location.lat, 15.001);
+
+	// a single point at a location is not excluded
+	data.resize(3);
+	processing::FillDataGrid(data, grid, true, 1e-6, &result, &excluded);
+	EXPECT_EQ(result.ToVector(), std::vector< std::vector<int> >({{5, 0}, {0, 2}}));
+	EXPECT_EQ(excluded.count, 0);
+}
+
+TEST(TestGridForming, TestPartitionByGrids) {
+	std::vector< std::pair<GeoCoords, int> > data = {
+		std::make_pair(GeoCoords{10., 10.}, 1),
+		std::make_pair(GeoCoords{11., 11.}, 500),
+		std::make_pair(GeoCoords{10., 20.}, 2),
+		std::make_pair(GeoCoords{15., 10.}, 4),
+		std::make_pair(GeoCoords{20., 20.}, 8),
+		std::make_pair(GeoCoords{15., 15.}, 16),
+		std::make_pair(GeoCoords{50., 50.}, 32),
+	};
+	std::vector<grids::GridMetadata> grids = {
+		grids::GridMetadata(9., 17, 9., 17., 4., 4., 1, "a", "b", 0),
+		grids::GridMetadata(13., 21., 13., 21., 4., 4., 1, "c", "d", 1),
+	};
+
+	auto parts = processing::PartitionByGrids(data, grids::GridIndex(grids));
+	ASSERT_EQ(parts.size(), grids.size());
+	EXPECT_EQ(parts[0].size(), 4);
+	EXPECT_EQ(parts[1].size(), 2);
+	for (size_t i = 0; i < grids.size(); ++i) {
+		processing::DataGrid<int> expected(0), result(0);
+		processing::FillDataGrid(data, grids[i], true, 1e-6, &expected);
+		processing::FillDataGrid(parts[i], grids[i], true, 1e-6, &result);
+		EXPECT_EQ(result.ToVector(), expected.ToVector());
+	}
+}
+
+TEST(TestGridForming, TestDataGridLayout) {
+	processing::DataGrid<int> grid(3, 5);
+	EXPECT_EQ(grid.NumRows(), 3);
+	EXPECT_EQ(grid.NumCols(), 5);
+	EXPECT_GE(grid.Stride(), grid.NumCols());
+	EXPECT_EQ(reinterpret_cast<uintptr_t>(grid.data()) % utils::kCacheLineSize, 0);
+	for (int i = 0; i < grid.NumRows(); ++i) {
+		EXPECT_EQ(
+				reinterpret_cast<uintptr_t>(grid[i].begin()) % utils::kCacheLineSize, 0);
+		for (int j = 0; j < grid.NumCols(); ++j) {
+			grid[i][j] = i * 10 + j;
+		}
+	}
+	EXPECT_EQ(grid.data()[2 * grid.Stride() + 4], 24);
+
+	processing::DataGrid<int> copy = grid;
+	copy[1][1] = -1;
+	EXPECT_EQ(grid[1][1], 11);
+	EXPECT_EQ(copy.ToVector()[1], std::vector<int>({10, -1, 12, 13, 14}));
+
+	auto stack = processing::DataGrid<int>::MakeStack(3, 2, 5);
+	ASSERT_EQ(stack.size(), 3);
+	for (int i = 0; i < 3; ++i) {
+		EXPECT_EQ(stack[i].data(), stack[0].data() + i * 2 * stack[0].Stride());
+	}
+	processing::DataGrid<int> layer = stack[1];
+	layer[0][0] = 7;
+	EXPECT_EQ(stack[1][0][0], 0);
+}
+
+TEST(TestGridForming, TestFillLayeredDataGrid) {
+	std::vector< std::pair<GeoCoords, std::pair<int, int> > > data = {
+		std::make_pair(GeoCoords{10., 10.}, std::make_pair(0, 1)),
+		std::make_pair(GeoCoords{11., 11.}, std::make_pair(2, 500)),
+		std::make_pair(GeoCoords{10., 16.}, std::make_pair(1, 2)),
+		std::make_pair(GeoCoords{15., 10.}, std::make_pair(1, 4)),
+		std::make_pair(GeoCoords{15., 10.}, std::make_pair(2, 8)),
+		std::make_pair(GeoCoords{15., 15.}, std::make_pair(3, 16)),
+	};
+	grids::GridMetadata grid(9., 17, 9., 17., 4., 4., 1, "a", "b", 0);
+
+	int first_layer = 1, channels = 2;
+	processing::DataGrid<int> result(0);
+	processing::FillLayeredDataGrid(
+			data, grid, first_layer, channels, false, 0, &result);
+	ASSERT_EQ(result.NumRows(), 2);
+	ASSERT_EQ(result.NumCols(), 2 * channels);
+	for (int c = 0; c < channels; ++c) {
+		std::vector< std::pair<GeoCoords, int> > layer;
+		for (const auto &row : data) {
+			if (row.second.first == first_layer + c) {
+				layer.emplace_back(row.first, row.second.second);
+			}
+		}
+		processing::DataGrid<int> expected(0);
+		processing::FillDataGrid(layer, grid, false, 0, &expected);
+		for (int x = 0; x < 2; ++x) {
+			for (int y = 0; y < 2; ++y) {
+				EXPECT_EQ(result[x][y * channels + c], expected[x][y]);
+			}
+		}
 	}
 }
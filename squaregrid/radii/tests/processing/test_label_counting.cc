@@ -0,0 +1,110 @@
+#include <algorithm>
+#include <utility>
+#include <vector>
+
+#include <gtest/gtest.h>
+
+#include "utils/common.h"
+#include "grids/grid_metadata.h"
+#include "processing/data_grid.h"
+#include "processing/grid_forming.h"
+#include "processing/label_counting.h"
+#include "processing/radii_summation.h"
+#include "utils/helpers.h"
+
+using utils::GeoCoords;
+
+namespace {
+
+class TestLabelCounting : public ::testing::Test {
+	protected:
+		void SetUp() override {
+			unsigned seed = 29;
+			auto next = [&seed](int mod) {
+				seed = seed * 1103515245 + 12345;
+				return (int) ((seed >> 16) % mod);
+			};
+			for (int i = 0; i < 600; ++i) {
+				GeoCoords coords(next(2400) / 100., next(2400) / 100.);
+				int label = next(9), quantity = 1 + next(3);
+				data_.emplace_back(coords, std::make_pair(label, quantity));
+				utils::OccurrenceCounter<int> counter;
+				counter.data[label] = quantity;
+				counters_.emplace_back(coords, counter);
+			}
+			// a hotspot for exclude_most_common
+			for (int i = 0; i < 5; ++i) {
+				data_.emplace_back(GeoCoords(3.5, 3.5), std::make_pair(1, 1));
+				utils::OccurrenceCounter<int> counter;
+				counter.data[1] = 1;
+				counters_.emplace_back(GeoCoords(3.5, 3.5), counter);
+			}
+		}
+
+		const grids::GridMetadata grid_ = grids::GridMetadata(
+				0., 24., 0., 24., 1., 1., 12, "a", "b", 0);
+		std::vector< std::pair<GeoCoords, std::pair<int, int> > > data_;
+		std::vector< std::pair<GeoCoords, utils::OccurrenceCounter<int> > > counters_;
+};
+
+}  // namespace
+
+TEST_F(TestLabelCounting, TestFillLabelGrid) {
+	for (bool exclude_most_common : {false, true}) {
+		processing::LabelGrid result;
+		processing::FillLabelGrid(data_, grid_, exclude_most_common, 0, &result);
+		processing::DataGrid< utils::OccurrenceCounter<int> > expected;
+		processing::FillDataGrid(
+				counters_, grid_, exclude_most_common, 0, &expected);
+		ASSERT_EQ(result.rows, 24);
+		ASSERT_EQ(result.cols, 24);
+		for (int x = 0; x < 24; ++x) {
+			for (int y = 0; y < 24; ++y) {
+				size_t cell = x * 24 + y;
+				std::vector< std::pair<int, int> > cell_labels(
+						result.entries.begin() + result.offsets[cell],
+						result.entries.begin() + result.offsets[cell + 1]);
+				std::vector< std::pair<int, int> > expected_labels(
+						expected[x][y].data.begin(), expected[x][y].data.end());
+				EXPECT_EQ(cell_labels, expected_labels);
+			}
+		}
+	}
+}
+
+TEST_F(TestLabelCounting, TestTopLabelsMatchRadii) {
+	const int k = 3;
+	processing::LabelGrid grid;
+	processing::FillLabelGrid(data_, grid_, false, 0, &grid);
+	processing::DataGrid< utils::OccurrenceCounter<int> > counters;
+	processing::FillDataGrid(counters_, grid_, false, 0, &counters);
+
+	// every cell, some twice, in no particular order
+	std::vector< std::pair<int, int> > cells;
+	for (int x = 23; x >= 0; --x) {
+		for (int y = 0; y < 24; y += (x % 3) + 1) {
+			cells.emplace_back(x, y);
+		}
+		cells.emplace_back(x, 23 - x);
+	}
+	for (int R : {0, 1, 4, 9}) {
+		std::vector< processing::DataGrid< utils::OccurrenceCounter<int> > > radii;
+		processing::CalculateRadiiStencil(counters, R, &radii, true);
+		std::vector< std::vector< std::pair<int, int> > > result;
+		processing::CalculateTopLabels(grid, R, k, cells, &result);
+		ASSERT_EQ(result.size(), cells.size());
+		for (size_t i = 0; i < cells.size(); ++i) {
+			std::vector< std::pair<int, int> > sorted;
+			for (const auto &p : radii[R][cells[i].first][cells[i].second].data) {
+				sorted.emplace_back(p.second, p.first);
+			}
+			std::sort(sorted.rbegin(), sorted.rend());
+			sorted.resize(std::min<size_t>(sorted.size(), k));
+			std::vector< std::pair<int, int> > expected;
+			for (const auto &p : sorted) {
+				expected.emplace_back(p.second, p.first);
+			}
+			EXPECT_EQ(result[i], expected) << "R " << R << " cell " << i;
+		}
+	}
+}
@@ -0,0 +1,55 @@
+#include <memory>
+#include <string>
+
+#include <gtest/gtest.h>
+
+#include "processing/radii_cache.h"
+
+namespace {
+
+std::shared_ptr<processing::StoredRadii> MakeRadii(int squares, int value) {
+	auto radii = std::make_shared<processing::StoredRadii>();
+	radii->columns = 2;
+	radii->values.assign(squares * 2, value);
+	return radii;
+}
+
+}  // namespace
+
+TEST(TestRadiiCache, TestEvictionAndVersions) {
+	// room for 3 grids of 4 squares
+	processing::RadiiCache cache(3 * 4 * 2 * sizeof(int));
+	cache.Put("radii.a", 1, "v1", MakeRadii(4, 1));
+	cache.Put("radii.a", 2, "v1", MakeRadii(4, 2));
+	cache.Put("radii.b", 1, "v1", MakeRadii(4, 3));
+	EXPECT_EQ(cache.Bytes(), 3 * 4 * 2 * sizeof(int));
+
+	auto radii = cache.Get("radii.a", 2, "v1");
+	ASSERT_TRUE(radii);
+	EXPECT_EQ(radii->Squares(), 4);
+	EXPECT_EQ((*radii)[3][1], 2);
+
+	// radii.a grid 1 is the least recently used one
+	cache.Put("radii.b", 2, "v1", MakeRadii(4, 4));
+	EXPECT_FALSE(cache.Get("radii.a", 1, "v1"));
+	EXPECT_TRUE(cache.Get("radii.a", 2, "v1"));
+	EXPECT_TRUE(cache.Get("radii.b", 1, "v1"));
+
+	// another version of the table drops the entry
+	EXPECT_FALSE(cache.Get("radii.b", 1, "v2"));
+	EXPECT_FALSE(cache.Get("radii.b", 1, "v1"));
+	EXPECT_EQ(cache.Bytes(), 2 * 4 * 2 * sizeof(int));
+
+	// values larger than the budget are not kept
+	cache.Put("radii.c", 1, "v1", MakeRadii(100, 5));
+	EXPECT_FALSE(cache.Get("radii.c", 1, "v1"));
+	EXPECT_EQ(cache.Bytes(), 2 * 4 * 2 * sizeof(int));
+}
+
+TEST(TestRadiiCache, TestPreferPointFetch) {
+	// a side 16 grid has 1024 squares
+	EXPECT_TRUE(processing::PreferPointFetch(1, 16));
+	EXPECT_TRUE(processing::PreferPointFetch(31, 16));
+	EXPECT_FALSE(processing::PreferPointFetch(32, 16));
+	EXPECT_FALSE(processing::PreferPointFetch(1024, 16));
+}
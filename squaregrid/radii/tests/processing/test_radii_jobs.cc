@@ -0,0 +1,102 @@
+#include <map>
+#include <sstream>
+#include <string>
+#include <tuple>
+#include <vector>
+
+#include <gtest/gtest.h>
+
+#include "utils/common.h"
+#include "grids/grid_metadata.h"
+#include "processing/radii_jobs.h"
+#include "processing/radii_update.h"
+
+using utils::GeoCoords;
+
+namespace {
+
+// Rows of _FormatRadiiJobRows by square id, checking their grid id.
+std::map< int, std::vector<int> > ParseRows(const std::string &rows, int grid_id) {
+	std::map< int, std::vector<int> > result;
+	std::istringstream lines(rows);
+	std::string line;
+	while (std::getline(lines, line)) {
+		std::istringstream fields(line);
+		int city_id, square_id, value;
+		fields >> city_id >> square_id;
+		EXPECT_EQ(city_id, grid_id);
+		auto &values = result[square_id];
+		while (fields >> value) values.push_back(value);
+	}
+	return result;
+}
+
+}  // namespace
+
+TEST(TestRadiiJobs, TestPlanRadiiJobs) {
+	std::vector<grids::GridMetadata> grids = {
+		grids::GridMetadata(9., 17, 9., 17., 4., 4., 1, "a", "b", 5),
+		grids::GridMetadata(13., 21., 13., 21., 4., 4., 1, "c", "d", 8),
+	};
+	std::vector< std::pair< GeoCoords, std::pair<int, int> > > values = {
+		std::make_pair(GeoCoords{10., 10.}, std::make_pair(0, 1)),
+		std::make_pair(GeoCoords{15., 15.}, std::make_pair(0, 1)),
+		std::make_pair(GeoCoords{15., 15.}, std::make_pair(1, 1)),
+		std::make_pair(GeoCoords{20., 14.}, std::make_pair(1, 1)),
+		std::make_pair(GeoCoords{20., 20.}, std::make_pair(1, 1)),
+		// outside all the grids
+		std::make_pair(GeoCoords{50., 50.}, std::make_pair(0, 1)),
+	};
+	auto jobs = processing::_PlanRadiiJobs(
+			values, grids,
+			[](int layer, const grids::GridMetadata &grid) {
+				return std::to_string(layer) + ":" + std::to_string(grid.GetId());
+			},
+			{"radii.first", "radii.second"});
+
+	// (layer, grid index, points)
+	std::vector< std::tuple<int, int, int> > expected = {
+		std::make_tuple(0, 0, 2), std::make_tuple(0, 1, 1),
+		std::make_tuple(1, 0, 1), std::make_tuple(1, 1, 3),
+	};
+	ASSERT_EQ(jobs.size(), expected.size());
+	for (size_t i = 0; i < jobs.size(); ++i) {
+		int layer = std::get<0>(expected[i]);
+		const auto &grid = grids[std::get<1>(expected[i])];
+		EXPECT_EQ(jobs[i].city_id, grid.GetId());
+		EXPECT_EQ(jobs[i].output_table, layer ? "radii.second" : "radii.first");
+		EXPECT_EQ(
+				jobs[i].data_query,
+				std::to_string(layer) + ":" + std::to_string(grid.GetId()));
+		EXPECT_EQ(
+				jobs[i].cost,
+				processing::EstimateRadiiJobCost(std::get<2>(expected[i]), grid));
+	}
+}
+
+TEST(TestRadiiJobs, TestJobRowsMatchDelta) {
+	int side = 6, radii = 3;
+	grids::GridMetadata grid(0., 12., 0., 12., 1., 1., side, "a", "b", 7);
+	std::vector< std::pair<GeoCoords, int> > values = {
+		std::make_pair(GeoCoords{1.5, 1.5}, 1),
+		std::make_pair(GeoCoords{5.5, 6.5}, 2),
+		std::make_pair(GeoCoords{5.5, 6.5}, 1),
+		std::make_pair(GeoCoords{11.5, 3.5}, 4),
+		std::make_pair(GeoCoords{40., 40.}, 1),
+	};
+	std::string rows;
+	EXPECT_TRUE(processing::_FormatRadiiJobRows(
+				values, grid, radii, false, 0, processing::RadiiEngine::kAuto, &rows));
+	// ring sums of all the points are their delta against an empty grid
+	auto expected = processing::_CalculateRadiiDelta(values, grid, radii);
+	EXPECT_FALSE(expected.empty());
+	EXPECT_EQ(ParseRows(rows, grid.GetId()), expected);
+
+	values.push_back(std::make_pair(GeoCoords{1.5, 1.5}, 1 << 15));
+	rows.clear();
+	EXPECT_FALSE(processing::_FormatRadiiJobRows(
+				values, grid, radii, false, 0, processing::RadiiEngine::kAuto, &rows));
+	EXPECT_EQ(
+			ParseRows(rows, grid.GetId()),
+			processing::_CalculateRadiiDelta(values, grid, radii));
+}
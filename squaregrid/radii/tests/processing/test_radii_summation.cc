@@ -1,3 +1,4 @@
+#include <algorithm>
 #include <vector>
 
 #include <gtest/gtest.h>
@@ -6,6 +7,7 @@
 #include "grids/grid_metadata.h"
 #include "processing/data_grid.h"
 #include "processing/radii_summation.h"
+#include "utils/helpers.h"
 
 TEST(TestRadiiSummation, TestCalculateRadii) {
 	int n = 4, radii = 2;
@@ -42,6 +44,150 @@ TEST(TestRadiiSummation, TestCalculateRadii) {
 	processing::CalculateRadii(grid, radii, &result, false);
 	ASSERT_EQ(result.size(), radii + 1);
 	for (int it = 0; it <= radii; ++it) {
-		EXPECT_EQ(result[it].data(), expected_result[it]);
+		EXPECT_EQ(result[it].ToVector(), expected_result[it]);
+	}
+}
+
+TEST(TestRadiiSummation, TestPrefixSumsMatchStencil) {
+	int n = 23, radii = 9;
+	processing::DataGrid<int> grid(n, n);
+	processing::DataGrid< utils::Averager<int> > avg_grid(n, n);
+	unsigned seed = 17;
+	for (int i = 0; i < n; ++i) {
+		for (int j = 0; j < n; ++j) {
+			seed = seed * 1103515245 + 12345;
+			grid[i][j] = (seed >> 16) % 100;
+			if (grid[i][j] % 3 == 0) {
+				avg_grid[i][j] = utils::Averager<int>(grid[i][j]);
+			}
+		}
+	}
+	for (bool cumulative : {false, true}) {
+		std::vector< processing::DataGrid<int> > expected, result;
+		processing::CalculateRadiiStencil(grid, radii, &expected, cumulative);
+		processing::CalculateRadiiPrefixSums(grid, radii, &result, cumulative);
+		ASSERT_EQ(result.size(), radii + 1);
+		for (int it = 0; it <= radii; ++it) {
+			EXPECT_EQ(result[it].ToVector(), expected[it].ToVector());
+		}
+
+		std::vector< processing::DataGrid< utils::Averager<int> > > avg_expected;
+		std::vector< processing::DataGrid< utils::Averager<int> > > avg_result;
+		processing::CalculateRadiiStencil(avg_grid, radii, &avg_expected, cumulative);
+		processing::CalculateRadii(avg_grid, radii, &avg_result, cumulative);
+		ASSERT_EQ(avg_result.size(), radii + 1);
+		for (int it = 0; it <= radii; ++it) {
+			for (int i = 0; i < n; ++i) {
+				for (int j = 0; j < n; ++j) {
+					EXPECT_EQ(avg_result[it][i][j].sum, avg_expected[it][i][j].sum);
+					EXPECT_EQ(avg_result[it][i][j].count, avg_expected[it][i][j].count);
+				}
+			}
+		}
+	}
+}
+
+TEST(TestRadiiSummation, TestFFTMatchesStencil) {
+	int n = 19, radii = 7;
+	processing::DataGrid<int> grid(n, n);
+	processing::DataGrid< utils::Averager<int> > avg_grid(n, n);
+	unsigned seed = 29;
+	for (int i = 0; i < n; ++i) {
+		for (int j = 0; j < n; ++j) {
+			seed = seed * 1103515245 + 12345;
+			grid[i][j] = (seed >> 16) % 1000;
+			if (grid[i][j] % 4 == 0) {
+				avg_grid[i][j] = utils::Averager<int>(grid[i][j]);
+			}
+		}
+	}
+	for (bool cumulative : {false, true}) {
+		std::vector< processing::DataGrid<int> > expected, result;
+		processing::CalculateRadiiStencil(grid, radii, &expected, cumulative);
+		processing::CalculateRadii(
+				grid, radii, &result, cumulative, processing::RadiiEngine::kFFT);
+		ASSERT_EQ(result.size(), radii + 1);
+		for (int it = 0; it <= radii; ++it) {
+			EXPECT_EQ(result[it].ToVector(), expected[it].ToVector());
+		}
+
+		std::vector< processing::DataGrid< utils::Averager<int> > > avg_expected;
+		std::vector< processing::DataGrid< utils::Averager<int> > > avg_result;
+		processing::CalculateRadiiStencil(avg_grid, radii, &avg_expected, cumulative);
+		processing::CalculateRadiiFFT(avg_grid, radii, &avg_result, cumulative);
+		ASSERT_EQ(avg_result.size(), radii + 1);
+		for (int it = 0; it <= radii; ++it) {
+			for (int i = 0; i < n; ++i) {
+				for (int j = 0; j < n; ++j) {
+					EXPECT_EQ(avg_result[it][i][j].sum, avg_expected[it][i][j].sum);
+					EXPECT_EQ(avg_result[it][i][j].count, avg_expected[it][i][j].count);
+				}
+			}
+		}
+	}
+}
+
+TEST(TestRadiiSummation, TestBandsMatchWholeGrid) {
+	int n = 21, radii = 6, band = 4;
+	processing::DataGrid<int> grid(n, n);
+	unsigned seed = 41;
+	for (int i = 0; i < n; ++i) {
+		for (int j = 0; j < n; ++j) {
+			seed = seed * 1103515245 + 12345;
+			grid[i][j] = (seed >> 16) % 100;
+		}
+	}
+	for (auto engine : {
+			processing::RadiiEngine::kStencil,
+			processing::RadiiEngine::kPrefixSums,
+			processing::RadiiEngine::kFFT}) {
+		std::vector< processing::DataGrid<int> > expected;
+		processing::CalculateRadiiStencil(grid, radii, &expected, false);
+		for (int row = 0; row < n; row += band) {
+			int row_end = std::min(n, row + band);
+			std::vector< processing::DataGrid<int> > result;
+			processing::CalculateRadiiBand(
+					grid, radii, row, row_end, &result, false, engine);
+			ASSERT_EQ(result.size(), radii + 1);
+			for (int it = 0; it <= radii; ++it) {
+				ASSERT_EQ(result[it].NumRows(), row_end - row);
+				for (int i = row; i < row_end; ++i) {
+					for (int j = 0; j < n; ++j) {
+						EXPECT_EQ(result[it][i - row][j], expected[it][i][j]);
+					}
+				}
+			}
+		}
+	}
+}
+
+TEST(TestRadiiSummation, TestInterleavedChannels) {
+	int n = 13, m = 11, channels = 3, radii = 5;
+	processing::DataGrid<int> grid(n, m * channels);
+	std::vector< processing::DataGrid<int> > layers(
+			channels, processing::DataGrid<int>(n, m));
+	unsigned seed = 53;
+	for (int i = 0; i < n; ++i) {
+		for (int j = 0; j < m; ++j) {
+			for (int c = 0; c < channels; ++c) {
+				seed = seed * 1103515245 + 12345;
+				layers[c][i][j] = grid[i][j * channels + c] = (seed >> 16) % 100;
+			}
+		}
+	}
+	std::vector< processing::DataGrid<int> > result;
+	processing::CalculateRadiiBand(
+			grid, radii, 2, 9, &result, false,
+			processing::RadiiEngine::kAuto, channels);
+	for (int c = 0; c < channels; ++c) {
+		std::vector< processing::DataGrid<int> > expected;
+		processing::CalculateRadiiStencil(layers[c], radii, &expected, false);
+		for (int it = 0; it <= radii; ++it) {
+			for (int i = 2; i < 9; ++i) {
+				for (int j = 0; j < m; ++j) {
+					EXPECT_EQ(result[it][i - 2][j * channels + c], expected[it][i][j]);
+				}
+			}
+		}
 	}
 }
@@ -0,0 +1,65 @@
+#include <map>
+#include <vector>
+
+#include <gtest/gtest.h>
+
+#include "utils/common.h"
+#include "grids/grid_metadata.h"
+#include "processing/data_grid.h"
+#include "processing/grid_forming.h"
+#include "processing/radii_summation.h"
+#include "processing/radii_update.h"
+
+using utils::GeoCoords;
+
+TEST(TestRadiiUpdate, TestDeltaMatchesRecomputation) {
+	int side = 6, radii = 3;
+	grids::GridMetadata grid(0., 12., 0., 12., 1., 1., side, "a", "b", 0);
+	std::vector< std::pair<GeoCoords, int> > before = {
+		std::make_pair(GeoCoords{1.5, 1.5}, 1),
+		std::make_pair(GeoCoords{5.5, 6.5}, 1),
+		std::make_pair(GeoCoords{5.5, 6.5}, 1),
+		std::make_pair(GeoCoords{10.5, 3.5}, 1),
+	};
+	std::vector< std::pair<GeoCoords, int> > after = {
+		std::make_pair(GeoCoords{1.5, 1.5}, 1),
+		std::make_pair(GeoCoords{5.5, 6.5}, 1),
+		std::make_pair(GeoCoords{10.5, 3.5}, 1),
+		std::make_pair(GeoCoords{11.5, 11.5}, 1),
+		std::make_pair(GeoCoords{40., 40.}, 1),
+	};
+	std::vector< std::pair<GeoCoords, int> > changes = {
+		std::make_pair(GeoCoords{5.5, 6.5}, -1),
+		std::make_pair(GeoCoords{11.5, 11.5}, 1),
+		std::make_pair(GeoCoords{40., 40.}, 1),
+	};
+
+	auto full_radii = [&](const std::vector< std::pair<GeoCoords, int> > &data) {
+		processing::DataGrid<int> data_grid(0);
+		processing::FillDataGrid(data, grid, false, 0, &data_grid);
+		std::vector< processing::DataGrid<int> > result;
+		processing::CalculateRadiiStencil(data_grid, radii, &result, false);
+		return result;
+	};
+	auto old_radii = full_radii(before), new_radii = full_radii(after);
+	auto delta = processing::_CalculateRadiiDelta(changes, grid, radii);
+
+	auto ids = grids::GetGridCellsIds(side);
+	int changed = 0;
+	for (int x = 0; x < 2 * side; ++x) {
+		for (int y = 0; y < 2 * side; ++y) {
+			bool differs = false;
+			for (int r = 0; r <= radii; ++r) {
+				differs |= old_radii[r][x][y] != new_radii[r][x][y];
+			}
+			auto it = delta.find(ids[x][y]);
+			ASSERT_EQ(it != delta.end(), differs);
+			if (!differs) continue;
+			++changed;
+			for (int r = 0; r <= radii; ++r) {
+				EXPECT_EQ(old_radii[r][x][y] + it->second[r], new_radii[r][x][y]);
+			}
+		}
+	}
+	EXPECT_EQ(changed, delta.size());
+}
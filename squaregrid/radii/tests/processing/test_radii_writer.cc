@@ -0,0 +1,66 @@
+#include <memory>
+#include <string>
+#include <vector>
+
+#include <gtest/gtest.h>
+
+#include "grids/grid_metadata.h"
+#include "processing/data_grid.h"
+#include "processing/radii_writer.h"
+
+TEST(TestRadiiWriter, TestFormatRadiiRows) {
+	grids::GridMetadata grid(0., 2., 0., 2., 1., 1., 1, "a", "b", 7);
+	auto radii = processing::DataGrid<int>::MakeStack(2, 2, 2);
+	// cell ids of a side 1 grid: {{0, 3}, {1, 2}}
+	radii[0][0][0] = 5;
+	radii[1][0][0] = -1;
+	radii[1][1][1] = 12;
+
+	std::string rows = "header\n";
+	EXPECT_TRUE(processing::_FormatRadiiRows(grid, radii, 0, &rows));
+	EXPECT_EQ(rows, "header\n7\t0\t5\t-1\n7\t2\t0\t12\n");
+
+	radii[0][0][1] = 1 << 15;
+	rows.clear();
+	EXPECT_FALSE(processing::_FormatRadiiRows(grid, radii, 0, &rows));
+	EXPECT_EQ(rows, "7\t0\t5\t-1\n7\t3\t32768\t0\n7\t2\t0\t12\n");
+
+	// the second row of the grid written as a band
+	auto band = processing::DataGrid<int>::MakeStack(2, 1, 2);
+	band[1][0][1] = 3;
+	rows.clear();
+	EXPECT_TRUE(processing::_FormatRadiiRows(grid, band, 1, &rows));
+	EXPECT_EQ(rows, "7\t2\t0\t3\n");
+
+	// the second of two interleaved layers
+	auto layers = processing::DataGrid<int>::MakeStack(2, 2, 4);
+	layers[0][1][2] = 9;
+	layers[1][1][3] = 4;
+	rows.clear();
+	EXPECT_TRUE(processing::_FormatRadiiRows(grid, layers, 0, &rows, 1, 2));
+	EXPECT_EQ(rows, "7\t2\t0\t4\n");
+}
+
+TEST(TestRadiiWriter, TestGridProgress) {
+	grids::GridMetadata grid(0., 2., 0., 2., 1., 1., 1, "a", "b", 7);
+	auto radii = processing::DataGrid<int>::MakeStack(2, 2, 2);
+	radii[0][0][0] = 5;
+	auto empty = processing::DataGrid<int>::MakeStack(2, 2, 2);
+	std::vector<bool> done;
+	{
+		// batches are far from full, so nothing is sent and no pool is needed
+		processing::RadiiWriter<int> writer(nullptr, "t");
+		auto written = std::make_shared<processing::GridProgress>(
+				[&done](bool ok) { done.push_back(ok); });
+		auto skipped = std::make_shared<processing::GridProgress>(
+				[&done](bool ok) { done.push_back(ok); });
+		writer.WriteRadii(grid, radii, written);
+		writer.WriteRadii(grid, empty, skipped);
+		written.reset();
+		skipped.reset();
+		// the rows of the first grid wait in the batch
+		EXPECT_EQ(done, std::vector<bool>({true}));
+	}
+	// and are lost without Flush
+	EXPECT_EQ(done, std::vector<bool>({true, false}));
+}
@@ -0,0 +1,39 @@
+#include <atomic>
+#include <vector>
+
+#include <boost/thread/thread.hpp>
+#include <gtest/gtest.h>
+
+#include "utils/bounded_queue.h"
+
+TEST(TestBoundedQueue, TestProducersAndConsumers) {
+	const int kProducers = 3, kItems = 1000, kCapacity = 2;
+	utils::BoundedQueue<int> queue(kCapacity);
+	std::atomic<long long> sum(0);
+	std::atomic<int> popped(0);
+
+	boost::thread_group consumers, producers;
+	for (int i = 0; i < 2; ++i) {
+		consumers.create_thread([&]() {
+			int value;
+			while (queue.Pop(&value)) {
+				sum += value;
+				++popped;
+			}
+		});
+	}
+	for (int i = 0; i < kProducers; ++i) {
+		producers.create_thread([&]() {
+			for (int j = 1; j <= kItems; ++j) {
+				EXPECT_TRUE(queue.Push(j));
+			}
+		});
+	}
+	producers.join_all();
+	queue.Close();
+	consumers.join_all();
+
+	EXPECT_EQ(popped, kProducers * kItems);
+	EXPECT_EQ(sum, kProducers * kItems * (kItems + 1LL) / 2);
+	EXPECT_FALSE(queue.Push(1));
+}
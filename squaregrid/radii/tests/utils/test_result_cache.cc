@@ -0,0 +1,123 @@
+#include <atomic>
+#include <chrono>
+#include <stdexcept>
+#include <string>
+#include <thread>
+
+#include <boost/filesystem.hpp>
+#include <boost/thread/thread.hpp>
+#include <gtest/gtest.h>
+
+#include "utils/result_cache.h"
+
+namespace {
+
+class TestResultCache : public ::testing::Test {
+	protected:
+		void SetUp() override {
+			directory_ = boost::filesystem::temp_directory_path() /
+				boost::filesystem::unique_path("result-cache-%%%%%%%%");
+		}
+
+		void TearDown() override {
+			boost::filesystem::remove_all(directory_);
+		}
+
+		std::string Directory() const {
+			return directory_.string();
+		}
+
+	private:
+		boost::filesystem::path directory_;
+};
+
+}  // namespace
+
+TEST(TestKeyHasher, TestSequences) {
+	std::string ab = utils::KeyHasher().Add("a").Add("b").Hex();
+	EXPECT_EQ(ab.size(), 64u);
+	EXPECT_EQ(ab, utils::KeyHasher().Add("a").Add("b").Hex());
+	EXPECT_NE(ab, utils::KeyHasher().Add("ab").Hex());
+	EXPECT_NE(ab, utils::KeyHasher().Add("b").Add("a").Hex());
+	EXPECT_NE(
+			utils::KeyHasher().Add(std::vector<int>{1, 2}).Hex(),
+			utils::KeyHasher().Add(std::vector<int>{2, 1}).Hex());
+}
+
+TEST_F(TestResultCache, TestEviction) {
+	utils::ResultCache cache(Directory(), 10);
+	std::string value;
+	cache.Put("a", "1234");
+	cache.Put("b", "5678");
+	EXPECT_TRUE(cache.Get("a", &value));
+	EXPECT_EQ(value, "1234");
+	cache.Put("c", "90");
+	cache.Put("d", "00");
+	// b is the least recently used
+	EXPECT_FALSE(cache.Get("b", &value));
+	EXPECT_TRUE(cache.Get("a", &value));
+	EXPECT_TRUE(cache.Get("d", &value));
+	EXPECT_EQ(cache.Bytes(), 8u);
+	cache.Put("e", "too long value");
+	EXPECT_FALSE(cache.Get("e", &value));
+}
+
+TEST_F(TestResultCache, TestPersistence) {
+	{
+		utils::ResultCache cache(Directory(), 100);
+		cache.Put("a", "value");
+	}
+	utils::ResultCache cache(Directory(), 100);
+	std::string value;
+	EXPECT_TRUE(cache.Get("a", &value));
+	EXPECT_EQ(value, "value");
+	EXPECT_EQ(cache.Bytes(), 5u);
+}
+
+TEST_F(TestResultCache, TestSingleFlight) {
+	utils::ResultCache cache(Directory(), 100);
+	std::atomic<int> computed(0);
+	boost::thread_group threads;
+	for (int i = 0; i < 4; ++i) {
+		threads.create_thread([&]() {
+			std::string value = cache.GetOrCompute("key", [&](std::string *result) {
+				++computed;
+				std::this_thread::sleep_for(std::chrono::milliseconds(50));
+				*result = "value";
+				return true;
+			});
+			EXPECT_EQ(value, "value");
+		});
+	}
+	threads.join_all();
+	EXPECT_EQ(computed, 1);
+
+	std::string value = cache.GetOrCompute("other", [](std::string *result) {
+		*result = "not stored";
+		return false;
+	});
+	EXPECT_EQ(value, "not stored");
+	EXPECT_FALSE(cache.Get("other", &value));
+}
+
+TEST_F(TestResultCache, TestFailures) {
+	utils::ResultCache cache(Directory(), 100);
+	int computed = 0;
+	auto compute = [&](std::string *result) {
+		if (++computed == 1) throw std::runtime_error("failed");
+		*result = "value";
+		return true;
+	};
+	EXPECT_THROW(cache.GetOrCompute("key", compute), std::runtime_error);
+	EXPECT_EQ(cache.GetOrCompute("key", compute), "value");
+	EXPECT_EQ(computed, 2);
+
+	// values which cannot be written are returned, but not kept
+	boost::filesystem::remove_all(Directory());
+	EXPECT_EQ(cache.GetOrCompute("other", compute), "value");
+	EXPECT_EQ(cache.GetOrCompute("other", compute), "value");
+	EXPECT_EQ(computed, 4);
+	std::string value;
+	EXPECT_FALSE(cache.Get("key", &value));
+	EXPECT_EQ(cache.Bytes(), 0u);
+}
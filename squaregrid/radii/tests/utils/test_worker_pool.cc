@@ -0,0 +1,74 @@
+#include <atomic>
+#include <future>
+#include <mutex>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#include <gtest/gtest.h>
+
+#include "utils/worker_pool.h"
+
+TEST(TestWorkerPool, TestParallelismCap) {
+	const int kTasks = 200, kCap = 2;
+	utils::WorkerPool pool(4);
+	std::atomic<int> running(0), max_running(0), done(0);
+	auto batch = pool.NewBatch("client", kCap);
+	for (int i = 0; i < kTasks; ++i) {
+		batch->Add([&]() {
+			int now = ++running;
+			int seen = max_running;
+			while (now > seen && !max_running.compare_exchange_weak(seen, now)) {}
+			std::this_thread::yield();
+			--running;
+			++done;
+		});
+	}
+	batch->Wait();
+	EXPECT_EQ(done, kTasks);
+	EXPECT_LE(max_running, kCap);
+	EXPECT_EQ(pool.GetStats().finished, (size_t) kTasks);
+	EXPECT_EQ(pool.GetStats().queued, 0u);
+}
+
+TEST(TestWorkerPool, TestClientsRoundRobin) {
+	utils::WorkerPool pool(1);
+	std::promise<void> gate;
+	std::shared_future<void> opened = gate.get_future().share();
+	std::mutex order_mutex;
+	std::vector<std::string> order;
+	auto record = [&](const std::string &name) {
+		std::lock_guard<std::mutex> lock(order_mutex);
+		order.push_back(name);
+	};
+
+	auto big = pool.NewBatch("a", 1);
+	big->Add([&]() { opened.wait(); record("a"); });
+	for (int i = 0; i < 5; ++i) {
+		big->Add([&]() { record("a"); });
+	}
+	auto small = pool.NewBatch("b", 1);
+	small->Add([&]() { record("b"); });
+	gate.set_value();
+	small->Wait();
+	big->Wait();
+
+	ASSERT_EQ(order.size(), 7u);
+	EXPECT_EQ(order[0], "a");
+	EXPECT_EQ(order[1], "b");
+}
+
+TEST(TestWorkerPool, TestError) {
+	utils::WorkerPool pool(2);
+	auto batch = pool.NewBatch("client", 2);
+	std::atomic<int> done(0);
+	batch->Add([]() { throw std::runtime_error("failed"); });
+	for (int i = 0; i < 10; ++i) {
+		batch->Add([&]() { ++done; });
+	}
+	EXPECT_THROW(batch->Wait(), std::runtime_error);
+	EXPECT_EQ(done, 10);
+	batch->Add([&]() { ++done; });
+	EXPECT_NO_THROW(batch->Wait());
+	EXPECT_EQ(done, 11);
+}
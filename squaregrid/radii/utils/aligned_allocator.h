@@ -0,0 +1,45 @@
+#pragma once
+
+#include <cstddef>
+#include <new>
+
+namespace utils {
+
+// Cache line size, also wide enough for any SIMD register we target.
+const std::size_t kCacheLineSize = 64;
+
+template<typename DataType, std::size_t Alignment = kCacheLineSize>
+struct AlignedAllocator {
+	public:
+		typedef DataType value_type;
+
+		template<typename OtherType> struct rebind {
+			typedef AlignedAllocator<OtherType, Alignment> other;
+		};
+
+		AlignedAllocator() {}
+
+		template<typename OtherType> AlignedAllocator(
+				const AlignedAllocator<OtherType, Alignment>&) {}
+
+		DataType* allocate(std::size_t count) {
+			return static_cast<DataType*>(::operator new(
+					count * sizeof(DataType), std::align_val_t(Alignment)));
+		}
+
+		void deallocate(DataType *ptr, std::size_t) {
+			::operator delete(ptr, std::align_val_t(Alignment));
+		}
+
+		template<typename OtherType> bool operator == (
+				const AlignedAllocator<OtherType, Alignment>&) const {
+			return true;
+		}
+
+		template<typename OtherType> bool operator != (
+				const AlignedAllocator<OtherType, Alignment>&) const {
+			return false;
+		}
+};
+
+}  // namespace utils
@@ -0,0 +1,61 @@
+#pragma once
+
+#include <condition_variable>
+#include <deque>
+#include <mutex>
+#include <utility>
+
+namespace utils {
+
+// Multi-producer multi-consumer FIFO of limited capacity. Push() blocks while
+// the queue is full, Pop() while it is empty and not closed.
+template<typename DataType> class BoundedQueue {
+	public:
+		explicit BoundedQueue(size_t capacity)
+				: capacity_(capacity), closed_(false) {}
+
+		BoundedQueue(const BoundedQueue&) = delete;
+		BoundedQueue& operator=(const BoundedQueue&) = delete;
+
+		// Returns false if the queue was closed and value was not added.
+		bool Push(DataType value) {
+			std::unique_lock<std::mutex> lock(mutex_);
+			not_full_.wait(lock, [this] {
+				return closed_ || items_.size() < capacity_;
+			});
+			if (closed_) return false;
+			items_.push_back(std::move(value));
+			not_empty_.notify_one();
+			return true;
+		}
+
+		// Returns false once the queue is closed and drained.
+		bool Pop(DataType *value) {
+			std::unique_lock<std::mutex> lock(mutex_);
+			not_empty_.wait(lock, [this] {
+				return closed_ || !items_.empty();
+			});
+			if (items_.empty()) return false;
+			*value = std::move(items_.front());
+			items_.pop_front();
+			not_full_.notify_one();
+			return true;
+		}
+
+		// Wakes up all waiting threads; remaining items can still be popped.
+		void Close() {
+			std::lock_guard<std::mutex> lock(mutex_);
+			closed_ = true;
+			not_full_.notify_all();
+			not_empty_.notify_all();
+		}
+
+	private:
+		size_t capacity_;
+		bool closed_;
+		std::deque<DataType> items_;
+		std::mutex mutex_;
+		std::condition_variable not_full_, not_empty_;
+};
+
+}  // namespace utils
@@ -0,0 +1,100 @@
+#pragma once
+
+#include <condition_variable>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <utility>
+#include <vector>
+
+#include <pqxx/pqxx>
+
+namespace utils {
+
+// Bounded pool of database connections shared between threads. Connections
+// are opened lazily; Acquire() blocks while all of them are in use.
+class ConnectionPool {
+	public:
+		// Returns the connection to the pool when destroyed.
+		class Lease {
+			public:
+				Lease(ConnectionPool *pool, std::unique_ptr<pqxx::connection> conn)
+						: pool_(pool), conn_(std::move(conn)) {}
+
+				Lease(Lease &&other) = default;
+				Lease& operator=(Lease &&other) = delete;
+
+				~Lease() {
+					if (conn_) pool_->Release_(std::move(conn_));
+				}
+
+				pqxx::connection& operator*() const {
+					return *conn_;
+				}
+
+				pqxx::connection* operator->() const {
+					return conn_.get();
+				}
+
+				pqxx::connection* get() const {
+					return conn_.get();
+				}
+
+			private:
+				ConnectionPool *pool_;
+				std::unique_ptr<pqxx::connection> conn_;
+		};
+
+		ConnectionPool(const std::string &connection_string, int size)
+				: connection_string_(connection_string), size_(size), opened_(0) {}
+
+		ConnectionPool(const ConnectionPool&) = delete;
+		ConnectionPool& operator=(const ConnectionPool&) = delete;
+
+		Lease Acquire() {
+			std::unique_lock<std::mutex> lock(mutex_);
+			released_.wait(lock, [this] {
+				return !idle_.empty() || opened_ < size_;
+			});
+			if (!idle_.empty()) {
+				std::unique_ptr<pqxx::connection> conn = std::move(idle_.back());
+				idle_.pop_back();
+				return Lease(this, std::move(conn));
+			}
+			++opened_;
+			lock.unlock();
+			try {
+				return Lease(
+						this, std::make_unique<pqxx::connection>(connection_string_));
+			} catch (...) {
+				lock.lock();
+				--opened_;
+				released_.notify_one();
+				throw;
+			}
+		}
+
+		int Size() const {
+			return size_;
+		}
+
+	private:
+		std::string connection_string_;
+		int size_, opened_;
+		std::vector< std::unique_ptr<pqxx::connection> > idle_;
+		std::mutex mutex_;
+		std::condition_variable released_;
+
+		void Release_(std::unique_ptr<pqxx::connection> conn) {
+			std::lock_guard<std::mutex> lock(mutex_);
+			// broken connections are dropped and reopened on demand
+			if (conn->is_open()) {
+				idle_.push_back(std::move(conn));
+			} else {
+				--opened_;
+			}
+			released_.notify_one();
+		}
+};
+
+}  // namespace utils
@@ -0,0 +1,184 @@
+#pragma once
+
+#include <charconv>
+#include <cmath>
+#include <cstdint>
+#include <string>
+#include <vector>
+
+#include "utils/datamart.pb.h"
+
+namespace utils {
+
+// Row access to DataMartColumn in both the cell and the packed format.
+
+inline bool IsPacked(const DataMartColumn &column) {
+	return column.packed_case() != DataMartColumn::PACKED_NOT_SET;
+}
+
+inline bool IsPacked(const DataMart &mart) {
+	for (const auto &column : mart.columns()) {
+		if (IsPacked(column)) return true;
+	}
+	return false;
+}
+
+inline bool _IsValid(const DataMartColumn &column, int row) {
+	const std::string &validity = column.validity();
+	return (
+			validity.empty() ||
+			(static_cast<unsigned char>(validity[row / 8]) >> (row % 8)) & 1);
+}
+
+// Type of the value in row, DATA_TYPE_NOT_SET if it has none.
+inline DataMartCell::DataTypeCase GetValueType(
+		const DataMartColumn &column, int row) {
+	if (!IsPacked(column)) {
+		return column.cells(row).data_type_case();
+	}
+	if (!_IsValid(column, row)) return DataMartCell::DATA_TYPE_NOT_SET;
+	switch (column.packed_case()) {
+		case DataMartColumn::kIntValues:
+			return DataMartCell::kIntVal;
+		case DataMartColumn::kFloatValues:
+			return DataMartCell::kFloatVal;
+		default:
+			return DataMartCell::kStrVal;
+	}
+}
+
+inline int64_t GetIntValue(const DataMartColumn &column, int row) {
+	if (!IsPacked(column)) return column.cells(row).int_val();
+	return column.int_values().values(row);
+}
+
+inline double GetFloatValue(const DataMartColumn &column, int row) {
+	if (!IsPacked(column)) return column.cells(row).float_val();
+	return column.float_values().values(row);
+}
+
+inline const std::string& GetStrValue(const DataMartColumn &column, int row) {
+	if (!IsPacked(column)) return column.cells(row).str_val();
+	const auto &values = column.str_values();
+	return values.dictionary(values.indices(row));
+}
+
+// Type of the values of column, of its first value in the cell format.
+inline DataMartCell::DataTypeCase GetColumnType(const DataMartColumn &column) {
+	switch (column.packed_case()) {
+		case DataMartColumn::kIntValues:
+			return DataMartCell::kIntVal;
+		case DataMartColumn::kFloatValues:
+			return DataMartCell::kFloatVal;
+		case DataMartColumn::kStrValues:
+			return DataMartCell::kStrVal;
+		default:
+			break;
+	}
+	for (const auto &cell : column.cells()) {
+		if (cell.data_type_case() != DataMartCell::DATA_TYPE_NOT_SET) {
+			return cell.data_type_case();
+		}
+	}
+	return DataMartCell::DATA_TYPE_NOT_SET;
+}
+
+// SQL type for the values of column, text if it has none.
+inline std::string GetSqlType(const DataMartColumn &column) {
+	switch (GetColumnType(column)) {
+		case DataMartCell::kIntVal:
+			return "bigint";
+		case DataMartCell::kFloatVal:
+			return "float";
+		default:
+			return "text";
+	}
+}
+
+template<typename T> void _AppendCopyNumber(T value, std::string *out) {
+	if (std::isnan(value)) {
+		out->append("NaN");
+	} else if (std::isinf(value)) {
+		out->append(value > 0 ? "Infinity" : "-Infinity");
+	} else {
+		char buffer[32];
+		char *end = std::to_chars(buffer, buffer + sizeof(buffer), value).ptr;
+		out->append(buffer, end);
+	}
+}
+
+inline void _AppendCopyText(const std::string &value, std::string *out) {
+	for (char c : value) {
+		switch (c) {
+			case '\\':
+				out->append("\\\\");
+				break;
+			case '\t':
+				out->append("\\t");
+				break;
+			case '\n':
+				out->append("\\n");
+				break;
+			case '\r':
+				out->append("\\r");
+				break;
+			default:
+				out->push_back(c);
+		}
+	}
+}
+
+// Appends the value of row to out in the COPY text format, \N if it has none.
+inline void AppendCopyValue(
+		const DataMartColumn &column, int row, std::string *out) {
+	switch (GetValueType(column, row)) {
+		case DataMartCell::kIntVal:
+			_AppendCopyNumber(GetIntValue(column, row), out);
+			break;
+		case DataMartCell::kFloatVal:
+			// cells hold floats, printed shortest as such
+			if (IsPacked(column)) {
+				_AppendCopyNumber(column.float_values().values(row), out);
+			} else {
+				_AppendCopyNumber(column.cells(row).float_val(), out);
+			}
+			break;
+		case DataMartCell::kStrVal:
+			_AppendCopyText(GetStrValue(column, row), out);
+			break;
+		default:
+			out->append("\\N");
+	}
+}
+
+// Fills column with integer values in the given format. Rows with valid
+// unset have no value.
+inline void SetIntValues(
+		const std::vector<int64_t> &values, const std::vector<bool> &valid,
+		bool packed, DataMartColumn *column) {
+	int rows = values.size();
+	if (!packed) {
+		for (int i = 0; i < rows; ++i) {
+			auto *cell = column->add_cells();
+			if (valid.empty() || valid[i]) cell->set_int_val(values[i]);
+		}
+		return;
+	}
+	auto *packed_values = column->mutable_int_values()->mutable_values();
+	packed_values->Reserve(rows);
+	for (int i = 0; i < rows; ++i) {
+		packed_values->Add(values[i]);
+	}
+	bool all_valid = true;
+	for (bool v : valid) {
+		all_valid &= v;
+	}
+	if (all_valid) return;
+	std::string validity((rows + 7) / 8, '\0');
+	for (int i = 0; i < rows; ++i) {
+		if (valid[i]) validity[i / 8] |= 1 << (i % 8);
+	}
+	column->set_validity(validity);
+}
+
+}  // namespace utils
@@ -3,30 +3,87 @@ import numpy
 
 from utils.datamart_pb2 import DataMart
 
-def create_datamart_from_df(df) -> DataMart:
+# Rows per message of the streaming RPCs
+CHUNK_ROWS = 50000
+
+def _is_int(dtype):
+	return dtype == numpy.int32 or dtype == numpy.int64
+
+def _is_float(dtype):
+	return dtype == numpy.float32 or dtype == numpy.float64
+
+def is_packed(mart) -> bool:
+	return any(col.WhichOneof('packed') is not None for col in mart.columns)
+
+
+def create_datamart_from_df(df, packed=False) -> DataMart:
+	"""With packed every column is sent as one typed array instead of a
+	message per cell, which is much faster for large frames."""
 	result = DataMart()
 	result.nrows = len(df)
 	for col in df.columns:
 		column = result.columns.add()
 		column.name = col
+		if packed:
+			if _is_int(df[col].dtype):
+				column.int_values.values.extend(df[col].values.astype(numpy.int64))
+			elif _is_float(df[col].dtype):
+				column.float_values.values.extend(df[col].values.astype(numpy.float64))
+			else:
+				codes, uniques = pandas.factorize(
+						numpy.asarray(df[col], dtype=object).astype(str))
+				column.str_values.dictionary.extend(uniques)
+				column.str_values.indices.extend(codes.astype(numpy.int32))
+			continue
 		for val in df[col]:
 			cell = column.cells.add()
-			if df[col].dtype == numpy.int32 or df[col].dtype == numpy.int64:
+			if _is_int(df[col].dtype):
 				cell.int_val = val
-			elif df[col].dtype == numpy.float32 or df[col].dtype == numpy.float64:
+			elif _is_float(df[col].dtype):
 				cell.float_val = val
 			else:
 				cell.str_val = str(val)
 	return result
 
 
+def iter_datamart_chunks(df, chunk_rows=CHUNK_ROWS, packed=True):
+	"""Marts of consecutive chunk_rows rows of df, at least one even if df is
+	empty."""
+	for begin in range(0, max(len(df), 1), chunk_rows):
+		yield create_datamart_from_df(
+				df.iloc[begin:begin + chunk_rows], packed=packed)
+
+
+def _read_packed_column(col, nrows):
+	kind = col.WhichOneof('packed')
+	if kind == 'int_values':
+		values = numpy.array(col.int_values.values, dtype=numpy.int64)
+		missing = 0
+	elif kind == 'float_values':
+		values = numpy.array(col.float_values.values, dtype=numpy.float64)
+		missing = 0.
+	else:
+		dictionary = numpy.array(list(col.str_values.dictionary) + [''], dtype=object)
+		indices = numpy.array(col.str_values.indices, dtype=numpy.int64)
+		values = dictionary[numpy.where(indices < 0, len(dictionary) - 1, indices)]
+		missing = ''
+	if len(col.validity) > 0:
+		valid = numpy.unpackbits(
+				numpy.frombuffer(col.validity, dtype=numpy.uint8),
+				bitorder='little')[:nrows].astype(bool)
+		values[~valid] = missing
+	return values
+
+
 def create_df_from_datamart(mart) -> pandas.DataFrame:
 	if mart.nrows == 0:
 		return pandas.DataFrame()
 	dct = dict()
 	for col in mart.columns:
 		col_name = col.name
-		if len(col.cells) > 0:
+		if col.WhichOneof('packed') is not None:
+			dct[col.name] = _read_packed_column(col, mart.nrows)
+		elif len(col.cells) > 0:
 			dtype = col.cells[0].WhichOneof("data_type")
 			if dtype == 'int_val':
 				dct[col.name] = [x.int_val for x in col.cells]
@@ -0,0 +1,95 @@
+#pragma once
+
+#include <cassert>
+#include <cmath>
+#include <complex>
+#include <utility>
+#include <vector>
+
+namespace utils {
+
+typedef std::complex<double> Complex;
+
+// Iterative radix-2 FFT of a fixed power-of-two size.
+class FFTPlan {
+	public:
+		explicit FFTPlan(int size)
+				: size_(size), reversed_(size), roots_(size), inverse_roots_(size) {
+			assert(size > 0 && (size & (size - 1)) == 0);
+			for (int i = 1, j = 0; i < size; ++i) {
+				int bit = size >> 1;
+				for (; j & bit; bit >>= 1) j ^= bit;
+				j ^= bit;
+				reversed_[i] = j;
+			}
+			// roots of the pass with block length len are stored at [len / 2, len)
+			for (int len = 2; len <= size; len <<= 1) {
+				for (int k = 0; k < len / 2; ++k) {
+					double angle = -2 * M_PI * k / len;
+					roots_[len / 2 + k] = Complex(std::cos(angle), std::sin(angle));
+					inverse_roots_[len / 2 + k] = std::conj(roots_[len / 2 + k]);
+				}
+			}
+		}
+
+		int GetSize() const {
+			return size_;
+		}
+
+		void Transform(Complex *data, bool inverse) const {
+			const Complex *roots = inverse ? inverse_roots_.data() : roots_.data();
+			for (int i = 1; i < size_; ++i) {
+				if (i < reversed_[i]) std::swap(data[i], data[reversed_[i]]);
+			}
+			for (int len = 2; len <= size_; len <<= 1) {
+				int half = len / 2;
+				for (int i = 0; i < size_; i += len) {
+					Complex *a = data + i, *b = data + i + half;
+					for (int k = 0; k < half; ++k) {
+						Complex v = b[k] * roots[half + k];
+						b[k] = a[k] - v;
+						a[k] += v;
+					}
+				}
+			}
+			if (inverse) {
+				for (int i = 0; i < size_; ++i) data[i] /= size_;
+			}
+		}
+
+		// In-place 2D transform of a row-major size x size matrix. The spectrum
+		// is kept transposed: this saves a transposition in both directions and
+		// does not matter for pointwise products. All-zero rows are skipped, so
+		// padded inputs are cheap to transform. Only the first output_rows rows
+		// of the result are computed, -1 means all of them.
+		void Transform2D(
+				std::vector<Complex> *data, bool inverse, int output_rows = -1) const {
+			assert((int) data->size() == size_ * size_);
+			TransformRows_(data, inverse, size_);
+			for (int i = 0; i < size_; ++i) {
+				for (int j = i + 1; j < size_; ++j) {
+					std::swap((*data)[i * size_ + j], (*data)[j * size_ + i]);
+				}
+			}
+			TransformRows_(data, inverse, output_rows < 0 ? size_ : output_rows);
+		}
+
+	private:
+		int size_;
+		std::vector<int> reversed_;
+		std::vector<Complex> roots_, inverse_roots_;
+
+		void TransformRows_(
+				std::vector<Complex> *data, bool inverse, int rows) const {
+			for (int i = 0; i < rows; ++i) {
+				Complex *row = data->data() + i * size_;
+				bool empty = true;
+				for (int j = 0; j < size_ && empty; ++j) {
+					empty = row[j] == Complex();
+				}
+				if (!empty) Transform(row, inverse);
+			}
+		}
+};
+
+}  // namespace utils
@@ -1,6 +1,10 @@
+#pragma once
+
 #include <map>
 #include <vector>
 
+#include "utils/common.h"
+
 namespace utils {
 
 template<typename DataType> struct AddableVector {
@@ -44,6 +48,20 @@ template<typename DataType> struct Averager {
 			return result;
 		}
 
+		Averager<DataType>& operator -= (
+				const Averager<DataType> &v) {
+			sum = sum - v.sum;
+			count -= v.count;
+			return *this;
+		}
+
+		Averager<DataType> operator - (
+				const Averager<DataType> &v) const {
+			Averager<DataType> result = *this;
+			result -= v;
+			return result;
+		}
+
 		auto value() const {
 			return sum / count;
 		}
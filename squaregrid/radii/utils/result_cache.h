@@ -0,0 +1,273 @@
+#pragma once
+
+#include <algorithm>
+#include <cstdint>
+#include <ctime>
+#include <exception>
+#include <fstream>
+#include <functional>
+#include <future>
+#include <iterator>
+#include <list>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <sstream>
+#include <string>
+#include <utility>
+#include <vector>
+
+#include <boost/filesystem.hpp>
+#include <openssl/evp.h>
+
+namespace utils {
+
+// SHA-256 of a sequence of values, the key of a computation in ResultCache.
+class KeyHasher {
+	public:
+		KeyHasher() : context_(EVP_MD_CTX_new()) {
+			EVP_DigestInit_ex(context_, EVP_sha256(), nullptr);
+		}
+
+		KeyHasher(const KeyHasher&) = delete;
+		KeyHasher& operator=(const KeyHasher&) = delete;
+
+		~KeyHasher() {
+			EVP_MD_CTX_free(context_);
+		}
+
+		// Every value is preceded by its size, so that different sequences
+		// never hash the same bytes.
+		KeyHasher& Add(const void *data, size_t size) {
+			uint64_t prefix = size;
+			EVP_DigestUpdate(context_, &prefix, sizeof(prefix));
+			EVP_DigestUpdate(context_, data, size);
+			return *this;
+		}
+
+		KeyHasher& Add(const std::string &value) {
+			return Add(value.data(), value.size());
+		}
+
+		template<typename T> KeyHasher& Add(const std::vector<T> &values) {
+			return Add(values.data(), values.size() * sizeof(T));
+		}
+
+		KeyHasher& Add(int64_t value) {
+			return Add(&value, sizeof(value));
+		}
+
+		std::string Hex() {
+			unsigned char digest[EVP_MAX_MD_SIZE];
+			unsigned int size = 0;
+			EVP_DigestFinal_ex(context_, digest, &size);
+			static const char kDigits[] = "0123456789abcdef";
+			std::string hex;
+			for (unsigned int i = 0; i < size; ++i) {
+				hex.push_back(kDigits[digest[i] >> 4]);
+				hex.push_back(kDigits[digest[i] & 15]);
+			}
+			return hex;
+		}
+
+	private:
+		EVP_MD_CTX *context_;
+};
+
+// Thread-safe cache of computed values by key, kept as files of a directory
+// that may outlive the process. The least recently used values are removed
+// once their total size exceeds budget_bytes. A missing value is computed
+// only once even if several threads ask for it at the same time.
+class ResultCache {
+	public:
+		ResultCache(const std::string &directory, size_t budget_bytes)
+				: directory_(directory), budget_bytes_(budget_bytes), bytes_(0) {
+			namespace fs = boost::filesystem;
+			fs::create_directories(directory_);
+			// files left by earlier runs, most recently used first
+			std::vector< std::pair<std::time_t, Entry> > found;
+			for (const auto &file : fs::directory_iterator(directory_)) {
+				if (!fs::is_regular_file(file.path())) continue;
+				if (file.path().extension() == kTemporaryExtension) {
+					// left by an interrupted Put
+					boost::system::error_code error;
+					fs::remove(file.path(), error);
+					continue;
+				}
+				found.emplace_back(
+						fs::last_write_time(file.path()),
+						Entry{file.path().filename().string(), fs::file_size(file.path())});
+			}
+			std::sort(
+					found.begin(), found.end(),
+					[](const std::pair<std::time_t, Entry> &a,
+							const std::pair<std::time_t, Entry> &b) {
+						return a.first > b.first;
+					});
+			std::lock_guard<std::mutex> lock(mutex_);
+			for (const auto &file : found) {
+				lru_.push_back(file.second);
+				entries_[file.second.key] = std::prev(lru_.end());
+				bytes_ += file.second.bytes;
+			}
+			Evict_();
+		}
+
+		ResultCache(const ResultCache&) = delete;
+		ResultCache& operator=(const ResultCache&) = delete;
+
+		// The file of the value is read without holding the cache lock.
+		bool Get(const std::string &key, std::string *value) {
+			namespace fs = boost::filesystem;
+			size_t bytes;
+			{
+				std::lock_guard<std::mutex> lock(mutex_);
+				auto it = entries_.find(key);
+				if (it == entries_.end()) return false;
+				bytes = it->second->bytes;
+				lru_.splice(lru_.begin(), lru_, it->second);
+			}
+			fs::path path = directory_ / key;
+			std::ifstream file(path.string(), std::ios::binary);
+			std::ostringstream content;
+			content << file.rdbuf();
+			if (!file || content.str().size() != bytes) {
+				Forget_(key);
+				return false;
+			}
+			*value = content.str();
+			boost::system::error_code error;
+			fs::last_write_time(path, std::time(nullptr), error);
+			return true;
+		}
+
+		// Value of key, computed by compute and stored unless compute returns
+		// false. Threads asking for a key being computed wait for the result.
+		std::string GetOrCompute(
+				const std::string &key,
+				const std::function<bool(std::string*)> &compute) {
+			std::string value;
+			std::unique_lock<std::mutex> lock(mutex_, std::defer_lock);
+			for (int attempt = 0; ; ++attempt) {
+				if (Get(key, &value)) return value;
+				lock.lock();
+				auto running = in_flight_.find(key);
+				if (running != in_flight_.end()) {
+					std::shared_future<std::string> result = running->second;
+					lock.unlock();
+					return result.get();
+				}
+				// stored by a computation which ended after Get
+				if (attempt == 0 && entries_.count(key)) {
+					lock.unlock();
+					continue;
+				}
+				break;
+			}
+			std::promise<std::string> promise;
+			in_flight_[key] = promise.get_future().share();
+			lock.unlock();
+
+			// the computation is forgotten however it ends, its promise is
+			// settled before
+			struct InFlight {
+				ResultCache *cache;
+				const std::string &key;
+				~InFlight() {
+					std::lock_guard<std::mutex> lock(cache->mutex_);
+					cache->in_flight_.erase(key);
+				}
+			} in_flight{this, key};
+			try {
+				if (compute(&value)) Put(key, value);
+			} catch (...) {
+				promise.set_exception(std::current_exception());
+				throw;
+			}
+			promise.set_value(value);
+			return value;
+		}
+
+		// Values which cannot be written are not kept.
+		void Put(const std::string &key, const std::string &value) {
+			namespace fs = boost::filesystem;
+			if (value.size() > budget_bytes_) return;
+			boost::system::error_code error;
+			fs::path path = directory_ / key;
+			fs::path temporary = fs::unique_path(path.string() + "-%%%%%%%%", error);
+			if (error) return;
+			temporary += kTemporaryExtension;
+			{
+				std::ofstream file(temporary.string(), std::ios::binary);
+				file.write(value.data(), value.size());
+				if (!file) {
+					fs::remove(temporary, error);
+					return;
+				}
+			}
+			fs::rename(temporary, path, error);
+			if (error) {
+				fs::remove(temporary, error);
+				return;
+			}
+
+			std::lock_guard<std::mutex> lock(mutex_);
+			auto it = entries_.find(key);
+			if (it != entries_.end()) {
+				bytes_ -= it->second->bytes;
+				lru_.erase(it->second);
+			}
+			lru_.push_front(Entry{key, value.size()});
+			entries_[key] = lru_.begin();
+			bytes_ += value.size();
+			Evict_();
+		}
+
+		size_t Bytes() const {
+			std::lock_guard<std::mutex> lock(mutex_);
+			return bytes_;
+		}
+
+	private:
+		static constexpr const char *kTemporaryExtension = ".tmp";
+
+		struct Entry {
+			std::string key;
+			size_t bytes;
+		};
+
+		boost::filesystem::path directory_;
+		size_t budget_bytes_, bytes_;
+		std::list<Entry> lru_;
+		std::map<std::string, std::list<Entry>::iterator> entries_;
+		std::map< std::string, std::shared_future<std::string> > in_flight_;
+		mutable std::mutex mutex_;
+
+		// Drops the entry of key after its file could not be read, unless the
+		// file was replaced meanwhile and matches the entry again.
+		void Forget_(const std::string &key) {
+			std::lock_guard<std::mutex> lock(mutex_);
+			auto it = entries_.find(key);
+			if (it == entries_.end()) return;
+			boost::system::error_code error;
+			size_t bytes = boost::filesystem::file_size(directory_ / key, error);
+			if (!error && bytes == it->second->bytes) return;
+			// removed or damaged outside of the cache
+			bytes_ -= it->second->bytes;
+			lru_.erase(it->second);
+			entries_.erase(it);
+		}
+
+		void Evict_() {
+			while (bytes_ > budget_bytes_) {
+				const Entry &entry = lru_.back();
+				boost::system::error_code error;
+				boost::filesystem::remove(directory_ / entry.key, error);
+				bytes_ -= entry.bytes;
+				entries_.erase(entry.key);
+				lru_.pop_back();
+			}
+		}
+};
+
+}  // namespace utils
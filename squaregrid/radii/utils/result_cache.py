@@ -0,0 +1,182 @@
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+def make_key(*parts) -> str:
+	"""SHA-256 of parts, each of them bytes, str or anything with a stable
+	repr."""
+	key = hashlib.sha256()
+	for part in parts:
+		if isinstance(part, str):
+			part = part.encode('utf-8')
+		elif not isinstance(part, bytes):
+			part = repr(part).encode('utf-8')
+		key.update(len(part).to_bytes(8, 'little'))
+		key.update(part)
+	return key.hexdigest()
+
+
+class ResultCache:
+	"""Computed values by key kept as files of a directory that may outlive the
+	process, the least recently used removed beyond budget_bytes. A missing
+	value is computed only once even if several threads ask for it at the same
+	time."""
+
+	def __init__(self, directory, budget_bytes):
+		self.directory_ = directory
+		self.budget_bytes_ = budget_bytes
+		self.lock_ = threading.Lock()
+		self.in_flight_ = dict()
+		self.entries_ = collections.OrderedDict()
+		self.bytes_ = 0
+		os.makedirs(directory, exist_ok=True)
+		files = list()
+		for name in os.listdir(directory):
+			path = os.path.join(directory, name)
+			if name.endswith('.tmp'):
+				os.remove(path)
+			elif os.path.isfile(path):
+				stat = os.stat(path)
+				files.append((stat.st_mtime, name, stat.st_size))
+		for _, name, size in sorted(files):
+			self.entries_[name] = size
+			self.bytes_ += size
+		self.evict_()
+
+	def get(self, key):
+		"""Value of key or None."""
+		with self.lock_:
+			return self.get_(key)
+
+	def get_or_compute(self, key, compute):
+		"""Value of key, computed by compute() if missing. compute returns the
+		value and whether it may be stored."""
+		with self.lock_:
+			value = self.get_(key)
+			if value is not None:
+				return value
+			running = self.in_flight_.get(key)
+			if running is None:
+				running = concurrent.futures.Future()
+				self.in_flight_[key] = running
+				owner = True
+			else:
+				owner = False
+		if not owner:
+			return running.result()
+		try:
+			value, store = compute()
+			if store:
+				self.put(key, value)
+			running.set_result(value)
+			return value
+		except BaseException as e:
+			running.set_exception(e)
+			raise
+		finally:
+			with self.lock_:
+				del self.in_flight_[key]
+
+	def put(self, key, value):
+		if len(value) > self.budget_bytes_:
+			return
+		fd, temporary = tempfile.mkstemp(dir=self.directory_, suffix='.tmp')
+		with os.fdopen(fd, 'wb') as f:
+			f.write(value)
+		os.replace(temporary, os.path.join(self.directory_, key))
+		with self.lock_:
+			self.bytes_ -= self.entries_.pop(key, 0)
+			self.entries_[key] = len(value)
+			self.bytes_ += len(value)
+			self.evict_()
+
+	def get_(self, key):
+		size = self.entries_.get(key)
+		if size is None:
+			return None
+		path = os.path.join(self.directory_, key)
+		try:
+			with open(path, 'rb') as f:
+				value = f.read()
+		except OSError:
+			value = None
+		if value is None or len(value) != size:
+			logging.warning('Cached result %s is missing or damaged' % key)
+			self.bytes_ -= self.entries_.pop(key)
+			return None
+		self.entries_.move_to_end(key)
+		os.utime(path)
+		return value
+
+	def evict_(self):
+		while self.bytes_ > self.budget_bytes_:
+			key, size = self.entries_.popitem(last=False)
+			self.bytes_ -= size
+			try:
+				os.remove(os.path.join(self.directory_, key))
+			except OSError:
+				pass
+
+
+class MemoryCache:
+	"""Values by key kept in memory for ttl seconds after they were computed,
+	the least recently used dropped once the total of size(value) exceeds
+	budget_bytes. Sizes are measured on every access, so values may grow
+	while they are kept. A missing value is computed only once even if several
+	threads ask for it at the same time."""
+
+	def __init__(self, budget_bytes, ttl, size):
+		self.budget_bytes_ = budget_bytes
+		self.ttl_ = ttl
+		self.size_ = size
+		self.lock_ = threading.Lock()
+		self.in_flight_ = dict()
+		# key -> (expiration time, value)
+		self.entries_ = collections.OrderedDict()
+
+	def get_or_compute(self, key, compute):
+		"""Value of key, computed by compute() if missing or expired."""
+		with self.lock_:
+			entry = self.entries_.pop(key, None)
+			if entry is not None and entry[0] > time.monotonic():
+				self.entries_[key] = entry
+				self.evict_()
+				return entry[1]
+			running = self.in_flight_.get(key)
+			if running is None:
+				running = concurrent.futures.Future()
+				self.in_flight_[key] = running
+				owner = True
+			else:
+				owner = False
+		if not owner:
+			return running.result()
+		try:
+			expires = time.monotonic() + self.ttl_
+			value = compute()
+			with self.lock_:
+				self.entries_[key] = (expires, value)
+				self.evict_()
+			running.set_result(value)
+			return value
+		except BaseException as e:
+			running.set_exception(e)
+			raise
+		finally:
+			with self.lock_:
+				del self.in_flight_[key]
+
+	def evict_(self):
+		sizes = [self.size_(value) for _, value in self.entries_.values()]
+		total = sum(sizes)
+		for size in sizes:
+			if total <= self.budget_bytes_:
+				break
+			self.entries_.popitem(last=False)
+			total -= size
@@ -0,0 +1,210 @@
+#pragma once
+
+#include <algorithm>
+#include <chrono>
+#include <condition_variable>
+#include <deque>
+#include <exception>
+#include <functional>
+#include <list>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <utility>
+#include <vector>
+
+namespace utils {
+
+// Fixed set of threads shared by all requests of a service. Each request
+// submits its tasks as a Batch of some client. Clients with runnable tasks
+// are served round-robin and the batches of a client in the order they were
+// created, while at most max_parallel tasks of a batch run at once, so one
+// huge request can neither take all the threads nor starve small ones.
+class WorkerPool {
+	public:
+		struct Stats {
+			size_t queued = 0;
+			int running = 0;
+			size_t finished = 0;
+			// time tasks spent in the queue
+			double mean_wait_ms = 0;
+			double max_wait_ms = 0;
+		};
+
+	private:
+		typedef std::chrono::steady_clock Clock;
+
+		struct Task {
+			std::function<void()> run;
+			Clock::time_point queued_at;
+		};
+
+		struct BatchState {
+			std::string client;
+			int max_parallel;
+			int running = 0;
+			int unfinished = 0;
+			std::deque<Task> pending;
+			std::exception_ptr error;
+			std::condition_variable done;
+		};
+
+	public:
+		// Tasks of one request. The destructor waits for them.
+		class Batch {
+			public:
+				Batch(WorkerPool *pool, std::list<BatchState>::iterator state)
+						: pool_(pool), state_(state) {}
+
+				Batch(const Batch&) = delete;
+				Batch& operator=(const Batch&) = delete;
+
+				~Batch() {
+					std::unique_lock<std::mutex> lock(pool_->mutex_);
+					state_->done.wait(lock, [this] { return state_->unfinished == 0; });
+					pool_->batches_.erase(state_);
+				}
+
+				void Add(std::function<void()> task) {
+					std::lock_guard<std::mutex> lock(pool_->mutex_);
+					state_->pending.push_back(Task{std::move(task), Clock::now()});
+					++state_->unfinished;
+					++pool_->queued_;
+					pool_->ready_.notify_one();
+				}
+
+				// Blocks until all the added tasks are finished and rethrows the
+				// first exception any of them threw.
+				void Wait() {
+					std::unique_lock<std::mutex> lock(pool_->mutex_);
+					state_->done.wait(lock, [this] { return state_->unfinished == 0; });
+					if (state_->error) {
+						std::exception_ptr error = state_->error;
+						state_->error = nullptr;
+						std::rethrow_exception(error);
+					}
+				}
+
+			private:
+				WorkerPool *pool_;
+				std::list<BatchState>::iterator state_;
+		};
+
+		explicit WorkerPool(int threads)
+				: stopped_(false), queued_(0), running_(0), finished_(0),
+				  total_wait_ms_(0), max_wait_ms_(0) {
+			for (int i = 0; i < threads; ++i) {
+				threads_.emplace_back(&WorkerPool::Work_, this);
+			}
+		}
+
+		WorkerPool(const WorkerPool&) = delete;
+		WorkerPool& operator=(const WorkerPool&) = delete;
+
+		// All the batches must be destroyed before the pool.
+		~WorkerPool() {
+			{
+				std::lock_guard<std::mutex> lock(mutex_);
+				stopped_ = true;
+				ready_.notify_all();
+			}
+			for (auto &thread : threads_) {
+				thread.join();
+			}
+		}
+
+		std::unique_ptr<Batch> NewBatch(const std::string &client, int max_parallel) {
+			std::lock_guard<std::mutex> lock(mutex_);
+			batches_.emplace_back();
+			batches_.back().client = client;
+			batches_.back().max_parallel = std::max(max_parallel, 1);
+			return std::unique_ptr<Batch>(new Batch(this, std::prev(batches_.end())));
+		}
+
+		int Threads() const {
+			return threads_.size();
+		}
+
+		Stats GetStats() const {
+			std::lock_guard<std::mutex> lock(mutex_);
+			Stats stats;
+			stats.queued = queued_;
+			stats.running = running_;
+			stats.finished = finished_;
+			stats.mean_wait_ms = finished_ ? total_wait_ms_ / finished_ : 0;
+			stats.max_wait_ms = max_wait_ms_;
+			return stats;
+		}
+
+	private:
+		std::vector<std::thread> threads_;
+		std::list<BatchState> batches_;
+		// client served last, the next one is the first after it by name
+		std::string last_client_;
+		bool stopped_;
+		size_t queued_;
+		int running_;
+		size_t finished_;
+		double total_wait_ms_, max_wait_ms_;
+		mutable std::mutex mutex_;
+		std::condition_variable ready_;
+
+		// First batch of the client next to last_client_ that may run a task.
+		std::list<BatchState>::iterator NextBatch_() {
+			auto next = batches_.end(), first = batches_.end();
+			for (auto it = batches_.begin(); it != batches_.end(); ++it) {
+				if (it->pending.empty() || it->running >= it->max_parallel) continue;
+				if (first == batches_.end() || it->client < first->client) {
+					first = it;
+				}
+				if (it->client > last_client_ &&
+						(next == batches_.end() || it->client < next->client)) {
+					next = it;
+				}
+			}
+			return next != batches_.end() ? next : first;
+		}
+
+		void Work_() {
+			std::unique_lock<std::mutex> lock(mutex_);
+			while (true) {
+				auto batch = batches_.end();
+				ready_.wait(lock, [this, &batch] {
+					batch = NextBatch_();
+					return stopped_ || batch != batches_.end();
+				});
+				if (batch == batches_.end()) return;
+
+				Task task = std::move(batch->pending.front());
+				batch->pending.pop_front();
+				++batch->running;
+				--queued_;
+				++running_;
+				last_client_ = batch->client;
+				double wait_ms = std::chrono::duration<double, std::milli>(
+						Clock::now() - task.queued_at).count();
+				total_wait_ms_ += wait_ms;
+				max_wait_ms_ = std::max(max_wait_ms_, wait_ms);
+
+				lock.unlock();
+				std::exception_ptr error;
+				try {
+					task.run();
+				} catch (...) {
+					error = std::current_exception();
+				}
+				lock.lock();
+
+				if (error && !batch->error) batch->error = error;
+				--batch->running;
+				--running_;
+				++finished_;
+				if (--batch->unfinished == 0) batch->done.notify_all();
+				// the batch may now run another task
+				ready_.notify_one();
+			}
+		}
+};
+
+}  // namespace utils